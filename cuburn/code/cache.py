@@ -0,0 +1,144 @@
+"""
+A persistent, content-addressed cache of compiled device modules.
+"""
+
+import os
+import hashlib
+import tempfile
+import subprocess
+
+# Bump this to invalidate every existing cache entry (e.g. when the meaning
+# of the key changes).
+CACHE_VERSION = '2'
+
+DEFAULT_CACHE_DIR = os.environ.get('CUBURN_CACHE_DIR',
+        os.path.join(os.path.expanduser('~'), '.cache', 'cuburn'))
+DEFAULT_MAX_SIZE = int(os.environ.get('CUBURN_CACHE_SIZE', 256 << 20))
+
+_toolkit_version = None
+
+def toolkit_version():
+    """
+    Return the version banner of the ``nvcc`` on the path, which is what
+    compiles cubins, or an empty string if it can't be run.
+    """
+    global _toolkit_version
+    if _toolkit_version is None:
+        try:
+            _toolkit_version = subprocess.check_output(['nvcc', '--version'],
+                    stderr=subprocess.STDOUT)
+        except (OSError, subprocess.CalledProcessError):
+            _toolkit_version = ''
+    return _toolkit_version
+
+def cache_key(src, opts, arch, toolkit=None):
+    """
+    Return the key under which the cubin for ``src``, compiled with the
+    options ``opts`` for architecture ``arch``, is stored. The key also
+    covers the ``toolkit`` version (by default, `toolkit_version()`), so
+    that upgrading CUDA doesn't leave old cubins being served.
+    """
+    if toolkit is None:
+        toolkit = toolkit_version()
+    h = hashlib.sha1()
+    for part in (CACHE_VERSION, toolkit, arch or '', '\0'.join(opts), src):
+        if isinstance(part, unicode):
+            part = part.encode('utf-8')
+        h.update(part)
+        h.update('\0')
+    return h.hexdigest()
+
+class CubinCache(object):
+    """
+    Stores cubins as files named by their key in the directory ``path``.
+
+    Entries are written to a temporary file and renamed into place, so
+    processes sharing a directory never see a partial cubin. Reading an
+    entry refreshes its modification time, and whenever an entry is added,
+    the least recently used entries are removed until the total size of the
+    cache is below ``max_size`` bytes.
+    """
+    suffix = '.cubin'
+
+    def __init__(self, path=DEFAULT_CACHE_DIR, max_size=DEFAULT_MAX_SIZE):
+        self.path, self.max_size = path, max_size
+        self.hits = self.misses = 0
+
+    def _entry(self, key):
+        return os.path.join(self.path, key + self.suffix)
+
+    def get(self, key):
+        """Return the cubin stored under ``key``, or None."""
+        path = self._entry(key)
+        try:
+            with open(path, 'rb') as fp:
+                cubin = fp.read()
+            os.utime(path, None)
+        except (IOError, OSError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return cubin
+
+    def put(self, key, cubin):
+        """Store ``cubin`` under ``key``, then evict old entries."""
+        if not os.path.isdir(self.path):
+            try:
+                os.makedirs(self.path)
+            except OSError:
+                # Another process may have beaten us to it
+                if not os.path.isdir(self.path):
+                    raise
+        fd, tmp = tempfile.mkstemp(prefix='.tmp-', dir=self.path)
+        try:
+            with os.fdopen(fd, 'wb') as fp:
+                fp.write(cubin)
+            os.rename(tmp, self._entry(key))
+        except:
+            os.unlink(tmp)
+            raise
+        self.evict()
+
+    def entries(self):
+        """Return a list of (mtime, size, path) for every entry."""
+        out = []
+        try:
+            names = os.listdir(self.path)
+        except OSError:
+            return out
+        for name in names:
+            if not name.endswith(self.suffix):
+                continue
+            path = os.path.join(self.path, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            out.append((st.st_mtime, st.st_size, path))
+        return out
+
+    def evict(self):
+        """Remove least recently used entries to fit within max_size."""
+        entries = sorted(self.entries())
+        total = sum(e[1] for e in entries)
+        for mtime, size, path in entries:
+            if total <= self.max_size:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                # Removed concurrently by another process
+                pass
+            total -= size
+
+    def compile(self, src, opts, arch, compiler):
+        """
+        Return the cubin for ``src``, calling ``compiler(src, opts, arch)``
+        and storing its result only on a miss.
+        """
+        key = cache_key(src, opts, arch)
+        cubin = self.get(key)
+        if cubin is None:
+            cubin = compiler(src, opts, arch)
+            self.put(key, cubin)
+        return cubin
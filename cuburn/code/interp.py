@@ -122,10 +122,35 @@ class PrecalcWrapper(PackerWrapper):
     def _code(self, code):
         self.packer.precalc_code.append(code)
 
+# Placeholder source value for rows that have not been packed
+_UNPACKED = object()
+
+class _PackState(object):
+    """
+    The packed arrays for one genome, along with the source value each row
+    was packed from, so that unchanged rows can be skipped on repacking.
+    """
+    def __init__(self, gnm, nrows, width):
+        self.gnm, self.scale = gnm, None
+        self.times = np.empty((nrows, width), 'f4')
+        self.times.fill(1e9)
+        self.knots = np.zeros((nrows, width), 'f4')
+        self.srcs = [_UNPACKED] * nrows
+
+    def copy(self, gnm):
+        other = _PackState.__new__(_PackState)
+        other.gnm, other.scale = gnm, self.scale
+        other.times, other.knots = self.times.copy(), self.knots.copy()
+        other.srcs = list(self.srcs)
+        return other
+
 class GenomePacker(object):
     """
     Packs a genome for use in iteration.
     """
+    # Number of genomes whose packed state is kept for incremental repacking
+    pack_cache_size = 4
+
     def __init__(self, tname, ptr_name, spec):
         """
         Create a new DataPacker.
@@ -154,6 +179,50 @@ class GenomePacker(object):
         self.genome = None
         self.search_rounds = util.DEFAULT_SEARCH_ROUNDS
 
+        self._pack_states = []
+        self.last_repacked = 0
+
+    def __getstate__(self):
+        # Packers are sent to workers along with cubins; the cache would only
+        # bloat the message and pin the genomes.
+        return dict(self.__dict__, _pack_states=[])
+
+    # The state of a finalized packer needed to pack genomes and to
+    # interpolate them on the host, as plain values and as ordered sets
+    _plain_state = ('tname', 'ptr_name', 'search_rounds', 'precalc_code',
+                    '_len', 'packed', 'genome')
+    _set_state = ('packed_direct', 'packed_direct_mag', 'genome_precalc',
+                  'packed_precalc')
+
+    def to_dict(self):
+        """
+        Return the state of a finalized packer as lists, strings and numbers,
+        suitable for JSON encoding. Unlike a pickle, this leaves out the
+        spec, the generated code and the pack cache.
+        """
+        assert self._len is not None, 'to_dict() called before finalize()'
+        out = dict((k, getattr(self, k)) for k in self._plain_state)
+        out.update((k, list(getattr(self, k))) for k in self._set_state)
+        return out
+
+    @classmethod
+    def from_dict(cls, state, spec=specs.anim):
+        """
+        Rebuild a packer from the output of `to_dict`. It packs genomes just
+        as the original did, but can't generate code.
+        """
+        packer = cls(state['tname'], state['ptr_name'], spec)
+        paths = lambda vals: [tuple(p) for p in vals]
+        for k in cls._plain_state:
+            setattr(packer, k, state[k])
+        packer.packed, packer.genome = (paths(state['packed']),
+                                        paths(state['genome']))
+        for k in cls._set_state:
+            oset = getattr(packer, k)
+            for path in paths(state[k]):
+                oset.add(path)
+        return packer
+
     def __len__(self):
         """Length in elements. (*4 for length in bytes.)"""
         assert self._len is not None, 'len() called before finalize()'
@@ -207,18 +276,24 @@ class GenomePacker(object):
     def pack(self, gnm, pool=None):
         """
         Return a packed copy of the genome ready for uploading to the GPU,
-        as two float32 NDArrays for the knot times and values.
+        as two float32 NDArrays for the knot times and values. If ``pool`` is
+        given, they are allocated from it (typically a page-locked pool).
+
+        Packing is incremental. The packer keeps the packed arrays of the
+        last few genomes it saw, keyed by identity, along with the value each
+        row was packed from. Only rows whose value changed are normalized
+        again; a genome not seen before is diffed against the most recent
+        one, which is cheap when they share most values. The number of rows
+        normalized is left in ``last_repacked``.
         """
-        width = 1 << self.search_rounds
-        if pool:
-            times = pool.allocate((len(self.genome), width), 'f4')
-            knots = pool.allocate((len(self.genome), width), 'f4')
-        else:
-            times, knots = np.empty((2, len(self.genome), width), 'f4')
-        times.fill(1e9)
-
+        state = self._pack_state(gnm)
         # TODO: do a nicer job of finding the value of scale
         scale = gnm.get('time', {}).get('duration', 1)
+        if scale != state.scale:
+            state.srcs = [_UNPACKED] * len(self.genome)
+            state.scale = scale
+
+        repacked = 0
         for idx, path in enumerate(self.genome):
             attr = gnm
             for name in path:
@@ -226,11 +301,40 @@ class GenomePacker(object):
                     attr = resolve_spec(specs.anim, path).default
                     break
                 attr = attr[name]
+            # Snapshot lists, so in-place edits are seen as changes
+            src = tuple(attr) if isinstance(attr, (list, np.ndarray)) else attr
+            if src == state.srcs[idx]:
+                continue
             attr = SplineEval.normalize(attr, scale)
-            times[idx,:len(attr[0])] = attr[0]
-            knots[idx,:len(attr[1])] = attr[1]
+            state.times[idx].fill(1e9)
+            state.times[idx,:len(attr[0])] = attr[0]
+            state.knots[idx,:len(attr[1])] = attr[1]
+            state.srcs[idx] = src
+            repacked += 1
+        self.last_repacked = repacked
+
+        if pool:
+            times = pool.allocate(state.times.shape, 'f4')
+            knots = pool.allocate(state.knots.shape, 'f4')
+            times[:], knots[:] = state.times, state.knots
+        else:
+            times, knots = state.times.copy(), state.knots.copy()
         return times, knots
 
+    def _pack_state(self, gnm):
+        states = self._pack_states
+        for i, state in enumerate(states):
+            if state.gnm is gnm:
+                states.insert(0, states.pop(i))
+                return state
+        if states:
+            state = states[0].copy(gnm)
+        else:
+            state = _PackState(gnm, len(self.genome), 1 << self.search_rounds)
+        states.insert(0, state)
+        del states[self.pack_cache_size:]
+        return state
+
     _defs = Template(r"""
 __global__ void interp_{{tname}}(
         {{tname}}* {{ptr_name}},
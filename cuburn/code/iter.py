@@ -2,6 +2,9 @@
 The main iteration loop.
 """
 
+import json
+import hashlib
+
 import variations
 import interp
 from util import Template, devlib, ringbuflib
@@ -416,10 +419,39 @@ def iter_body(cp):
     vars.update(locals())
     return tmpl.substitute(vars)
 
+def kernel_skeleton(gnm):
+    """
+    Reduce an animation to the parts that the iteration code is generated
+    from: the xform IDs, the set of variations in each xform, and whether
+    each xform has a post-affine transform (and likewise for the final
+    xform, if present). Everything else is packed as data.
+
+    ``mkiterlib`` generates its code from this skeleton rather than from the
+    genome itself, so genomes with the same skeleton always produce the same
+    source, parameter layout and compiled module.
+    """
+    def xf(x):
+        out = {'variations': dict((k, {}) for k in x.get('variations', {}))}
+        if 'post_affine' in x:
+            out['post_affine'] = {}
+        return out
+    skel = {'xforms': dict((k, xf(v)) for k, v in gnm['xforms'].items())}
+    if 'final_xform' in gnm:
+        skel['final_xform'] = xf(gnm['final_xform'])
+    return skel
+
+def kernel_key(gnm):
+    """
+    Return a hash identifying the iteration module for ``gnm``. Animations
+    with equal keys may share a compiled module and ``GenomePacker``.
+    """
+    skel = json.dumps(kernel_skeleton(gnm), sort_keys=True)
+    return hashlib.sha1(skel).hexdigest()
+
 def mkiterlib(gnm):
     packer = interp.GenomePacker('iter_params', 'params',
                                  cuburn.genome.specs.anim)
-    cp = packer.view(gnm)
+    cp = packer.view(kernel_skeleton(gnm))
 
     iterbody = iter_body(cp)
     bodies = [iter_xf_body(cp, i, x) for i, x in sorted(cp.xforms.items())]
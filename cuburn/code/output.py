@@ -133,10 +133,16 @@ __global__ void f32_to_yuv444p10(
     rctxs[rb_incr(rb->tail, tid)] = rctx;
 }
 
-// Convert from rgb444 to planar YUV 10-bit, using JPEG full-range primaries.
-// Perform subsampling of chroma using weighted averages.
-__global__ void f32_to_yuv420p10(
-    uint16_t *dst, const float4 *src,
+// Convert from rgb444 to planar YUV 4:2:0, using JPEG full-range primaries.
+// Perform subsampling of chroma using weighted averages. The output is a
+// full-resolution luma plane followed by the two quarter-size chroma planes,
+// with each sample scaled to 'peak'. This is a template, so it has to step
+// outside the "extern C" block added by the compiler.
+}
+
+template <typename T>
+__device__ void f32_to_yuv420p(
+    T *dst, const float4 *src, float peak,
     int gutter, int dstride, int sstride, int height,
     ringbuf *rb, mwc_st *rctxs)
 {
@@ -150,7 +156,7 @@ __global__ void f32_to_yuv420p10(
     int isrc = sstride * (y + gutter) + x + gutter;
     int idst = dstride * y + x;
     float4 in = src[isrc];
-    dst[idst] = dclampf(rctx, 1023.0f, 0.299f      * in.x + 0.587f     * in.y + 0.114f     * in.z);
+    dst[idst] = dclampf(rctx, peak, 0.299f      * in.x + 0.587f     * in.y + 0.114f     * in.z);
 
     // Drop into subsampling mode for chroma components
     if (x * 2 > dstride || y * 2 > height) return;
@@ -182,13 +188,33 @@ __global__ void f32_to_yuv420p10(
     // For this to work, dstride must equal the output frame width
     // and be a multiple of four.
     idst = dstride * height + dstride / 2 * y + x;
-    dst[idst] = dclampf(rctx, 1023.0f, cb / sum + 0.5f);
+    dst[idst] = dclampf(rctx, peak, cb / sum + 0.5f);
     idst += dstride * height / 4;
-    dst[idst] = dclampf(rctx, 1023.0f, cr / sum + 0.5f);
+    dst[idst] = dclampf(rctx, peak, cr / sum + 0.5f);
 
     rctxs[rb_incr(rb->tail, tid)] = rctx;
 }
 
+extern "C" {
+
+__global__ void f32_to_yuv420p8(
+    uint8_t *dst, const float4 *src,
+    int gutter, int dstride, int sstride, int height,
+    ringbuf *rb, mwc_st *rctxs)
+{
+    f32_to_yuv420p(dst, src, 255.0f, gutter, dstride, sstride, height,
+                   rb, rctxs);
+}
+
+__global__ void f32_to_yuv420p10(
+    uint16_t *dst, const float4 *src,
+    int gutter, int dstride, int sstride, int height,
+    ringbuf *rb, mwc_st *rctxs)
+{
+    f32_to_yuv420p(dst, src, 1023.0f, gutter, dstride, sstride, height,
+                   rb, rctxs);
+}
+
 // Convert from rgb444 to planar YUV 10-bit, using JPEG full-range primaries.
 // TODO(strobe): Share more code.
 __global__ void f32_to_yuv444p12(
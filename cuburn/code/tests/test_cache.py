@@ -0,0 +1,85 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from cuburn.code import cache, util
+
+class CubinCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.cache = cache.CubinCache(os.path.join(self.dir, 'c'), 130)
+        self.calls = []
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _compiler(self, src, opts, arch):
+        self.calls.append((src, opts, arch))
+        return 'cubin:' + src
+
+    def test_key(self):
+        key = cache.cache_key('src', ('-O3',), 'sm_35')
+        self.assertEqual(key, cache.cache_key('src', ('-O3',), 'sm_35'))
+        self.assertNotEqual(key, cache.cache_key('src2', ('-O3',), 'sm_35'))
+        self.assertNotEqual(key, cache.cache_key('src', (), 'sm_35'))
+        self.assertNotEqual(key, cache.cache_key('src', ('-O3',), 'sm_30'))
+        # A new toolkit may compile the same source differently
+        self.assertNotEqual(cache.cache_key('src', (), 'sm_35', 'V8.0'),
+                            cache.cache_key('src', (), 'sm_35', 'V9.0'))
+
+    def test_compile_once(self):
+        for i in range(2):
+            cubin = self.cache.compile('a', (), 'sm_35', self._compiler)
+            self.assertEqual(cubin, 'cubin:a')
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+        # A fresh instance should find the entry on disk
+        other = cache.CubinCache(self.cache.path)
+        self.assertEqual(other.get(cache.cache_key('a', (), 'sm_35')),
+                         'cubin:a')
+
+    def test_lru_eviction(self):
+        for i, key in enumerate('abc'):
+            self.cache.put(key, 'x' * 40)
+            os.utime(self.cache._entry(key), (i, i))
+        # Reading 'a' makes 'b' the least recently used entry
+        self.assertEqual(self.cache.get('a'), 'x' * 40)
+        self.cache.put('d', 'x' * 40)
+        self.assertIsNone(self.cache.get('b'))
+        for key in 'acd':
+            self.assertIsNotNone(self.cache.get(key))
+
+    def test_no_partial_files(self):
+        self.cache.put('a', 'data')
+        self.assertEqual(os.listdir(self.cache.path), ['a.cubin'])
+
+    def test_util_compile_hit(self):
+        old = util.cubin_cache
+        util.cubin_cache = self.cache
+        try:
+            src, opts = 'src', util.DEFAULT_CMP_OPTIONS
+            self.cache.put(cache.cache_key(src, opts, 'sm_35'), 'cached')
+            cubin = util.compile('test', src, save=False, arch='sm_35')
+            self.assertEqual(cubin, 'cached')
+        finally:
+            util.cubin_cache = old
+
+    def test_util_compile_save(self):
+        old = util.cubin_cache, util._nvcc, tempfile.tempdir
+        util.cubin_cache, util._nvcc = self.cache, self._compiler
+        tempfile.tempdir = self.dir
+        path = os.path.join(self.dir, 'test_kern')
+        try:
+            util.compile('test', 'src', save=True, arch='sm_35')
+            with open(path + '.cubin') as fp:
+                self.assertEqual(fp.read(), 'cubin:src')
+            # A cache hit writes nothing
+            os.unlink(path + '.cu')
+            os.unlink(path + '.cubin')
+            util.compile('test', 'src', save=True, arch='sm_35')
+            self.assertFalse(os.path.exists(path + '.cu'))
+            self.assertEqual(len(self.calls), 1)
+        finally:
+            util.cubin_cache, util._nvcc, tempfile.tempdir = old
@@ -0,0 +1,98 @@
+import copy
+import json
+import cPickle as pickle
+import unittest
+import numpy as np
+
+from cuburn.code import iter, interp
+from cuburn.code.tests.test_iter import random_anim
+
+class FakePool(object):
+    def __init__(self):
+        self.allocs = 0
+    def allocate(self, shape, dtype):
+        self.allocs += 1
+        return np.empty(shape, dtype)
+
+class IncrementalPackTest(unittest.TestCase):
+    def setUp(self):
+        self.rand = np.random.RandomState(0)
+        self.gnm = random_anim(self.rand, nxf=3)
+        self.packer, lib = iter.mkiterlib(self.gnm)
+
+    def assertPacked(self, gnm, packed):
+        # Compare against a packer that has never seen a genome
+        times, knots = iter.mkiterlib(gnm)[0].pack(gnm)
+        self.assertTrue(np.array_equal(packed[0], times))
+        # Knots past the end of each spline are padding
+        valid = times < 1e9
+        self.assertTrue(np.array_equal(packed[1][valid], knots[valid]))
+
+    def test_unchanged(self):
+        first = self.packer.pack(self.gnm)
+        self.assertEqual(self.packer.last_repacked, len(self.packer.genome))
+        second = self.packer.pack(self.gnm)
+        self.assertEqual(self.packer.last_repacked, 0)
+        self.assertPacked(self.gnm, second)
+        # Returned arrays are not shared with the cache
+        first[0].fill(0)
+        self.assertPacked(self.gnm, self.packer.pack(self.gnm))
+
+    def test_changed_value(self):
+        self.packer.pack(self.gnm)
+        self.gnm['camera']['scale'] = [0.5, 0, 2, 0]
+        self.assertPacked(self.gnm, self.packer.pack(self.gnm))
+        self.assertEqual(self.packer.last_repacked, 1)
+
+    def test_in_place_edit(self):
+        self.gnm['camera']['scale'] = [0.5, 0, 2, 0]
+        self.packer.pack(self.gnm)
+        self.gnm['camera']['scale'][2] = 3
+        self.assertPacked(self.gnm, self.packer.pack(self.gnm))
+        self.assertEqual(self.packer.last_repacked, 1)
+
+    def test_other_genomes(self):
+        self.packer.pack(self.gnm)
+        # An equal copy is diffed against the last genome, and needs nothing
+        same = copy.deepcopy(self.gnm)
+        self.packer.pack(same)
+        self.assertEqual(self.packer.last_repacked, 0)
+
+        # Genomes sharing the kernel are tracked separately
+        other = copy.deepcopy(self.gnm)
+        other['camera']['scale'] = 7
+        for i in range(3):
+            for gnm in (self.gnm, other):
+                self.assertPacked(gnm, self.packer.pack(gnm))
+        self.assertEqual(self.packer.last_repacked, 0)
+
+    def test_duration_repacks_all(self):
+        self.packer.pack(self.gnm)
+        self.gnm['time'] = {'duration': 3}
+        self.assertPacked(self.gnm, self.packer.pack(self.gnm))
+        self.assertEqual(self.packer.last_repacked, len(self.packer.genome))
+
+    def test_pool(self):
+        pool = FakePool()
+        self.packer.pack(self.gnm)
+        self.assertPacked(self.gnm, self.packer.pack(self.gnm, pool))
+        self.assertEqual(pool.allocs, 2)
+
+    def test_pickle_drops_cache(self):
+        self.packer.pack(self.gnm)
+        other = pickle.loads(pickle.dumps(self.packer, -1))
+        self.assertEqual(other._pack_states, [])
+        self.assertEqual(len(self.packer._pack_states), 1)
+        self.assertPacked(self.gnm, other.pack(self.gnm))
+
+    def test_dict_round_trip(self):
+        state = json.loads(json.dumps(self.packer.to_dict()))
+        other = interp.GenomePacker.from_dict(state)
+        self.assertEqual(len(other), len(self.packer))
+        self.assertEqual(other.genome, self.packer.genome)
+        self.assertEqual(list(other.packed_precalc),
+                         list(self.packer.packed_precalc))
+        self.assertPacked(self.gnm, other.pack(self.gnm))
+        # Much smaller than the pickle, which carries the whole spec
+        self.assertLess(len(json.dumps(state)),
+                        len(pickle.dumps(self.packer, -1)))
@@ -0,0 +1,81 @@
+import unittest
+import numpy as np
+
+from cuburn.code import iter
+from cuburn.code.util import assemble_code
+
+VARS = ['linear', 'julia', 'waves', 'perspective', 'pre_blur']
+
+def random_anim(rand, nxf=None):
+    """
+    A random animation, with a random structure drawn from a small space so
+    that collisions are common, and random values.
+    """
+    def spline():
+        if rand.rand() < 0.5:
+            return rand.uniform(-1, 1)
+        n = 2 + 2 * rand.randint(0, 6)
+        return list(rand.uniform(-1, 1, n))
+    def xform():
+        xf = {'weight': spline(), 'color': spline(),
+              'pre_affine': {'angle': spline(), 'offset': {'x': spline()}},
+              'variations': {}}
+        for v in rand.choice(VARS, rand.randint(1, 3), replace=False):
+            xf['variations'][v] = {'weight': spline()}
+        if rand.rand() < 0.5:
+            xf['post_affine'] = {'spread': spline()}
+        return xf
+    nxf = nxf or rand.randint(1, 3)
+    gnm = {'type': 'animation', 'camera': {'scale': spline()},
+           'xforms': dict((str(i), xform()) for i in range(nxf))}
+    if rand.rand() < 0.3:
+        gnm['final_xform'] = xform()
+    return gnm
+
+def source(gnm):
+    packer, lib = iter.mkiterlib(gnm)
+    return assemble_code(lib), tuple(packer.packed), tuple(packer.genome)
+
+class KernelKeyTest(unittest.TestCase):
+    def test_values_do_not_matter(self):
+        rand = np.random.RandomState(0)
+        def perturb(obj):
+            # Replace every spline, changing its knot count
+            if isinstance(obj, dict):
+                return dict((k, perturb(v)) for k, v in obj.items())
+            return list(rand.uniform(-1, 1, 2 * rand.randint(1, 8)))
+        for i in range(10):
+            a = random_anim(rand)
+            b = dict(perturb(a), type='animation')
+            self.assertEqual(iter.kernel_key(a), iter.kernel_key(b))
+            self.assertEqual(source(a), source(b))
+
+    def test_structure_matters(self):
+        base = {'type': 'animation', 'xforms': {
+                    '0': {'variations': {'linear': {'weight': 1}}},
+                    '1': {'variations': {'julia': {'weight': [0, 1]}}}}}
+        keys = set([iter.kernel_key(base)])
+
+        def variant(fn):
+            gnm = {'type': 'animation', 'xforms': dict(
+                (k, dict(v, variations=dict(v['variations'])))
+                for k, v in base['xforms'].items())}
+            fn(gnm)
+            keys.add(iter.kernel_key(gnm))
+        variant(lambda g: g['xforms']['0']['variations'].update(waves={}))
+        variant(lambda g: g['xforms']['1'].update(post_affine={}))
+        variant(lambda g: g.update(final_xform={'variations': {}}))
+        variant(lambda g: g['xforms'].update(x=g['xforms'].pop('1')))
+        variant(lambda g: g['xforms'].pop('1'))
+        self.assertEqual(len(keys), 6)
+
+    def test_equal_keys_equal_source(self):
+        rand = np.random.RandomState(1)
+        by_key, by_src = {}, {}
+        for i in range(60):
+            gnm = random_anim(rand, nxf=rand.randint(1, 3))
+            key, src = iter.kernel_key(gnm), source(gnm)
+            self.assertEqual(by_key.setdefault(key, src), src)
+            self.assertEqual(by_src.setdefault(src, key), key)
+        # Make sure the test actually exercised some collisions
+        self.assertLess(len(by_key), 50)
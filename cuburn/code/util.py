@@ -15,6 +15,9 @@ except ImportError, e:
 import numpy as np
 import tempita
 
+from cache import CubinCache
+from cuburn.writer import write_atomic
+
 fst = lambda (a,b): a
 snd = lambda (a,b): b
 
@@ -65,6 +68,20 @@ class Template(tempita.Template):
     default_namespace = tempita.Template.default_namespace.copy()
 Template.default_namespace.update({'np': np, 'crep': crep})
 
+# Buffer dimensions, as computed by ``calc_dim``.
+Dimensions = namedtuple('Dimensions', 'w h aw ah astride')
+
+def calc_dim(width, height, gutter):
+    """
+    Given a width and height, return a valid set of dimensions which
+    include at least ``gutter`` pixels of padding on each side, and where
+    (acc_width % 32) == 0 and (acc_height % 8) == 0.
+    """
+    awidth = width + 2 * gutter
+    aheight = 8 * int(np.ceil((height + 2 * gutter) / 8.))
+    astride = 32 * int(np.ceil(awidth / 32.))
+    return Dimensions(width, height, awidth, aheight, astride)
+
 # Passive container for device code.
 DevLib = namedtuple('DevLib', 'deps headers decls defs')
 
@@ -88,21 +105,41 @@ def assemble_code(*libs):
 
 DEFAULT_CMP_OPTIONS = ('-use_fast_math',)
 DEFAULT_SAVE_KERNEL = True
+
+# Compiled modules are looked up here before invoking the compiler. Set to
+# None to always compile.
+cubin_cache = CubinCache()
+
+def device_arch():
+    """Return the architecture name of the current context's device."""
+    return 'sm_%d%d' % cuda.Context.get_device().compute_capability()
+
+def _nvcc(src, opts, arch):
+    return pycuda.compiler.compile(src, options=list(opts), arch=arch)
+
 def compile(name, src, opts=DEFAULT_CMP_OPTIONS, save=DEFAULT_SAVE_KERNEL,
             arch=None):
     """
-    Compile a module. Returns a copy of the source (for inspection or
-    display) and the compiled cubin.
+    Compile a module, or fetch it from ``cubin_cache``. Returns the compiled
+    cubin. If ``save`` is set, the source and cubin of modules which have to
+    be compiled are left in the temporary directory for debugging; cached
+    modules are not written out again.
     """
-    dir = tempfile.gettempdir()
-    if save:
-        with open(os.path.join(dir, name + '_kern.cu'), 'w') as fp:
-            fp.write(src)
-    cubin = pycuda.compiler.compile(src, options=list(opts), arch=arch)
-    if save:
-        with open(os.path.join(dir, name + '_kern.cubin'), 'w') as fp:
-            fp.write(cubin)
-    return cubin
+    if arch is None:
+        arch = device_arch()
+    def nvcc(src, opts, arch):
+        # Written whole or not at all, since the dist server's compile pool
+        # may be writing the same module at once
+        path = os.path.join(tempfile.gettempdir(), name + '_kern')
+        if save:
+            write_atomic(path + '.cu', src)
+        cubin = _nvcc(src, opts, arch)
+        if save:
+            write_atomic(path + '.cubin', cubin)
+        return cubin
+    if cubin_cache is not None:
+        return cubin_cache.compile(src, opts, arch, nvcc)
+    return nvcc(src, opts, arch)
 
 class ClsMod(object):
     """
@@ -0,0 +1,276 @@
+"""
+Host-side interpolation of packed genomes. Produces the same ``iter_params``
+records and palette rows as the ``interp_iter_params`` and
+``interp_palette_flat`` device kernels.
+"""
+
+from collections import OrderedDict
+
+import numpy as np
+from numpy import float32 as f32
+
+from cuburn.code.color import YUV_MATRIX
+from cuburn.genome import specs
+from cuburn.genome.util import resolve_spec, palette_decode
+from cuburn.genome.use import eval_splines
+
+import variations
+
+class HostPrecalc(object):
+    """
+    Host analogue of `cuburn.code.interp.PrecalcWrapper`. Reading an
+    attribute returns the interpolated values of that genome parameter (as an
+    array over time samples); ``_set(name, val)`` writes a packed precalc
+    value.
+    """
+    def __init__(self, vals, out, path=()):
+        self._vals, self._out, self._path = vals, out, path
+
+    def __getattr__(self, name):
+        path = self._path + (name,)
+        if path in self._vals:
+            return self._vals[path]
+        return HostPrecalc(self._vals, self._out, path)
+
+    def __getitem__(self, name):
+        return getattr(self, str(name))
+
+    def _set(self, name, val):
+        self._out['_'.join(self._path + (name,))] = val
+
+def precalc_camera(cam, dim):
+    rot = cam.rotation * f32(np.pi / 180)
+    rotsin, rotcos = np.sin(rot), np.cos(rot)
+    cenx, ceny = cam.center.x, cam.center.y
+    scale = cam.scale * f32(dim.w)
+
+    cam._set('xx', scale * rotcos)
+    cam._set('xy', scale * -rotsin)
+    cam._set('xo', scale * (rotsin * ceny - rotcos * cenx) + 0.5 * dim.aw)
+    cam._set('yx', scale * rotsin)
+    cam._set('yy', scale * rotcos)
+    cam._set('yo', scale * -(rotsin * cenx + rotcos * ceny) + 0.5 * dim.ah)
+
+def precalc_xf_affine(px):
+    pri = px.angle * f32(np.pi / 180)
+    spr = px.spread * f32(np.pi / 180)
+    magx, magy = px.magnitude.x, px.magnitude.y
+
+    px._set('xx', magx * np.cos(pri-spr))
+    px._set('yx', -magx * np.sin(pri-spr))
+    px._set('xy', -magy * np.cos(pri+spr))
+    px._set('yy', magy * np.sin(pri+spr))
+    px._set('xo', px.offset.x)
+    px._set('yo', -px.offset.y)
+
+def precalc_densities(cp, xfids):
+    dens = np.array([cp.xforms[n].weight for n in xfids])
+    sums = np.cumsum(dens * (1 / np.sum(dens, axis=0)), axis=0)
+    for n, s in zip(xfids[:-1], sums):
+        cp._set('den_' + n, s)
+
+def _precalc_groups(packer):
+    """
+    Yield the distinct precalculation hunks needed by ``packer``, identified
+    by the path of the object that produced them.
+    """
+    seen = set()
+    for path in packer.packed_precalc:
+        if len(path) == 1:
+            if not path[0].startswith('den_'):
+                raise NotImplementedError('No host precalc for ' + path[0])
+            group = ()
+        else:
+            group = path[:-1]
+        if group not in seen:
+            seen.add(group)
+            yield group
+
+def mag_rows(packer):
+    """
+    Return a bool array marking the rows of ``packer``'s packed splines which
+    are interpolated in the magnitude domain.
+    """
+    ndirect = len(packer.packed_direct)
+    nmag = len(packer.packed_direct_mag)
+    mag = np.zeros(len(packer.genome), bool)
+    mag[ndirect:ndirect+nmag] = True
+    for idx, path in enumerate(packer.genome):
+        if idx >= ndirect + nmag:
+            mag[idx] = resolve_spec(specs.anim, path).interp == 'mag'
+    return mag
+
+def xform_order(packer):
+    """
+    Return the xform ids of ``packer``'s genome in the order the density
+    precalc visits them, which decides which xform has no ``den_`` entry.
+    """
+    return [p[1] for p in packer.genome
+            if len(p) == 3 and p[0] == 'xforms' and p[2] == 'weight']
+
+def eval_genome(packer, times, knots, t):
+    """
+    Evaluate every spline packed for ``packer`` at times ``t``, returning a
+    dict of path to values.
+    """
+    n = len(packer.genome)
+    out = eval_splines(f32(times[:n]), f32(knots[:n]), f32(t),
+                       mag_rows(packer))
+    return dict(zip(packer.genome, out))
+
+def interp_iter_params(packer, times, knots, dim, tstart, tstep, nts):
+    """
+    Compute the ``nts`` temporal samples of ``packer``'s parameter struct,
+    starting at ``tstart`` and spaced by ``tstep``, from the ``times`` and
+    ``knots`` arrays returned by ``packer.pack``. ``dim`` plays the role of
+    the device's ``acc_size`` constant. Returns a record array whose fields
+    are named as in the struct typedef; ``out.view(f32)`` has the layout of
+    the device's ``iter_params`` buffer.
+    """
+    t = f32(tstart) + np.arange(nts, dtype=f32) * f32(tstep)
+    vals = eval_genome(packer, times, knots, t)
+
+    out = np.zeros(nts, [('_'.join(p), f32) for p in packer.packed])
+    for path in list(packer.packed_direct) + list(packer.packed_direct_mag):
+        out['_'.join(path)] = vals[path]
+
+    cp = HostPrecalc(vals, out)
+    for group in _precalc_groups(packer):
+        pc = HostPrecalc(vals, out, group)
+        if group == ():
+            precalc_densities(cp, xform_order(packer))
+        elif group == ('camera',):
+            precalc_camera(pc, dim)
+        elif group[-1] in ('pre_affine', 'post_affine'):
+            precalc_xf_affine(pc)
+        elif group[-2] == 'variations':
+            xf = HostPrecalc(vals, out, group[:-2])
+            variations.var_precalc[group[-1]](pc, xf)
+        else:
+            raise NotImplementedError('No host precalc for %s' % (group,))
+    return out
+
+def check_iter_params(params):
+    """
+    Return the names of the fields of ``params`` (as returned by
+    ``interp_iter_params``) which hold a NaN or infinite value at any
+    temporal sample. A genome which would render correctly returns [].
+    """
+    return [n for n in params.dtype.names
+            if not np.all(np.isfinite(params[n]))]
+
+class PaletteStack(object):
+    """
+    The palettes of one genome, decoded and sorted by time, as uploaded to
+    the device: ``times`` is padded to ``max_knots`` entries with 1e9, and
+    ``rgba`` holds the ``(n, 256, 4)`` palettes. ``yuva`` holds the same
+    palettes converted as ``interp_color`` converts them before blending,
+    with U and V biased into [0, 1].
+
+    ``pinned`` is left for the caller to hang page-locked copies of the
+    arrays on, so that they are allocated once per genome as well.
+    """
+    def __init__(self, palettes, max_knots=32):
+        palsrc = sorted(dict((v[0], v[1:]) for v in palettes).items())
+        if len(palsrc) > max_knots:
+            raise ValueError('Too many palettes (%d > %d)'
+                             % (len(palsrc), max_knots))
+        self.times = np.empty(max_knots, f32)
+        self.times.fill(1e9)
+        self.times[:len(palsrc)] = [t for t, v in palsrc]
+        self.rgba = np.array([palette_decode(v) for t, v in palsrc], f32)
+        self.yuva = self.rgba.copy()
+        self.yuva[...,:3] = np.dot(self.rgba[...,:3], YUV_MATRIX.A.T)
+        self.yuva[...,1:3] += 0.5
+        self.pinned = None
+        self._flat = None
+
+    def __len__(self):
+        return len(self.rgba)
+
+    def blend(self, tstart, tstep, height):
+        """
+        Host version of ``interp_color``, evaluated at ``height`` times
+        starting at ``tstart`` and spaced by ``tstep``. Returns a float32
+        array of ``(height, 256, 4)`` YUVA entries.
+
+        The conversion to YUV is linear, so blending the converted palettes
+        matches the device's convert-then-blend. A genome with one palette
+        gets the same rows at every time, and they're only built once.
+        """
+        if len(self) == 1:
+            if self._flat is None or len(self._flat) < height:
+                self._flat = np.repeat(self.yuva, height, axis=0)
+            return self._flat[:height]
+
+        ptimes, pals = self.times, self.yuva
+        time = f32(tstart) + np.arange(height, dtype=f32) * f32(tstep)
+        idx = np.maximum(np.searchsorted(ptimes, time), 1)
+        tr = ptimes[idx]
+        lf = (tr - time) / (tr - ptimes[idx-1])
+        # As on the device, ignore a right-side palette beyond t=1
+        over = tr > 1
+        lf[over] = 1
+        ridx = np.where(over, idx - 1, np.minimum(idx, len(pals) - 1))
+        lf = lf[:,None,None]
+        return pals[idx-1] * lf + pals[ridx] * (1 - lf)
+
+class PaletteCache(object):
+    """
+    Keeps the `PaletteStack` of the last ``size`` genomes used. Within an
+    animation the palettes never change, so they're decoded once rather than
+    for every frame.
+
+    A genome seen on the last call is matched by identity; others by the
+    contents of their ``palette`` list, which still matches once a genome
+    has been copied or unpickled (as for each task on a worker). Genomes
+    must not have their palettes modified in place after use. Cache
+    performance is tallied in `stats`.
+    """
+    def __init__(self, size=16, max_knots=32):
+        self.size, self.max_knots = size, max_knots
+        self.stacks = OrderedDict()
+        self.stats = dict(hits=0, misses=0)
+        self._last = (None, None)
+
+    def get(self, gnm):
+        last, stack = self._last
+        if last is gnm:
+            self.stats['hits'] += 1
+            return stack
+        key = tuple(tuple(v) for v in gnm['palette'])
+        stack = self.stacks.pop(key, None)
+        if stack is None:
+            self.stats['misses'] += 1
+            stack = PaletteStack(gnm['palette'], self.max_knots)
+        else:
+            self.stats['hits'] += 1
+        self.stacks[key] = stack
+        while len(self.stacks) > self.size:
+            self.stacks.popitem(last=False)
+        self._last = (gnm, stack)
+        return stack
+
+def interp_palette(gnm, tstart, tstep, height, max_knots=32):
+    """
+    Host version of ``interp_palette_flat``. Returns ``height`` rows of 256
+    YUVA palette entries (with U and V biased into [0, 1]) as a float32
+    array, without the device's 8-bit dither quantization.
+    """
+    return PaletteStack(gnm['palette'], max_knots).blend(tstart, tstep,
+                                                          height)
+
+def pack_palette(yuva, noise):
+    """
+    Quantize rows of YUVA palette entries from `PaletteStack.blend` into the
+    ``flatpal`` surface format written by ``interp_palette_flat``. ``noise``
+    holds uniform dither values in [-1, 1] for each of the Y, U and V
+    channels, shaped like ``yuva[...,:3]``. Returns an int32 array with two
+    words per entry.
+    """
+    # Float to unsigned conversion on the device saturates at zero
+    yuv = np.clip(yuva[...,:3] * 255 + 0.49 * noise, 0, 255).astype(np.int32)
+    out = np.empty(yuva.shape[:-1] + (2,), np.int32)
+    out[...,0] = (yuv[...,1] << 18) | yuv[...,2]
+    out[...,1] = (1 << 22) | (yuv[...,0] << 4)
+    return out
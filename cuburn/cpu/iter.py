@@ -0,0 +1,215 @@
+"""
+A vectorized host implementation of the main iteration loop.
+
+This runs the chaos game for a whole population of points at once, using the
+same animation genome, ``GenomePacker`` parameter layout and accumulation
+buffer format as the ``iter`` kernel. It doesn't need CUDA, so it can be used
+to render previews on machines without a GPU, and as a reference for checking
+device output.
+"""
+
+import numpy as np
+from numpy import float32 as f32
+
+from cuburn.code import iter, util
+
+import interp
+import variations
+
+class HostRNG(object):
+    """
+    Vectorized stand-ins for the ``mwc_next`` family of device functions.
+    Each method returns an array of the given shape.
+    """
+    def __init__(self, seed=None):
+        self.rand = np.random.RandomState(seed)
+
+    def next(self, shape):
+        return self.rand.randint(0, 1 << 32, size=shape, dtype=np.uint32)
+
+    def next_01(self, shape):
+        return f32(self.rand.random_sample(shape))
+
+    def next_11(self, shape):
+        return f32(self.rand.random_sample(shape) * 2 - 1)
+
+class ParamView(object):
+    """
+    Read-only access to one temporal sample of a packed parameter record, by
+    the same attribute paths used in the device templates (``pv.weight``,
+    ``px.pre_affine.xx``, and so on).
+    """
+    def __init__(self, row, path=()):
+        self._row, self._path = row, path
+
+    def __getattr__(self, name):
+        path = self._path + (name,)
+        key = '_'.join(path)
+        if key in self._row.dtype.fields:
+            return self._row[key]
+        return ParamView(self._row, path)
+
+    def __getitem__(self, name):
+        return getattr(self, str(name))
+
+def apply_affine(x, y, aff):
+    return aff.xx * x + aff.xy * y + aff.xo, aff.yx * x + aff.yy * y + aff.yo
+
+class HostRenderer(object):
+    """
+    Render the accumulation buffer for a genome on the CPU.
+
+    ``npoints`` is the number of trajectories iterated in parallel; ``fuse``
+    is the number of iterations run on fresh points before accumulation
+    begins.
+    """
+
+    # These match the values in `cuburn.render`, so that host and device
+    # buffers are interchangeable.
+    gutter = 12
+    ntemporal_samples = 1024
+    palette_height = 64
+
+    def __init__(self, gnm, npoints=1<<16, fuse=20, seed=None):
+        self.packer, self.lib = iter.mkiterlib(gnm)
+        self.xfids = interp.xform_order(self.packer)
+        self.has_final = 'final_xform' in gnm
+        self.npoints, self.fuse = npoints, fuse
+        self.rng = HostRNG(seed)
+        self.palettes = interp.PaletteCache()
+        self._index(gnm)
+
+        xfs = gnm['xforms'].values() + [gnm.get('final_xform', {})]
+        missing = set(v for xf in xfs for v in xf.get('variations', {})
+                      if v not in variations.var_funcs)
+        if missing:
+            raise NotImplementedError('No host implementation for: ' +
+                                      ', '.join(sorted(missing)))
+
+    def apply_xf(self, px, x, y, color):
+        """Host equivalent of the generated ``apply_xf_*`` functions."""
+        tx, ty = apply_affine(x, y, px.pre_affine)
+        ox, oy = np.zeros_like(tx), np.zeros_like(ty)
+        var_names, has_post = self._xfinfo[px._path]
+        for name in var_names:
+            pv = px.variations[name]
+            dx, dy = variations.var_funcs[name](tx, ty, pv.weight, pv, px,
+                                                self.rng)
+            ox += dx
+            oy += dy
+        if has_post:
+            ox, oy = apply_affine(ox, oy, px.post_affine)
+        csp = px.color_speed
+        return ox, oy, color * (1 - csp) + px.color * csp
+
+    def iterate(self, gnm, dim, tstart, tstep, nsamps):
+        """
+        Accumulate at least ``nsamps`` samples of ``gnm`` at the temporal
+        samples beginning at ``tstart`` and spaced by ``tstep``, and return
+        the result as a float32 array shaped like the device accumulation
+        buffer, ``(dim.ah, dim.astride, 4)``, holding summed YUV and density.
+        """
+        nts = self.ntemporal_samples
+        times, knots = self.packer.pack(gnm)
+        params = interp.interp_iter_params(self.packer, times, knots, dim,
+                                           tstart, tstep, nts)
+        pal = self.palettes.get(gnm).blend(
+                tstart, tstep * nts / self.palette_height, self.palette_height)
+
+        n = self.npoints
+        x, y = self.rng.next_11(n), self.rng.next_11(n)
+        color = self.rng.next_01(n)
+
+        nrounds = int(np.ceil(nsamps / float(n)))
+        tidxs = np.arange(nrounds) * nts // nrounds
+        nbins = dim.ah * dim.astride
+        acc = np.zeros((nbins, 4), f32)
+        pending = []
+
+        # Like the device, let divergent points go to inf or NaN quietly
+        with np.errstate(all='ignore'):
+            for i in range(self.fuse):
+                x, y, color = self._step(params[tidxs[0]], x, y, color)
+            for tidx in tidxs:
+                row = params[tidx]
+                x, y, color = self._step(row, x, y, color)
+                pending.append(self._plot(row, pal[tidx >> 4], dim,
+                                          x, y, color))
+                if len(pending) * n >= max(nbins, 1 << 20):
+                    self._flush(acc, pending)
+        self._flush(acc, pending)
+        return acc.reshape((dim.ah, dim.astride, 4))
+
+    def render(self, gnm, gprof, tc):
+        """
+        Accumulate one frame, with the same temporal and sample-count
+        calculations as ``RenderManager.queue_frame``.
+        """
+        dim = util.calc_dim(gprof.width, gprof.height, self.gutter)
+        td = gprof.frame_width(tc) / round(gprof.fps * gprof.duration)
+        nsamps = gprof.spp(tc) * dim.w * dim.h
+        return self.iterate(gnm, dim, tc - 0.5 * td,
+                            td / self.ntemporal_samples, nsamps)
+
+    def _index(self, gnm):
+        # Variation order follows the sorted iteration in the templates,
+        # which matters for variations that alter their inputs
+        self._xfinfo = {}
+        xfs = [(('xforms', k), gnm['xforms'][k]) for k in self.xfids]
+        if self.has_final:
+            xfs.append((('final_xform',), gnm['final_xform']))
+        for path, xf in xfs:
+            self._xfinfo[path] = (sorted(xf.get('variations', {})),
+                                  'post_affine' in xf)
+
+    def _step(self, row, x, y, color):
+        # Restart divergent trajectories, as the device does
+        bad = ~np.isfinite(np.abs(x) + np.abs(y))
+        if np.any(bad):
+            nbad = np.count_nonzero(bad)
+            x[bad], y[bad] = self.rng.next_11(nbad), self.rng.next_11(nbad)
+            color[bad] = self.rng.next_01(nbad)
+
+        cp = ParamView(row)
+        xfsel = self.rng.next_01(len(x))
+        sel = np.zeros(len(x), np.int32)
+        for k in self.xfids[:-1]:
+            sel += xfsel > cp['den_' + k]
+
+        ox, oy, ocolor = np.empty_like(x), np.empty_like(y), np.empty_like(x)
+        for i, k in enumerate(self.xfids):
+            idx = np.flatnonzero(sel == i)
+            if not len(idx):
+                continue
+            ox[idx], oy[idx], ocolor[idx] = self.apply_xf(
+                    cp.xforms[k], x[idx], y[idx], color[idx])
+        return ox, oy, ocolor
+
+    def _plot(self, row, pal, dim, x, y, color):
+        cp = ParamView(row)
+        if self.has_final:
+            x, y, color = self.apply_xf(cp.final_xform, x, y, color)
+        cam = cp.camera
+        dither = 0.5 * cam.dither_width * self.rng.next_11(2)
+        cx, cy = apply_affine(x, y, cam)
+        cx += dither[0]
+        cy += dither[1]
+
+        ok = np.isfinite(cx) & np.isfinite(cy)
+        ix = np.rint(cx[ok]).astype(np.int64)
+        iy = np.rint(cy[ok]).astype(np.int64)
+        inb = (ix >= 0) & (ix < dim.astride) & (iy >= 0) & (iy < dim.ah)
+        col = color[ok][inb] * 255 + 0.49 * self.rng.next_11(np.sum(inb))
+        col = np.clip(np.rint(col), 0, 255).astype(np.int32)
+        return iy[inb] * dim.astride + ix[inb], pal[col,:3]
+
+    def _flush(self, acc, pending):
+        if not pending:
+            return
+        idx = np.concatenate([p[0] for p in pending])
+        yuv = np.concatenate([p[1] for p in pending])
+        del pending[:]
+        nbins = len(acc)
+        for c in range(3):
+            acc[:,c] += np.bincount(idx, yuv[:,c], nbins)
+        acc[:,3] += np.bincount(idx, minlength=nbins)
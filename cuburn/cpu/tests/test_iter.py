@@ -0,0 +1,213 @@
+import copy
+import unittest
+import numpy as np
+
+from cuburn.code import util
+from cuburn.code.color import YUV_MATRIX
+from cuburn.genome import convert, util as gutil
+from cuburn.genome.use import SplineEval, eval_splines
+from cuburn.cpu import interp, iter as hiter
+
+def _anim(xforms, pal=None):
+    if pal is None:
+        pal = np.random.RandomState(0).rand(256, 4)
+    node = {'type': 'node', 'palette': gutil.palette_encode(pal),
+            'xforms': xforms}
+    return convert.node_to_anim(None, node, False)
+
+class InterpTest(unittest.TestCase):
+    def test_packed_spline_matches_spline_eval(self):
+        knots = [0.2, 0.5, 0.4, -0.3, 0.3, 1.2, 0.7, 0.9]
+        sp = SplineEval(knots, 1)
+        times = np.empty(8, np.float32)
+        times.fill(1e9)
+        times[:sp.knots.shape[1]] = sp.knots[0]
+        vals = np.zeros(8, np.float32)
+        vals[:sp.knots.shape[1]] = sp.knots[1]
+        t = np.linspace(0, 1, 17).astype(np.float32)
+        expected = [sp(x) for x in t]
+        self.assertTrue(np.allclose(eval_splines(times, vals, t)[0],
+                                    expected, atol=1e-5))
+
+    def test_iter_params(self):
+        gnm = _anim({'0': {'weight': 1, 'variations': {'linear': {'weight': 1}}},
+                     '1': {'weight': 3, 'variations': {'linear': {'weight': 1}}}})
+        rdr = hiter.HostRenderer(gnm)
+        dim = util.calc_dim(320, 180, rdr.gutter)
+        times, knots = rdr.packer.pack(gnm)
+        params = interp.interp_iter_params(rdr.packer, times, knots, dim,
+                                           0, 0.001, 4)
+        self.assertTrue(np.allclose(params['den_0_0'], 0.25))
+        self.assertTrue(np.allclose(params['camera_xo'], 0.5 * dim.aw))
+        self.assertTrue(np.allclose(params['camera_yo'], 0.5 * dim.ah))
+
+    def _animated(self):
+        # Animated direct, magnitude and precalc parameters, with xform ids
+        # whose sorted order differs from their dict order
+        xf = lambda w, a: {
+                'weight': [w, 0, 2 * w, 0],
+                'color_speed': [0.2, 0, 0.5, 0, 0.7, 0.1],
+                'pre_affine': {'angle': [a, 0, a + 90, 0],
+                               'magnitude': {'x': [0.5, 0, 2, 0]}},
+                'variations': {'linear': {'weight': 1},
+                               'julian': {'weight': [0.1, 0, 3, 0],
+                                          'power': 2, 'dist': [1, 0, 3, 0]}}}
+        return {'type': 'animation',
+                'camera': {'rotation': [0, 0, 45, 0], 'scale': [0.25, 0, 1, 0]},
+                'xforms': {'b': xf(1, 10), '10': xf(2, -40), 'a': xf(0.5, 70)}}
+
+    def test_batch_matches_rows(self):
+        gnm = self._animated()
+        rdr = hiter.HostRenderer(gnm)
+        times, knots = rdr.packer.pack(gnm)
+        t = np.linspace(0, 1, 33).astype(np.float32)
+        vals = interp.eval_genome(rdr.packer, times, knots, t)
+        mag = interp.mag_rows(rdr.packer)
+        self.assertTrue(mag.any())
+        for idx, path in enumerate(rdr.packer.genome):
+            expected = eval_splines(times[idx], knots[idx], t, mag[idx])[0]
+            self.assertTrue(np.allclose(vals[path], expected,
+                                        rtol=1e-6, atol=1e-6), path)
+
+    def test_precalc_values(self):
+        gnm = self._animated()
+        rdr = hiter.HostRenderer(gnm)
+        dim = util.calc_dim(640, 360, rdr.gutter)
+        times, knots = rdr.packer.pack(gnm)
+        nts = 16
+        params = interp.interp_iter_params(rdr.packer, times, knots, dim,
+                                           0, 1. / nts, nts)
+        self.assertEqual(interp.check_iter_params(params), [])
+        self.assertEqual(params.view(np.float32).shape,
+                         (nts * len(rdr.packer.packed),))
+
+        t = np.arange(nts) / float(nts)
+        order = interp.xform_order(rdr.packer)
+        self.assertEqual(order, ['10', 'a', 'b'])
+        wts = np.array([[SplineEval(gnm['xforms'][k]['weight'], 1)(x)
+                         for x in t] for k in order])
+        dens = np.cumsum(wts / wts.sum(axis=0), axis=0)
+        for k, den in zip(order[:-1], dens):
+            self.assertTrue(np.allclose(params['den_' + k], den, rtol=1e-5))
+        self.assertNotIn('den_b', params.dtype.names)
+
+        cam = gnm['camera']
+        rot = np.radians([SplineEval(cam['rotation'], 1)(x) for x in t])
+        scale = [SplineEval(cam['scale'], 1, 'mag')(x) * dim.w for x in t]
+        self.assertTrue(np.allclose(params['camera_xx'], scale * np.cos(rot),
+                                    rtol=1e-5))
+        self.assertTrue(np.allclose(params['camera_yx'], scale * np.sin(rot),
+                                    rtol=1e-5))
+
+        pa = gnm['xforms']['a']['pre_affine']
+        ang = np.radians([SplineEval(pa['angle'], 1)(x) for x in t])
+        magx = [SplineEval(pa['magnitude']['x'], 1, 'mag')(x) for x in t]
+        self.assertTrue(np.allclose(params['xforms_a_pre_affine_xx'],
+                                    magx * np.cos(ang - np.radians(45)),
+                                    rtol=1e-4, atol=1e-5))
+
+    def test_check_iter_params(self):
+        gnm = _anim({'0': {'weight': 0, 'variations': {'linear': {'weight': 1}}},
+                     '1': {'weight': 0, 'variations': {'linear': {'weight': 1}}}})
+        rdr = hiter.HostRenderer(gnm)
+        dim = util.calc_dim(320, 180, rdr.gutter)
+        times, knots = rdr.packer.pack(gnm)
+        params = interp.interp_iter_params(rdr.packer, times, knots, dim,
+                                           0, 0.001, 4)
+        self.assertEqual(interp.check_iter_params(params), ['den_0_0'])
+
+class PaletteTest(unittest.TestCase):
+    def _palettes(self, *times):
+        rand = np.random.RandomState(len(times))
+        # The genome stores 8-bit RGB, and no alpha
+        pals = [np.concatenate([rand.randint(0, 256, (256, 3)) / 255.,
+                                np.ones((256, 1))], axis=1) for t in times]
+        gnm = {'palette': [[t] + gutil.palette_encode(p)
+                           for t, p in zip(times, pals)]}
+        return gnm, pals
+
+    def test_blend(self):
+        # Shuffled, to check they're sorted by time
+        gnm, pals = self._palettes(1, 0, 0.5)
+        rows = interp.PaletteStack(gnm['palette']).blend(0, 0.125, 9)
+        def yuv(pal):
+            out = pal.copy()
+            out[:,:3] = np.dot(pal[:,:3], YUV_MATRIX.A.T) + [0, 0.5, 0.5]
+            return out
+        # Rows at each knot, halfway between the first two, and at the end
+        self.assertTrue(np.allclose(rows[0], yuv(pals[1]), atol=1e-6))
+        self.assertTrue(np.allclose(rows[4], yuv(pals[2]), atol=1e-6))
+        self.assertTrue(np.allclose(rows[2], (yuv(pals[1]) + yuv(pals[2])) / 2,
+                                    atol=1e-6))
+        self.assertTrue(np.allclose(rows[8], yuv(pals[0]), atol=1e-6))
+        self.assertTrue(np.allclose(interp.interp_palette(gnm, 0, 0.125, 9),
+                                    rows))
+
+    def test_single(self):
+        gnm, pals = self._palettes(0)
+        stack = interp.PaletteStack(gnm['palette'])
+        self.assertEqual(list(stack.times[:2]), [0, 1e9])
+        rows = stack.blend(0.25, 0.01, 64)
+        self.assertEqual(rows.shape, (64, 256, 4))
+        self.assertTrue(np.all(rows == rows[0]))
+        self.assertTrue(np.allclose(rows[0], stack.yuva[0]))
+        self.assertIs(stack.blend(0.75, 0.01, 32).base, rows.base)
+
+    def test_too_many(self):
+        gnm, pals = self._palettes(0, 0.5, 1)
+        self.assertRaises(ValueError, interp.PaletteStack, gnm['palette'], 2)
+
+    def test_cache(self):
+        cache = interp.PaletteCache(size=2)
+        gnm, pals = self._palettes(0, 1)
+        stack = cache.get(gnm)
+        self.assertIs(cache.get(gnm), stack)
+        # A copy, as unpickled for a new task, shares the decoded stack
+        self.assertIs(cache.get(copy.deepcopy(gnm)), stack)
+        self.assertEqual(cache.stats, dict(hits=2, misses=1))
+        other, pals = self._palettes(0)
+        self.assertIsNot(cache.get(other), stack)
+        self.assertIs(cache.get(gnm), stack)
+        cache.get(self._palettes(0, 0.5, 1)[0])
+        # Least recently used goes first
+        self.assertIs(cache.get(gnm), stack)
+        self.assertIsNot(cache.get(copy.deepcopy(other)), stack)
+        self.assertEqual(cache.stats, dict(hits=4, misses=4))
+
+    def test_pack(self):
+        yuva = np.array([[[0, 0.5, 1, 1], [0.2, 1.1, -0.1, 1]]], np.float32)
+        noise = np.zeros((1, 2, 3))
+        out = interp.pack_palette(yuva, noise)
+        self.assertEqual(out.dtype, np.int32)
+        self.assertEqual(out.tolist(),
+                         [[[(127 << 18) | 255, 1 << 22],
+                           [255 << 18, (1 << 22) | (51 << 4)]]])
+        # Dither rounds up fractions above about a half
+        yuva[0,0,2] = 100.6 / 255
+        self.assertEqual(interp.pack_palette(yuva, noise)[0,0,0],
+                         (127 << 18) | 100)
+        noise[:] = 1
+        self.assertEqual(interp.pack_palette(yuva, noise)[0,0,0],
+                         (127 << 18) | 101)
+
+class IterTest(unittest.TestCase):
+    def test_contraction(self):
+        # Everything collapses onto the origin, which lands at the centre of
+        # the accumulation buffer.
+        pal = np.ones((256, 4)) * [0.25, 0.5, 0.75, 1]
+        gnm = _anim({'0': {'weight': 1, 'variations': {'linear': {'weight': 1}},
+                           'pre_affine': {'magnitude': {'x': 0.5, 'y': 0.5}}}},
+                    pal)
+        rdr = hiter.HostRenderer(gnm, npoints=1024, fuse=40, seed=1)
+        dim = util.calc_dim(64, 48, rdr.gutter)
+        acc = rdr.iterate(gnm, dim, 0.5, 1e-6, 8192)
+
+        den = acc[...,3]
+        self.assertEqual(den.sum(), 8192)
+        cy, cx = np.unravel_index(np.argmax(den), den.shape)
+        self.assertEqual((cy, cx), (dim.ah // 2, dim.aw // 2))
+
+        yuv = np.dot([0.25, 0.5, 0.75], YUV_MATRIX.A.T) + [0, 0.5, 0.5]
+        # The genome stores palettes with 8 bits per channel
+        self.assertTrue(np.allclose(acc[cy,cx,:3] / den[cy,cx], yuv,
+                                    atol=1./255))
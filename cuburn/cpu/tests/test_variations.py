@@ -0,0 +1,311 @@
+"""
+Conformance tests for the host variations. Each device template is translated
+from its CUDA C subset into scalar Python, and evaluated point by point as a
+reference for the vectorized host functions.
+"""
+
+import re
+import unittest
+import numpy as np
+
+from cuburn.code import variations as devvars
+from cuburn.genome.variations import var_params
+from cuburn.cpu import variations
+
+_tok_re = re.compile(r'''
+    (?P<num> (\d+\.\d*|\.\d+|\d+(?=[eE]))([eE][-+]?\d+)?f? | \d+ )
+  | (?P<id> [A-Za-z_]\w* )
+  | (?P<op> [-+*/]= | [=!<>]= | && | \|\| | [-+*/%<>=!?:(),;{}&] )
+  | (?P<ws> \s+ )
+''', re.X)
+
+def tokenize(src):
+    src = re.sub(r'//[^\n]*|/\*.*?\*/', ' ', src, flags=re.S)
+    toks, pos = [], 0
+    while pos < len(src):
+        m = _tok_re.match(src, pos)
+        if not m:
+            raise SyntaxError('Unexpected input: %r' % src[pos:pos+20])
+        pos = m.end()
+        if m.lastgroup == 'num':
+            toks.append(('num', m.group().rstrip('f')))
+        elif m.lastgroup != 'ws':
+            toks.append((m.lastgroup, m.group()))
+    return toks
+
+class Transpiler(object):
+    """
+    Translates the subset of C used by the variation templates (float
+    declarations, assignments, 'if'/'else', ternaries and function calls)
+    into Python source. Every literal becomes a float64, and every binary
+    operation is parenthesized, so C evaluation order and precedence survive
+    the translation.
+    """
+    binops = [('||',), ('&&',), ('&',), ('==', '!='), ('<', '>', '<=', '>='),
+              ('+', '-'), ('*', '/')]
+    pyops = {'||': 'or', '&&': 'and'}
+
+    def __init__(self, src):
+        self.toks, self.pos = tokenize(src), 0
+
+    def peek(self, n=0):
+        if self.pos + n < len(self.toks):
+            return self.toks[self.pos + n][1]
+
+    def take(self, expect=None):
+        tok = self.toks[self.pos][1]
+        if expect is not None and tok != expect:
+            raise SyntaxError('Expected %r, got %r' % (expect, tok))
+        self.pos += 1
+        return tok
+
+    def translate(self):
+        lines = []
+        while self.pos < len(self.toks):
+            lines.extend(self.stmt())
+        return lines
+
+    def indent(self, lines):
+        return ['    ' + l for l in lines] or ['    pass']
+
+    def stmt(self):
+        tok = self.peek()
+        if tok == '{':
+            self.take()
+            lines = []
+            while self.peek() != '}':
+                lines.extend(self.stmt())
+            self.take('}')
+            return lines
+        if tok == ';':
+            self.take()
+            return []
+        if tok == 'if':
+            self.take()
+            self.take('(')
+            cond = self.expr()
+            self.take(')')
+            lines = ['if %s:' % cond] + self.indent(self.stmt())
+            if self.peek() == 'else':
+                self.take()
+                lines += ['else:'] + self.indent(self.stmt())
+            return lines
+        if tok in ('float', 'int'):
+            self.take()
+            lines = []
+            while True:
+                name = self.take()
+                if self.peek() == '=':
+                    self.take()
+                    lines.append('%s = %s' % (name, self.expr()))
+                if self.take() == ';':
+                    return lines
+        name, op = self.take(), self.take()
+        val = self.expr()
+        self.take(';')
+        if op == '=':
+            return ['%s = %s' % (name, val)]
+        return ['%s = (%s %s %s)' % (name, name, op[0], val)]
+
+    def expr(self):
+        cond = self.binary(0)
+        if self.peek() != '?':
+            return cond
+        self.take()
+        a = self.expr()
+        self.take(':')
+        b = self.expr()
+        return '(%s if %s else %s)' % (a, cond, b)
+
+    def binary(self, level):
+        if level == len(self.binops):
+            return self.unary()
+        lhs = self.binary(level + 1)
+        while self.peek() in self.binops[level]:
+            op = self.take()
+            rhs = self.binary(level + 1)
+            if op == '&':
+                lhs = '(int(%s) & int(%s))' % (lhs, rhs)
+            else:
+                lhs = '(%s %s %s)' % (lhs, self.pyops.get(op, op), rhs)
+        return lhs
+
+    def unary(self):
+        tok = self.peek()
+        if tok in ('-', '+', '!'):
+            self.take()
+            return '(%s %s)' % ('not' if tok == '!' else tok, self.unary())
+        if tok == '(' and self.peek(1) in ('int', 'float'):
+            self.take()
+            typ = self.take()
+            self.take(')')
+            val = self.unary()
+            return 'truncf(%s)' % val if typ == 'int' else val
+        return self.primary()
+
+    def primary(self):
+        kind, tok = self.toks[self.pos]
+        self.pos += 1
+        if tok == '(':
+            val = self.expr()
+            self.take(')')
+            return '(%s)' % val
+        if kind == 'num':
+            return '_f(%r)' % float(tok)
+        if self.peek() == '(':
+            self.take()
+            args = []
+            while self.peek() != ')':
+                args.append(self.expr())
+                if self.peek() == ',':
+                    self.take()
+            self.take(')')
+            return '%s(%s)' % (tok, ', '.join(args))
+        return tok
+
+class TemplateRef(object):
+    """
+    Stands in for the packer's parameter wrappers when rendering a template,
+    rendering each parameter as a plain identifier and capturing precalc
+    code.
+    """
+    def __init__(self, path, precalc):
+        self._path, self._precalc_code = path, precalc
+
+    def __getattr__(self, name):
+        return TemplateRef(self._path + (name,), self._precalc_code)
+
+    def __str__(self):
+        return '_'.join(self._path)
+
+    def _precalc(self):
+        return self
+
+    def _code(self, code):
+        self._precalc_code.append(code)
+
+    def _set(self, name):
+        return '_'.join(self._path + (name,))
+
+class Params(object):
+    """Attribute access to a flat dict of parameter paths, with ``_set``."""
+    def __init__(self, vals, path):
+        self._vals, self._path = vals, path
+
+    def __getattr__(self, name):
+        path = self._path + (name,)
+        if path in self._vals:
+            return self._vals[path]
+        return Params(self._vals, path)
+
+    def _set(self, name, val):
+        self._vals[self._path + (name,)] = val
+
+class FakeRNG(object):
+    """
+    Returns a predetermined 32-bit value for each draw. The vectorized
+    functions draw a whole column at a time; the scalar reference draws the
+    same columns one point at a time, in program order.
+    """
+    def __init__(self, table):
+        self.table, self.col = table, 0
+
+    def next(self, shape):
+        self.col += 1
+        return self.table[:,self.col-1]
+
+    def next_01(self, shape):
+        return self.next(shape) * (1.0 / 4294967296.0)
+
+def reference_namespace():
+    ns = dict(_f=np.float64, truncf=np.trunc, isfinite=np.isfinite,
+              fmaxf=np.maximum, max=np.maximum, log2f=np.log2,
+              M_PI=np.pi, M_1_PI=1/np.pi, M_PI_2=np.pi/2, M_2_PI=2/np.pi,
+              M_LOG2E=np.log2(np.e))
+    for name in ('sin cos tan sinh cosh sqrt exp log power arctan2 fmod '
+                 'floor rint copysign arccos').split():
+        ns[name.replace('arc', 'a').replace('power', 'pow') + 'f'] = \
+                getattr(np, name)
+    ns.update(sin=np.sin, cos=np.cos, fabsf=np.abs)
+    return ns
+
+def reference(name, vals, tx, ty, table):
+    """
+    Evaluate the device template for variation ``name`` on each point, with
+    parameters taken from ``vals``, and the ``i``th point's random draws
+    taken from ``table[i]``.
+    """
+    precalc = []
+    pv = TemplateRef(('pv',), precalc)
+    px = TemplateRef(('px',), precalc)
+    code = devvars.var_code[name].substitute(pv=pv, px=px)
+
+    ns = reference_namespace()
+    ns.update(('_'.join(k), v) for k, v in vals.items())
+    for src in precalc:
+        exec '\n'.join(Transpiler(src).translate()) in ns
+
+    body = Transpiler(code).translate()
+    src = '\n'.join(['def apply(tx, ty, w, rctx):', '    ox = oy = _f(0)']
+                    + ['    ' + l for l in body]
+                    + ['    return ox, oy, tx, ty'])
+    exec src in ns
+
+    out = []
+    for i in range(len(tx)):
+        draws = iter(table[i])
+        ns['mwc_next'] = lambda rctx: draws.next()
+        ns['mwc_next_01'] = lambda rctx: draws.next() * (1.0 / 4294967296.0)
+        out.append(ns['apply'](tx[i], ty[i], vals[('pv', 'weight')], None))
+    return np.array(out).T
+
+class VariationConformanceTest(unittest.TestCase):
+    npoints = 64
+
+    def setUp(self):
+        self.rand = np.random.RandomState(1)
+        self.errstate = np.seterr(all='ignore')
+
+    def tearDown(self):
+        np.seterr(**self.errstate)
+
+    def _params(self, name):
+        rand = self.rand
+        vals = {('pv', 'weight'): rand.uniform(0.5, 1.5)}
+        for k in var_params[name]:
+            if k != 'weight':
+                vals[('pv', k)] = rand.uniform(0.3, 2) * rand.choice([-1, 1])
+        for k in ('xx', 'xy', 'xo', 'yx', 'yy', 'yo'):
+            vals[('px', 'pre_affine', k)] = rand.uniform(-1, 1)
+        for k in 'xy':
+            vals[('px', 'pre_affine', 'offset', k)] = rand.uniform(-1, 1)
+        return vals
+
+    def _check(self, name):
+        tx = self.rand.uniform(-2, 2, self.npoints)
+        ty = self.rand.uniform(-2, 2, self.npoints)
+        table = self.rand.randint(0, 1<<32, (self.npoints, 8)).astype(np.uint64)
+        vals = self._params(name)
+        rx, ry, rtx, rty = reference(name, vals, tx, ty, table)
+
+        pv, px = Params(vals, ('pv',)), Params(vals, ('px',))
+        if name in variations.var_precalc:
+            variations.var_precalc[name](pv, px)
+        htx, hty = tx.copy(), ty.copy()
+        hx, hy = variations.var_funcs[name](htx, hty, pv.weight, pv, px,
+                                            FakeRNG(table))
+        hx, hy = hx + np.zeros_like(tx), hy + np.zeros_like(ty)
+
+        for a, b in ((hx, rx), (hy, ry), (htx, rtx), (hty, rty)):
+            np.testing.assert_allclose(a, b.astype(float), rtol=1e-6,
+                                       atol=1e-9, err_msg=name)
+
+    def test_registry_complete(self):
+        self.assertEqual(sorted(variations.var_funcs),
+                         sorted(devvars.var_code))
+
+def _add_test(name):
+    setattr(VariationConformanceTest, 'test_' + name,
+            lambda self: self._check(name))
+for _name in devvars.var_code:
+    _add_test(_name)
@@ -0,0 +1,726 @@
+"""
+Vectorized host implementations of the variations in
+`cuburn.code.variations`.
+"""
+
+import numpy as np
+
+var_funcs = {}
+var_precalc = {}
+
+def var(name, precalc=None):
+    """
+    Register a host variation function under ``name``.
+
+    Each function is called as ``f(tx, ty, w, pv, px, rng)``, where ``tx``
+    and ``ty`` are arrays of post-affine coordinates, ``w`` is the variation
+    weight, and ``pv`` and ``px`` are views of the variation's and xform's
+    packed parameters (as in the device templates). ``rng`` stands in for the
+    device's ``rctx``. Functions return the ``(dx, dy)`` contributions to be
+    added to the output coordinates. As on the device, a few variations
+    modify ``tx`` and ``ty`` in place.
+
+    ``precalc``, if given, is called as ``precalc(pv, px)`` during host
+    parameter interpolation, with views that behave like the device-side
+    precalc wrappers.
+    """
+    def var_(fun):
+        var_funcs[name] = fun
+        if precalc:
+            var_precalc[name] = precalc
+        return fun
+    return var_
+
+def _r2(tx, ty):
+    return tx*tx + ty*ty
+
+def _r(tx, ty):
+    return np.sqrt(tx*tx + ty*ty)
+
+@var('linear')
+def linear(tx, ty, w, pv, px, rng):
+    return w * tx, w * ty
+
+@var('sinusoidal')
+def sinusoidal(tx, ty, w, pv, px, rng):
+    return w * np.sin(tx), w * np.sin(ty)
+
+@var('spherical')
+def spherical(tx, ty, w, pv, px, rng):
+    r2 = w / _r2(tx, ty)
+    return tx * r2, ty * r2
+
+@var('swirl')
+def swirl(tx, ty, w, pv, px, rng):
+    r2 = _r2(tx, ty)
+    c1, c2 = np.sin(r2), np.cos(r2)
+    return w * (c1*tx - c2*ty), w * (c2*tx + c1*ty)
+
+@var('horseshoe')
+def horseshoe(tx, ty, w, pv, px, rng):
+    r = w / _r(tx, ty)
+    return r * (tx - ty) * (tx + ty), 2 * tx * ty * r
+
+@var('polar')
+def polar(tx, ty, w, pv, px, rng):
+    return w * np.arctan2(tx, ty) / np.pi, w * (_r(tx, ty) - 1)
+
+@var('handkerchief')
+def handkerchief(tx, ty, w, pv, px, rng):
+    a, r = np.arctan2(tx, ty), _r(tx, ty)
+    return w * r * np.sin(a+r), w * r * np.cos(a-r)
+
+@var('heart')
+def heart(tx, ty, w, pv, px, rng):
+    sq = _r(tx, ty)
+    a = sq * np.arctan2(tx, ty)
+    r = w * sq
+    return r * np.sin(a), -r * np.cos(a)
+
+@var('disc')
+def disc(tx, ty, w, pv, px, rng):
+    a = w * np.arctan2(tx, ty) / np.pi
+    r = np.pi * _r(tx, ty)
+    return np.sin(r) * a, np.cos(r) * a
+
+@var('spiral')
+def spiral(tx, ty, w, pv, px, rng):
+    a, r = np.arctan2(tx, ty), _r(tx, ty)
+    r1 = w / r
+    return r1 * (np.cos(a) + np.sin(r)), r1 * (np.sin(a) - np.cos(r))
+
+@var('hyperbolic')
+def hyperbolic(tx, ty, w, pv, px, rng):
+    a, r = np.arctan2(tx, ty), _r(tx, ty)
+    return w * np.sin(a) / r, w * np.cos(a) * r
+
+@var('diamond')
+def diamond(tx, ty, w, pv, px, rng):
+    a, r = np.arctan2(tx, ty), _r(tx, ty)
+    return w * np.sin(a) * np.cos(r), w * np.cos(a) * np.sin(r)
+
+@var('ex')
+def ex(tx, ty, w, pv, px, rng):
+    a, r = np.arctan2(tx, ty), _r(tx, ty)
+    n0, n1 = np.sin(a+r), np.cos(a-r)
+    m0, m1 = n0*n0*n0*r, n1*n1*n1*r
+    return w * (m0 + m1), w * (m0 - m1)
+
+@var('julia')
+def julia(tx, ty, w, pv, px, rng):
+    a = 0.5 * np.arctan2(tx, ty)
+    a = np.where(rng.next(tx.shape) & 1, a + np.pi, a)
+    r = w * np.sqrt(_r(tx, ty))
+    return r * np.cos(a), r * np.sin(a)
+
+@var('bent')
+def bent(tx, ty, w, pv, px, rng):
+    nx = np.where(tx < 0, 2.0, 1.0)
+    ny = np.where(ty < 0, 0.5, 1.0)
+    return w * nx * tx, w * ny * ty
+
+def waves_precalc(pv, px):
+    dx, dy = px.pre_affine.offset.x, px.pre_affine.offset.y
+    pv._set('dx2', 1 / (dx * dx + 1e-20))
+    pv._set('dy2', 1 / (dy * dy + 1e-20))
+
+@var('waves', waves_precalc)
+def waves(tx, ty, w, pv, px, rng):
+    c10, c11 = px.pre_affine.xy, px.pre_affine.yy
+    return (w * (tx + c10 * np.sin(ty * pv.dx2)),
+            w * (ty + c11 * np.sin(tx * pv.dy2)))
+
+@var('fisheye')
+def fisheye(tx, ty, w, pv, px, rng):
+    r = 2 * w / (_r(tx, ty) + 1)
+    return r * ty, r * tx
+
+@var('popcorn')
+def popcorn(tx, ty, w, pv, px, rng):
+    dx, dy = np.tan(3*ty), np.tan(3*tx)
+    return (w * (tx + px.pre_affine.xo * np.sin(dx)),
+            w * (ty + px.pre_affine.yo * np.sin(dy)))
+
+@var('exponential')
+def exponential(tx, ty, w, pv, px, rng):
+    dx = w * np.exp(tx - 1)
+    dy = np.pi * ty
+    fin = np.isfinite(dx)
+    return np.where(fin, dx * np.cos(dy), 0), np.where(fin, dx * np.sin(dy), 0)
+
+@var('power')
+def power(tx, ty, w, pv, px, rng):
+    a = np.arctan2(tx, ty)
+    sa = np.sin(a)
+    r = w * np.power(_r(tx, ty), sa)
+    return r * np.cos(a), r * sa
+
+@var('cosine')
+def cosine(tx, ty, w, pv, px, rng):
+    a = np.pi * tx
+    return w * np.cos(a) * np.cosh(ty), -w * np.sin(a) * np.sinh(ty)
+
+@var('rings')
+def rings(tx, ty, w, pv, px, rng):
+    dx = px.pre_affine.xo
+    dx *= dx
+    r, a = _r(tx, ty), np.arctan2(tx, ty)
+    r = w * (np.fmod(r+dx, 2*dx) - dx + r * (1 - dx))
+    return r * np.cos(a), r * np.sin(a)
+
+@var('fan')
+def fan(tx, ty, w, pv, px, rng):
+    dx = px.pre_affine.xo
+    dx *= dx * np.pi
+    dx2 = 0.5 * dx
+    dy = px.pre_affine.yo
+    a = np.arctan2(tx, ty)
+    a += np.where(np.fmod(a+dy, dx) > dx2, -dx2, dx2)
+    r = w * _r(tx, ty)
+    return r * np.cos(a), r * np.sin(a)
+
+@var('blob')
+def blob(tx, ty, w, pv, px, rng):
+    r, a = _r(tx, ty), np.arctan2(tx, ty)
+    bdiff = 0.5 * (pv.high - pv.low)
+    r = r * w * (pv.low + bdiff * (1 + np.sin(pv.waves * a)))
+    return np.sin(a) * r, np.cos(a) * r
+
+@var('pdj')
+def pdj(tx, ty, w, pv, px, rng):
+    nx1, nx2 = np.cos(pv.b * tx), np.sin(pv.c * tx)
+    ny1, ny2 = np.sin(pv.a * ty), np.cos(pv.d * ty)
+    return w * (ny1 - nx1), w * (nx2 - ny2)
+
+@var('fan2')
+def fan2(tx, ty, w, pv, px, rng):
+    dy, dx = pv.y, pv.x
+    dx *= dx * np.pi
+    dx2 = 0.5 * dx
+    a = np.arctan2(tx, ty)
+    r = w * _r(tx, ty)
+    t = a + dy - dx * np.trunc((a + dy) / dx)
+    a = np.where(t > dx2, a - dx2, a + dx2)
+    return r * np.sin(a), r * np.cos(a)
+
+@var('rings2')
+def rings2(tx, ty, w, pv, px, rng):
+    dx = pv.val
+    dx *= dx
+    r, a = _r(tx, ty), np.arctan2(tx, ty)
+    r = r + -2 * dx * np.trunc((r+dx) / (2*dx)) + r * (1 - dx)
+    return w * np.sin(a) * r, w * np.cos(a) * r
+
+@var('eyefish')
+def eyefish(tx, ty, w, pv, px, rng):
+    r = 2 * w / (_r(tx, ty) + 1)
+    return r * tx, r * ty
+
+@var('bubble')
+def bubble(tx, ty, w, pv, px, rng):
+    r = w / (0.25 * _r2(tx, ty) + 1)
+    return r * tx, r * ty
+
+@var('cylinder')
+def cylinder(tx, ty, w, pv, px, rng):
+    return w * np.sin(tx), w * ty
+
+def perspective_precalc(pv, px):
+    pang = pv.angle * (np.pi / 2)
+    pdist = np.maximum(1e-9, pv.dist)
+    pv._set('mdist', pdist)
+    pv._set('sin', np.sin(pang))
+    pv._set('cos', pdist * np.cos(pang))
+
+@var('perspective', perspective_precalc)
+def perspective(tx, ty, w, pv, px, rng):
+    t = 1 / (pv.mdist - ty * pv.sin)
+    return w * pv.mdist * tx * t, w * pv.cos * ty * t
+
+@var('noise')
+def noise(tx, ty, w, pv, px, rng):
+    tmpr = rng.next_01(tx.shape) * 2 * np.pi
+    r = w * rng.next_01(tx.shape)
+    return tx * r * np.cos(tmpr), ty * r * np.sin(tmpr)
+
+def julian_precalc(pv, px):
+    pv._set('cn', pv.dist / (2 * pv.power))
+
+@var('julian', julian_precalc)
+def julian(tx, ty, w, pv, px, rng):
+    power = pv.power
+    t_rnd = np.trunc(rng.next_01(tx.shape) * np.abs(power))
+    a = np.arctan2(ty, tx)
+    tmpr = (a + 2 * np.pi * t_rnd) / power
+    r = w * np.power(_r2(tx, ty), pv.cn)
+    return r * np.cos(tmpr), r * np.sin(tmpr)
+
+@var('juliascope', julian_precalc)
+def juliascope(tx, ty, w, pv, px, rng):
+    ang = np.arctan2(ty, tx)
+    power = pv.power
+    t_rnd = np.trunc(rng.next_01(tx.shape) * np.abs(power))
+    ang = np.where(rng.next(tx.shape) & 1, -ang, ang)
+    tmpr = (2 * np.pi * t_rnd + ang) / power
+    r = w * np.power(_r2(tx, ty), pv.cn)
+    return r * np.cos(tmpr), r * np.sin(tmpr)
+
+@var('blur')
+def blur(tx, ty, w, pv, px, rng):
+    tmpr = rng.next_01(tx.shape) * 2 * np.pi
+    r = w * rng.next_01(tx.shape)
+    return r * np.cos(tmpr), r * np.sin(tmpr)
+
+def _gauss(w, rng, shape):
+    # Matches the device's Box-Muller-ish approximation, including the
+    # variance correction factor
+    return w * 0.57736 * np.sqrt(-2 * np.log(rng.next_01(shape)))
+
+@var('gaussian_blur')
+def gaussian_blur(tx, ty, w, pv, px, rng):
+    ang = rng.next_01(tx.shape) * 2 * np.pi
+    r = _gauss(w, rng, tx.shape)
+    return r * np.cos(ang), r * np.sin(ang)
+
+@var('radial_blur')
+def radial_blur(tx, ty, w, pv, px, rng):
+    blur_angle = pv.angle * np.pi * 0.5
+    spinvar, zoomvar = np.sin(blur_angle), np.cos(blur_angle)
+    r = _gauss(w, rng, tx.shape)
+    ra = _r(tx, ty)
+    tmpa = np.arctan2(ty, tx) + spinvar * r
+    rz = zoomvar * r - 1
+    return ra*np.cos(tmpa) + rz*tx, ra*np.sin(tmpa) + rz*ty
+
+@var('pie')
+def pie(tx, ty, w, pv, px, rng):
+    slices = pv.slices
+    sl = np.trunc(rng.next_01(tx.shape) * slices + 0.5)
+    a = pv.rotation + 2 * np.pi * (sl + rng.next_01(tx.shape) *
+                                   pv.thickness) / slices
+    r = w * rng.next_01(tx.shape)
+    return r * np.cos(a), r * np.sin(a)
+
+@var('ngon')
+def ngon(tx, ty, w, pv, px, rng):
+    power = pv.power * 0.5
+    b = 2 * np.pi / pv.sides
+    r_factor = np.power(_r2(tx, ty), power)
+    theta = np.arctan2(ty, tx)
+    phi = theta - b * np.floor(theta / b)
+    phi = np.where(phi > b / 2, phi - b, phi)
+    amp = (pv.corners * (1 / np.cos(phi) - 1) + pv.circle) / r_factor
+    return w * tx * amp, w * ty * amp
+
+@var('curl')
+def curl(tx, ty, w, pv, px, rng):
+    c1, c2 = pv.c1, pv.c2
+    re = 1 + c1*tx + c2*(tx*tx - ty*ty)
+    im = c1*ty + 2*c2*tx*ty
+    r = w / (re*re + im*im)
+    return r * (tx*re + ty*im), r * (ty*re - tx*im)
+
+@var('rectangles')
+def rectangles(tx, ty, w, pv, px, rng):
+    rx, ry = pv.x, pv.y
+    ox = tx if rx == 0 else rx * (2 * np.floor(tx/rx) + 1) - tx
+    oy = ty if ry == 0 else ry * (2 * np.floor(ty/ry) + 1) - ty
+    return w * ox, w * oy
+
+@var('arch')
+def arch(tx, ty, w, pv, px, rng):
+    ang = rng.next_01(tx.shape) * w * np.pi
+    sa = np.sin(ang)
+    return w * sa, w * sa * sa / np.cos(ang)
+
+@var('tangent')
+def tangent(tx, ty, w, pv, px, rng):
+    return w * np.sin(tx) / np.cos(ty), w * np.tan(ty)
+
+@var('square')
+def square(tx, ty, w, pv, px, rng):
+    return (w * (rng.next_01(tx.shape) - 0.5),
+            w * (rng.next_01(tx.shape) - 0.5))
+
+@var('rays')
+def rays(tx, ty, w, pv, px, rng):
+    ang = w * rng.next_01(tx.shape) * np.pi
+    r = w / _r2(tx, ty)
+    tanr = w * np.tan(ang) * r
+    return tanr * np.cos(tx), tanr * np.sin(ty)
+
+@var('blade')
+def blade(tx, ty, w, pv, px, rng):
+    r = rng.next_01(tx.shape) * w * _r(tx, ty)
+    return w * tx * (np.cos(r) + np.sin(r)), w * tx * (np.cos(r) - np.sin(r))
+
+@var('secant2')
+def secant2(tx, ty, w, pv, px, rng):
+    cr = np.cos(w * _r(tx, ty))
+    icr = 1 / cr + np.where(cr < 0, 1, -1)
+    return w * tx, w * icr
+
+@var('cross')
+def cross(tx, ty, w, pv, px, rng):
+    s = tx*tx - ty*ty
+    r = w * np.sqrt(1 / (s*s))
+    return r * tx, r * ty
+
+@var('disc2')
+def disc2(tx, ty, w, pv, px, rng):
+    twist = pv.twist
+    rotpi = pv.rot * np.pi
+    sintwist, costwist = np.sin(twist), np.cos(twist) - 1
+    if twist > 2 * np.pi:
+        k = 1 + twist - 2 * np.pi
+        sintwist, costwist = sintwist * k, costwist * k
+    if twist < -2 * np.pi:
+        k = 1 + twist + 2 * np.pi
+        sintwist, costwist = sintwist * k, costwist * k
+    t = rotpi * (tx + ty)
+    r = w * np.arctan2(tx, ty) / np.pi
+    return r * (np.sin(t) + costwist), r * (np.cos(t) + sintwist)
+
+@var('super_shape')
+def super_shape(tx, ty, w, pv, px, rng):
+    ang = np.arctan2(ty, tx)
+    theta = 0.25 * (pv.m * ang + np.pi)
+    t1 = np.power(np.abs(np.cos(theta)), pv.n2)
+    t2 = np.power(np.abs(np.sin(theta)), pv.n3)
+    myrnd = pv.rnd
+    d = _r(tx, ty)
+    r = (w * ((myrnd * rng.next_01(tx.shape) + (1 - myrnd) * d) - pv.holes)
+           * np.power(t1 + t2, -1 / pv.n1) / d)
+    return r * tx, r * ty
+
+@var('flower')
+def flower(tx, ty, w, pv, px, rng):
+    r = (w * (rng.next_01(tx.shape) - pv.holes)
+           * np.cos(pv.petals * np.arctan2(ty, tx)) / _r(tx, ty))
+    return r * tx, r * ty
+
+@var('conic')
+def conic(tx, ty, w, pv, px, rng):
+    d = _r(tx, ty)
+    ct = tx / d
+    eccen = pv.eccentricity
+    r = w * (rng.next_01(tx.shape) - pv.holes) * eccen / (1 + eccen*ct) / d
+    return r * tx, r * ty
+
+@var('parabola')
+def parabola(tx, ty, w, pv, px, rng):
+    r = _r(tx, ty)
+    sr, cr = np.sin(r), np.cos(r)
+    ox = pv.height * w * sr * sr * rng.next_01(tx.shape)
+    oy = pv.width * w * cr * rng.next_01(tx.shape)
+    return ox, oy
+
+@var('bent2')
+def bent2(tx, ty, w, pv, px, rng):
+    nx = np.where(tx < 0, pv.x, 1)
+    ny = np.where(ty < 0, pv.y, 1)
+    return w * nx * tx, w * ny * ty
+
+@var('bipolar')
+def bipolar(tx, ty, w, pv, px, rng):
+    x2y2 = _r2(tx, ty)
+    t = x2y2 + 1
+    x2 = tx * 2
+    ps = -np.pi / 2 * pv.shift
+    y = 0.5 * np.arctan2(2 * ty, x2y2 - 1) + ps
+    y = np.where(y > np.pi / 2, -np.pi / 2 + np.fmod(y + np.pi / 2, np.pi),
+        np.where(y < -np.pi / 2, np.pi / 2 - np.fmod(np.pi / 2 - y, np.pi), y))
+    return w * 0.25 * (2 / np.pi) * np.log((t+x2) / (t-x2)), w * (2 / np.pi) * y
+
+@var('boarders')
+def boarders(tx, ty, w, pv, px, rng):
+    roundx, roundy = np.rint(tx), np.rint(ty)
+    offx, offy = tx - roundx, ty - roundy
+    hx, hy = offx * 0.5 + roundx, offy * 0.5 + roundy
+    sx, sy = np.where(offx >= 0, 0.25, -0.25), np.where(offy >= 0, 0.25, -0.25)
+    xside = np.abs(offx) >= np.abs(offy)
+    ox = np.where(xside, hx + sx, hx + offx / offy * sy)
+    oy = np.where(xside, hy + offy / offx * sx, hy + sy)
+    outer = rng.next_01(tx.shape) > 0.75
+    return w * np.where(outer, hx, ox), w * np.where(outer, hy, oy)
+
+@var('butterfly')
+def butterfly(tx, ty, w, pv, px, rng):
+    # wx is weight*4/sqrt(3*pi)
+    wx = w * 1.3029400317411197908970256609023
+    y2 = ty * 2
+    r = wx * np.sqrt(np.abs(ty * tx) / (tx*tx + y2*y2))
+    return r * tx, r * y2
+
+@var('cell')
+def cell(tx, ty, w, pv, px, rng):
+    cell_size = pv.size
+    inv_cell_size = 1 / cell_size
+    x, y = np.floor(tx * inv_cell_size), np.floor(ty * inv_cell_size)
+    dx, dy = tx - x * cell_size, ty - y * cell_size
+    # Interleave cells
+    x = np.where(x >= 0, 2 * x, -(2 * x + 1))
+    y = np.where(y >= 0, 2 * y, -(2 * y + 1))
+    return w * (dx + x * cell_size), -w * (dy + y * cell_size)
+
+@var('cpow')
+def cpow(tx, ty, w, pv, px, rng):
+    a = np.arctan2(ty, tx)
+    lnr = 0.5 * np.log(_r2(tx, ty))
+    power = 1 / pv.power
+    va = 2 * np.pi * power
+    vc, vd = pv.r * power, pv.i * power
+    ang = vc*a + vd*lnr + va*np.floor(power * rng.next_01(tx.shape))
+    m = w * np.exp(vc * lnr - vd * a)
+    return m * np.cos(ang), m * np.sin(ang)
+
+def curve_precalc(pv, px):
+    xl, yl = pv.xlength, pv.ylength
+    pv._set('x2', 1 / np.maximum(1e-20, xl * xl))
+    pv._set('y2', 1 / np.maximum(1e-20, yl * yl))
+
+@var('curve', curve_precalc)
+def curve(tx, ty, w, pv, px, rng):
+    return (w * (tx + pv.xamp * np.exp(-ty*ty*pv.x2)),
+            w * (ty + pv.yamp * np.exp(-tx*tx*pv.y2)))
+
+@var('edisc')
+def edisc(tx, ty, w, pv, px, rng):
+    tmp = _r2(tx, ty) + 1
+    tmp2 = 2 * tx
+    r1, r2 = np.sqrt(tmp + tmp2), np.sqrt(tmp - tmp2)
+    xmax = (r1 + r2) * 0.5
+    a1 = np.log(xmax + np.sqrt(xmax - 1))
+    a2 = -np.arccos(tx / xmax)
+    neww = w / 11.57034632
+    snv = np.where(ty > 0, -np.sin(a1), np.sin(a1))
+    return neww * np.cosh(a2) * np.cos(a1), neww * np.sinh(a2) * snv
+
+@var('elliptic')
+def elliptic(tx, ty, w, pv, px, rng):
+    tmp = _r2(tx, ty) + 1
+    x2 = 2 * tx
+    xmax = 0.5 * (np.sqrt(tmp + x2) + np.sqrt(tmp - x2))
+    a = tx / xmax
+    b = 1 - a*a
+    ssx = xmax - 1
+    neww = w / (np.pi / 2)
+    b = np.where(b < 0, 0, np.sqrt(np.maximum(b, 0)))
+    ssx = np.where(ssx < 0, 0, np.sqrt(np.maximum(ssx, 0)))
+    oy = neww * np.log(xmax + ssx)
+    return neww * np.arctan2(a, b), np.where(ty > 0, oy, -oy)
+
+@var('escher')
+def escher(tx, ty, w, pv, px, rng):
+    a = np.arctan2(ty, tx)
+    lnr = 0.5 * np.log(_r2(tx, ty))
+    ebeta = pv.beta
+    vc = 0.5 * (1 + np.cos(ebeta))
+    vd = 0.5 * np.sin(ebeta)
+    m = w * np.exp(vc*lnr - vd*a)
+    n = vc*a + vd*lnr
+    return m * np.cos(n), m * np.sin(n)
+
+@var('foci')
+def foci(tx, ty, w, pv, px, rng):
+    expx = np.exp(tx) * 0.5
+    expnx = 0.25 / expx
+    tmp = w / (expx + expnx - np.cos(ty))
+    return tmp * (expx - expnx), tmp * np.sin(ty)
+
+@var('lazysusan')
+def lazysusan(tx, ty, w, pv, px, rng):
+    lx, ly = pv.x, pv.y
+    x, y = tx - lx, ty + ly
+    r = _r(x, y)
+    a = np.arctan2(y, x) + pv.spin + pv.twist * (w - r)
+    rs = 1 + pv.space / r
+    inside = r < w
+    return (w * np.where(inside, r * np.cos(a), rs * x) + w * lx,
+            w * np.where(inside, r * np.sin(a), rs * y) - w * ly)
+
+@var('loonie')
+def loonie(tx, ty, w, pv, px, rng):
+    r2 = _r2(tx, ty)
+    w2 = w * w
+    r = np.where(r2 < w2, w * np.sqrt(np.maximum(w2 / r2 - 1, 0)), w)
+    return r * tx, r * ty
+
+@var('pre_blur')
+def pre_blur(tx, ty, w, pv, px, rng):
+    shape = tx.shape
+    rndG = w * (rng.next_01(shape) + rng.next_01(shape)
+              + rng.next_01(shape) + rng.next_01(shape) - 2)
+    rndA = rng.next_01(shape) * 2 * np.pi
+    # As on the device, this alters the input coordinates
+    tx += rndG * np.cos(rndA)
+    ty += rndG * np.sin(rndA)
+    return 0, 0
+
+def _modulus(t, m):
+    return np.where(t > m, -m + np.fmod(t + m, 2*m),
+           np.where(t < -m, m - np.fmod(m - t, 2*m), t))
+
+@var('modulus')
+def modulus(tx, ty, w, pv, px, rng):
+    return w * _modulus(tx, pv.x), w * _modulus(ty, pv.y)
+
+@var('oscope')
+def oscope(tx, ty, w, pv, px, rng):
+    tpf = 2 * np.pi * pv.frequency
+    t = (pv.amplitude * np.exp(-np.abs(tx) * pv.damping) * np.cos(tpf * tx)
+         + pv.separation)
+    return w * tx, np.where(np.abs(ty) <= t, -w * ty, w * ty)
+
+@var('polar2')
+def polar2(tx, ty, w, pv, px, rng):
+    p2v = w / np.pi
+    return p2v * np.arctan2(tx, ty), 0.5 * p2v * np.log(_r2(tx, ty))
+
+@var('popcorn2')
+def popcorn2(tx, ty, w, pv, px, rng):
+    c = pv.c
+    return (w * (tx + pv.x * np.sin(np.tan(ty*c))),
+            w * (ty + pv.y * np.sin(np.tan(tx*c))))
+
+@var('scry')
+def scry(tx, ty, w, pv, px, rng):
+    # Not multiplied by weight, as on the device
+    t = _r2(tx, ty)
+    r = 1 / (np.sqrt(t) * (t + 1 / w))
+    return tx * r, ty * r
+
+def _separation(t, s, inside):
+    d = np.sqrt(t*t + s*s)
+    return np.where(t > 0, d - t * inside, -(d + t * inside))
+
+@var('separation')
+def separation(tx, ty, w, pv, px, rng):
+    return (w * _separation(tx, pv.x, pv.xinside),
+            w * _separation(ty, pv.y, pv.yinside))
+
+@var('split')
+def split(tx, ty, w, pv, px, rng):
+    ox = np.where(np.cos(ty * pv.ysize * np.pi) >= 0, w * tx, -w * tx)
+    oy = np.where(np.cos(tx * pv.xsize * np.pi) >= 0, w * ty, -w * ty)
+    return ox, oy
+
+@var('splits')
+def splits(tx, ty, w, pv, px, rng):
+    return (w * (tx + np.copysign(pv.x, tx)),
+            w * (ty + np.copysign(pv.y, ty)))
+
+@var('stripes')
+def stripes(tx, ty, w, pv, px, rng):
+    roundx = np.floor(tx + 0.5)
+    offsetx = tx - roundx
+    return (w * (offsetx * (1 - pv.space) + roundx),
+            w * (ty + offsetx * offsetx * pv.warp))
+
+@var('wedge')
+def wedge(tx, ty, w, pv, px, rng):
+    r = _r(tx, ty)
+    a = np.arctan2(ty, tx) + pv.swirl * r
+    wc, wa = pv.count, pv.angle
+    c = np.floor((wc * a + np.pi) / np.pi * 0.5)
+    comp_fac = 1 - wa * wc / np.pi * 0.5
+    a = a * comp_fac + c * wa
+    r = w * (r + pv.hole)
+    return r * np.cos(a), r * np.sin(a)
+
+@var('whorl')
+def whorl(tx, ty, w, pv, px, rng):
+    r = _r(tx, ty)
+    a = np.arctan2(ty, tx) + np.where(r < w, pv.inside, pv.outside) / (w - r)
+    return w * r * np.cos(a), w * r * np.sin(a)
+
+@var('waves2')
+def waves2(tx, ty, w, pv, px, rng):
+    return (w * (tx + pv.scalex * np.sin(ty * pv.freqx)),
+            w * (ty + pv.scaley * np.sin(tx * pv.freqy)))
+
+@var('exp')
+def exp(tx, ty, w, pv, px, rng):
+    expe = np.exp(tx)
+    return w * expe * np.cos(ty), w * expe * np.sin(ty)
+
+@var('log')
+def log(tx, ty, w, pv, px, rng):
+    return w * 0.5 * np.log(_r2(tx, ty)), w * np.arctan2(ty, tx)
+
+@var('sin')
+def sin(tx, ty, w, pv, px, rng):
+    return w * np.sin(tx) * np.cosh(ty), w * np.cos(tx) * np.sinh(ty)
+
+@var('cos')
+def cos(tx, ty, w, pv, px, rng):
+    return w * np.cos(tx) * np.cosh(ty), -w * np.sin(tx) * np.sinh(ty)
+
+@var('tan')
+def tan(tx, ty, w, pv, px, rng):
+    tanden = 1 / (np.cos(2*tx) + np.cosh(2*ty))
+    return w * tanden * np.sin(2*tx), w * tanden * np.sinh(2*ty)
+
+@var('sec')
+def sec(tx, ty, w, pv, px, rng):
+    secden = 2 / (np.cos(2*tx) + np.cosh(2*ty))
+    return (w * secden * np.cos(tx) * np.cosh(ty),
+            w * secden * np.sin(tx) * np.sinh(ty))
+
+@var('csc')
+def csc(tx, ty, w, pv, px, rng):
+    cscden = 2 / (np.cosh(2*ty) - np.cos(2*tx))
+    return (w * cscden * np.sin(tx) * np.cosh(ty),
+            -w * cscden * np.cos(tx) * np.sinh(ty))
+
+@var('cot')
+def cot(tx, ty, w, pv, px, rng):
+    cotden = 1 / (np.cosh(2*ty) - np.cos(2*tx))
+    return w * cotden * np.sin(2*tx), -w * cotden * np.sinh(2*ty)
+
+@var('sinh')
+def sinh(tx, ty, w, pv, px, rng):
+    return w * np.sinh(tx) * np.cos(ty), w * np.cosh(tx) * np.sin(ty)
+
+@var('cosh')
+def cosh(tx, ty, w, pv, px, rng):
+    return w * np.cosh(tx) * np.cos(ty), w * np.sinh(tx) * np.sin(ty)
+
+@var('tanh')
+def tanh(tx, ty, w, pv, px, rng):
+    tanhden = 1 / (np.cos(2*ty) + np.cosh(2*tx))
+    return w * tanhden * np.sinh(2*tx), w * tanhden * np.sin(2*ty)
+
+@var('sech')
+def sech(tx, ty, w, pv, px, rng):
+    sechden = 2 / (np.cos(2*ty) + np.cosh(2*tx))
+    return (w * sechden * np.cos(ty) * np.cosh(tx),
+            -w * sechden * np.sin(ty) * np.sinh(tx))
+
+@var('csch')
+def csch(tx, ty, w, pv, px, rng):
+    cschden = 2 / (np.cosh(2*tx) - np.cos(2*ty))
+    return (w * cschden * np.sinh(tx) * np.cos(ty),
+            -w * cschden * np.cosh(tx) * np.sin(ty))
+
+@var('coth')
+def coth(tx, ty, w, pv, px, rng):
+    cothden = 1 / (np.cosh(2*tx) - np.cos(2*ty))
+    return w * cothden * np.sinh(2*tx), w * cothden * np.sin(2*ty)
+
+@var('flux')
+def flux(tx, ty, w, pv, px, rng):
+    xpw, xmw = tx + w, tx - w
+    avgr = (w * (2 + pv.spread)
+              * np.sqrt(np.sqrt(ty*ty + xpw*xpw) / np.sqrt(ty*ty + xmw*xmw)))
+    avga = (np.arctan2(ty, xmw) - np.arctan2(ty, xpw)) * 0.5
+    return avgr * np.cos(avga), avgr * np.sin(avga)
+
+@var('mobius')
+def mobius(tx, ty, w, pv, px, rng):
+    re_u = pv.re_a * tx - pv.im_a * ty + pv.re_b
+    im_u = pv.re_a * ty + pv.im_a * tx + pv.im_b
+    re_v = pv.re_c * tx - pv.im_c * ty + pv.re_d
+    im_v = pv.re_c * ty + pv.im_c * tx + pv.im_d
+    rad_v = w / (re_v*re_v + im_v*im_v)
+    return rad_v * (re_u*re_v + im_u*im_v), rad_v * (im_u*re_v - re_u*im_v)
@@ -0,0 +1,467 @@
+"""
+Routing of render tasks to workers, and compiling their kernels, for the
+dist server.
+
+Nothing here touches CUDA or zmq, so the policy can be exercised with fake
+worker descriptors and a stub compiler.
+"""
+
+import time
+import hashlib
+import traceback
+import cPickle as pickle
+from collections import OrderedDict
+
+from cuburn.code import util
+from cuburn.code.cache import CubinCache
+
+# These match the buffers allocated by `cuburn.render.RenderManager`
+GUTTER = 12
+MAX_KNOTS = 1 << util.DEFAULT_SEARCH_ROUNDS
+MAX_PARAMS = 1024
+NTEMPORAL_SAMPLES = 1024
+PALETTE_WIDTH, PALETTE_HEIGHT = 256, 64
+
+def _fixed_footprint():
+    # Two each of DevSrc and DevInfo, double-buffered across streams
+    src = (2 * 4 * MAX_KNOTS * MAX_PARAMS + 4 * MAX_KNOTS
+           + 16 * 256 * MAX_KNOTS)
+    info = (4 * NTEMPORAL_SAMPLES * MAX_PARAMS
+            + 8 * PALETTE_WIDTH * PALETTE_HEIGHT)
+    # The Framebuffers' ring buffer indices, RNG seeds and points
+    nthreads = util.DEFAULT_RB_SIZE * 256
+    return 2 * (src + info) + 8 + 12 * nthreads + 16 * nthreads
+
+FIXED_FOOTPRINT = _fixed_footprint()
+
+def frame_footprint(width, height):
+    """
+    Estimate the device memory, in bytes, used by a `RenderManager` to
+    render frames of the given size: the three accumulation buffers, at 16
+    bytes per bin, plus the fixed-size buffers.
+    """
+    dim = util.calc_dim(width, height, GUTTER)
+    return 3 * 16 * dim.ah * dim.astride + FIXED_FOOTPRINT
+
+class WorkerPool(object):
+    """
+    Tracks the workers connected to the server and which of them are ready
+    for a task, and routes each task to a ready worker with room for it.
+
+    Workers are identified by their address. Each may advertise a
+    descriptor when it joins, a dict whose ``mem`` key gives the device
+    memory in bytes available for rendering, and whose ``arch`` key gives
+    the architecture kernels must be compiled for. A worker which doesn't
+    give its memory is assumed to have room for anything, and one which
+    doesn't give its architecture is assumed to use ``default_arch``.
+
+    ``reserve`` is held back from each worker's advertised memory, to cover
+    the CUDA context and loaded modules.
+    """
+    def __init__(self, reserve=64 << 20, default_arch='sm_35'):
+        self.reserve, self.default_arch = reserve, default_arch
+        self.workers = {}
+        self.ready = []
+
+    def join(self, addr, desc=None):
+        """Record the descriptor of a newly connected worker."""
+        self.workers[addr] = dict(desc or {})
+
+    def put(self, addr):
+        """Mark a worker as ready for another task."""
+        if addr not in self.workers:
+            self.join(addr)
+        self.ready.append(addr)
+
+    def arch(self, addr):
+        return self.workers[addr].get('arch') or self.default_arch
+
+    def archs(self):
+        """The architectures of the workers which have joined, or just the
+        default if none have yet."""
+        return set(map(self.arch, self.workers)) or set([self.default_arch])
+
+    def capacity(self, addr):
+        """Bytes available to tasks on a worker, or None if unknown."""
+        mem = self.workers[addr].get('mem')
+        return None if mem is None else mem - self.reserve
+
+    def fits(self, addr, size):
+        cap = self.capacity(addr)
+        return cap is None or cap >= size
+
+    def can_run(self, size):
+        """
+        Whether any worker could take a task needing ``size`` bytes. Returns
+        None if no workers have joined yet, since one that could might.
+        """
+        if not self.workers:
+            return None
+        return any(self.fits(addr, size) for addr in self.workers)
+
+    def take(self, size, hash=None, avoid=(), archs=None):
+        """
+        Remove and return a ready worker with room for a task needing
+        ``size`` bytes, or None if there isn't one right now. If ``archs``
+        is given, only workers with one of those architectures are taken.
+
+        If ``hash`` is given, only a worker whose last task had that hash is
+        taken. Otherwise, of the workers that fit, the one with the least
+        room is chosen, to keep larger workers free for larger tasks; but
+        workers whose last hash is in ``avoid`` (because other tasks waiting
+        could use the kernel they have loaded) are only taken if nothing
+        else fits. Ties go to the worker that has been ready longest.
+        """
+        best, best_key = None, None
+        for i, addr in enumerate(self.ready):
+            if not self.fits(addr, size):
+                continue
+            if archs is not None and self.arch(addr) not in archs:
+                continue
+            last = self.workers[addr].get('hash')
+            if hash is not None:
+                if last == hash:
+                    best = i
+                    break
+                continue
+            cap = self.capacity(addr)
+            key = (last in avoid, float('inf') if cap is None else cap)
+            if best is None or key < best_key:
+                best, best_key = i, key
+        if best is None:
+            return None
+        return self.ready.pop(best)
+
+    def assigned(self, addr, hash):
+        """
+        Record that a worker was given a task with ``hash``, counting an
+        affinity hit if its last task had the same one.
+        """
+        desc = self.workers[addr]
+        desc['tasks'] = desc.get('tasks', 0) + 1
+        if desc.get('hash') == hash:
+            desc['hits'] = desc.get('hits', 0) + 1
+        desc['hash'] = hash
+
+    def hit_rates(self):
+        """
+        Return a dict giving, for each worker that has been given a task,
+        the fraction of its tasks which reused its loaded kernel.
+        """
+        return dict((addr, desc.get('hits', 0) / float(desc['tasks']))
+                    for addr, desc in self.workers.items()
+                    if desc.get('tasks'))
+
+    def status(self):
+        """
+        Return a list of dicts describing each worker: its descriptor, with
+        its address in hex, whether it's ready, and its affinity hit rate.
+        """
+        rates = self.hit_rates()
+        out = []
+        for addr, desc in sorted(self.workers.items()):
+            desc = dict(desc, addr=addr.encode('hex'),
+                        ready=addr in self.ready, hit_rate=rates.get(addr))
+            desc.pop('hash', None)
+            out.append(desc)
+        return out
+
+class _Pending(object):
+    def __init__(self, item, hash, size, archs):
+        self.item, self.hash, self.size = item, hash, size
+        self.archs = set(archs)
+        self.skips = 0
+
+class Scheduler(object):
+    """
+    Holds tasks waiting for a worker, and matches them to ready workers in
+    the `WorkerPool` ``workers``.
+
+    A task can only go to a worker with an architecture its kernel has been
+    compiled for; until it has been compiled for at least one, the task
+    waits without holding up others. Of the tasks that can go, up to
+    ``window`` are held at once.
+
+    A worker keeps the kernel for its last task loaded, so reloading is
+    avoided by sending a task to a worker that last ran one with the same
+    hash. To find such pairs, tasks may go out of order, but only from
+    among the first ``window`` that can go; and once the oldest of those
+    has been passed over ``window`` times, nothing else goes until it has a
+    worker. With a ``window`` of 0, tasks go strictly in order.
+
+    No more than ``max_waiting`` tasks are held in all.
+    """
+    def __init__(self, workers, window=8, max_waiting=64):
+        self.workers, self.window = workers, window
+        self.max_waiting = max_waiting
+        self.pending = []
+
+    def __len__(self):
+        return len(self.pending)
+
+    def _eligible(self):
+        return [p for p in self.pending if p.archs]
+
+    def full(self):
+        """Whether callers should hold further tasks back until some have
+        been assigned."""
+        return (len(self._eligible()) >= max(self.window, 1)
+                or len(self.pending) >= self.max_waiting)
+
+    def add(self, item, hash, size, archs=None):
+        """
+        Queue ``item``, a task with kernel ``hash`` needing ``size`` bytes
+        of device memory. ``archs`` gives the architectures the kernel has
+        been compiled for so far; if None, it can go to any worker.
+        """
+        if archs is None:
+            archs = self.workers.archs()
+        self.pending.append(_Pending(item, hash, size, archs))
+
+    def compiled(self, hash, arch):
+        """Record that the kernel ``hash`` is ready for ``arch``."""
+        for p in self.pending:
+            if p.hash == hash:
+                p.archs.add(arch)
+
+    def _drop(self, pred):
+        keep, drop = [], []
+        for p in self.pending:
+            (drop if pred(p) else keep).append(p)
+        self.pending = keep
+        return [p.item for p in drop]
+
+    def drop_unroutable(self):
+        """Remove and return the items of tasks too big for any worker."""
+        return self._drop(lambda p: self.workers.can_run(p.size) is False)
+
+    def drop_uncompiled(self, busy):
+        """
+        Remove and return the items of tasks whose kernel hasn't been
+        compiled for any architecture, where ``busy(hash)`` says no
+        compile of it is still under way (because they all failed).
+        """
+        return self._drop(lambda p: not p.archs and not busy(p.hash))
+
+    def items(self):
+        """The items waiting, oldest first."""
+        return [p.item for p in self.pending]
+
+    def assign(self):
+        """
+        Match waiting tasks to ready workers. Returns a list of ``(addr,
+        item)`` pairs, to be sent in order.
+        """
+        out = []
+        while self.pending and self.workers.ready:
+            pair = self._assign_one()
+            if pair is None:
+                break
+            out.append(pair)
+        return out
+
+    def _assign_one(self):
+        eligible = self._eligible()
+        if not eligible:
+            return None
+        if eligible[0].skips >= self.window:
+            cands = eligible[:1]
+        else:
+            cands = eligible[:self.window]
+        for p in cands:
+            addr = self.workers.take(p.size, hash=p.hash, archs=p.archs)
+            if addr is not None:
+                return self._pop(p, addr)
+        wanted = set(p.hash for p in self.pending)
+        for p in cands:
+            addr = self.workers.take(p.size, avoid=wanted - set([p.hash]),
+                                     archs=p.archs)
+            if addr is not None:
+                return self._pop(p, addr)
+
+    def _pop(self, p, addr):
+        for q in self._eligible():
+            if q is p:
+                break
+            q.skips += 1
+        self.pending.remove(p)
+        self.workers.assigned(addr, p.hash)
+        return addr, p.item
+
+def _run_compile(compile, anim, arch):
+    # Failures come back as their tracebacks, which are cached like any
+    # other result, so that bad genomes aren't endlessly recompiled
+    try:
+        return compile(anim, arch)
+    except:
+        return traceback.format_exc()
+
+def is_error(rsp):
+    """Whether a `CompileService` result is the traceback of a failure."""
+    return isinstance(rsp, basestring)
+
+class _SpillDir(CubinCache):
+    suffix = '.kernel'
+
+class CompileCache(object):
+    """
+    Holds `CompileService` results, keyed by ``(hash, arch)``, in no more
+    than ``max_bytes`` of memory (as measured by their pickled size).
+
+    When that fills, the least recently used results are dropped, or, if
+    ``spill_dir`` is given, moved to files there, to be loaded back when
+    next asked for. The spill directory is itself limited to
+    ``spill_bytes``, in the manner of `CubinCache`.
+
+    Failures are kept for ``error_ttl`` seconds, and compiled again if
+    asked for after that, in case the fault was transient or has been
+    fixed. They're never spilled.
+
+    Counts of what happened are kept in `stats`; `status` adds the current
+    size.
+    """
+    def __init__(self, max_bytes=256 << 20, spill_dir=None,
+                 spill_bytes=1 << 30, error_ttl=3600, clock=time.time):
+        self.max_bytes, self.error_ttl = max_bytes, error_ttl
+        self.clock = clock
+        self.spill = spill_dir and _SpillDir(spill_dir, spill_bytes)
+        # key -> (size, expiry or None, value)
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.stats = dict.fromkeys(['hits', 'misses', 'evictions', 'spills',
+                                    'spill_hits', 'expired'], 0)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return self.get(key, count=False) is not None
+
+    @staticmethod
+    def _spill_key(key):
+        return hashlib.sha1(pickle.dumps(key, -1)).hexdigest()
+
+    def get(self, key, default=None, count=True):
+        ent = self.entries.pop(key, None)
+        if ent is not None and ent[1] is not None and ent[1] < self.clock():
+            self.nbytes -= ent[0]
+            self.stats['expired'] += 1
+            ent = None
+        if ent is not None:
+            self.entries[key] = ent
+            self.stats['hits'] += count
+            return ent[2]
+        if self.spill:
+            data = self.spill.get(self._spill_key(key))
+            if data is not None:
+                self.stats['spill_hits'] += count
+                val = pickle.loads(data)
+                self._store(key, val, len(data))
+                return val
+        self.stats['misses'] += count
+        return default
+
+    def __setitem__(self, key, val):
+        data = pickle.dumps(val, -1)
+        old = self.entries.pop(key, None)
+        if old is not None:
+            self.nbytes -= old[0]
+        self._store(key, val, len(data))
+
+    def _store(self, key, val, size):
+        expiry = None
+        if is_error(val):
+            expiry = self.clock() + self.error_ttl
+        self.entries[key] = (size, expiry, val)
+        self.nbytes += size
+        while self.nbytes > self.max_bytes and len(self.entries) > 1:
+            self._evict()
+
+    def _evict(self):
+        key, (size, expiry, val) = self.entries.popitem(last=False)
+        self.nbytes -= size
+        self.stats['evictions'] += 1
+        if self.spill and expiry is None:
+            self.spill.put(self._spill_key(key), pickle.dumps(val, -1))
+            self.stats['spills'] += 1
+
+    def status(self):
+        """Return a dict of the cache's `stats`, size and limits."""
+        errors = sum(1 for ent in self.entries.values() if ent[1] is not None)
+        return dict(self.stats, entries=len(self.entries), errors=errors,
+                    bytes=self.nbytes, max_bytes=self.max_bytes,
+                    spill=self.spill and self.spill.path)
+
+class CompileService(object):
+    """
+    Compiles kernels on a process ``pool`` (a `multiprocessing.Pool` or
+    anything with the same ``apply_async``), so that dispatch of tasks with
+    kernels already compiled carries on meanwhile, and several compiles can
+    run at once.
+
+    ``compile`` is called in a pool process as ``compile(anim, arch)``, so
+    must be picklable (that is, a module-level function), and returns the
+    ``(packer, lib, cubin)`` tuple of `Renderer.compile`. Results, or the
+    tracebacks of failed compiles, are stored in the dict-like ``cache`` by
+    ``(hash, arch)`` (a `CompileCache` by default). A request for a kernel
+    already being compiled joins the compile under way.
+
+    Nothing here blocks or uses callbacks (which would run on another
+    thread); the owner calls `poll` regularly to collect finished compiles.
+    """
+    def __init__(self, pool, compile, cache=None):
+        self.pool, self.compile = pool, compile
+        self.cache = CompileCache() if cache is None else cache
+        self.inflight = OrderedDict()
+        self.stats = dict.fromkeys(['hits', 'misses', 'merged', 'errors'], 0)
+
+    def get(self, hash, arch):
+        """The result of compiling ``hash`` for ``arch``, or None if it's
+        not available yet."""
+        return self.cache.get((hash, arch))
+
+    def request(self, hash, anim, arch):
+        """
+        Start compiling ``anim`` for ``arch``, unless a result for ``hash``
+        is cached or already on the way. Returns the cached result, or None.
+        """
+        key = (hash, arch)
+        rsp = self.cache.get(key)
+        if rsp is not None:
+            self.stats['hits'] += 1
+        elif key in self.inflight:
+            self.stats['merged'] += 1
+        else:
+            self.stats['misses'] += 1
+            self.inflight[key] = self.pool.apply_async(
+                    _run_compile, (self.compile, anim, arch))
+        return rsp
+
+    def busy(self, hash):
+        """Whether ``hash`` is being compiled for any architecture."""
+        return any(h == hash for h, arch in self.inflight)
+
+    def poll(self):
+        """
+        Collect finished compiles, and return them as a list of ``((hash,
+        arch), result)`` pairs, in the order they were requested. The
+        results are cached before they're returned.
+        """
+        done = []
+        for key, res in self.inflight.items():
+            if res.ready():
+                del self.inflight[key]
+                rsp = res.get()
+                if is_error(rsp):
+                    self.stats['errors'] += 1
+                self.cache[key] = rsp
+                done.append((key, rsp))
+        return done
+
+    def status(self):
+        """Return a dict of the service's `stats`, and of its cache's if it
+        has them."""
+        out = dict(self.stats, inflight=len(self.inflight))
+        if hasattr(self.cache, 'status'):
+            out['cache'] = self.cache.status()
+        return out
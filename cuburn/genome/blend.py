@@ -39,11 +39,9 @@ def resolve(gdb, item):
     """
     is_edge = (item['type'] == 'edge')
     spec = specs.toplevels[item['type']]
-    def go(i):
-        if i.get('base') is not None:
-            return go(gdb.get(i['base'])) + [i]
-        return [i]
-    items = map(flatten, go(item))
+    items = [flatten(item)]
+    if item.get('base') is not None:
+        items = gdb.get_bases(item['base']) + items
     out = {}
 
     for k in set(ik for i in items for ik in i.keys()):
@@ -60,7 +58,7 @@ def resolve(gdb, item):
 def _split_ref_id(s):
     sp = s.split('@')
     if len(sp) == 1:
-        return sp, 0
+        return sp[0], 0
     return sp[0], float(sp[1])
 
 def apply_temporal_offset(node, offset=0):
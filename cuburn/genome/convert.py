@@ -2,7 +2,10 @@
 
 import base64
 import warnings
+import itertools
+import multiprocessing
 import xml.parsers.expat
+from collections import deque
 import numpy as np
 
 from variations import var_params
@@ -19,12 +22,20 @@ class XMLGenomeParser(object):
     def __init__(self):
         self.flames = []
         self._flame = None
+        self._colors = []
+        self._hexpal = self._text = None
         self.parser = xml.parsers.expat.ParserCreate()
+        self.parser.buffer_text = True
         self.parser.StartElementHandler = self.start_element
         self.parser.EndElementHandler = self.end_element
+        self.parser.CharacterDataHandler = self.char_data
 
     def start_element(self, name, attrs):
-        if name == 'flame':
+        # Palettes have far more elements than anything else
+        if name == 'color':
+            # Converted all at once when the flame ends
+            self._colors.append((attrs['index'], attrs['rgb']))
+        elif name == 'flame':
             assert self._flame is None
             self._flame = dict(attrs)
             self._flame['xforms'] = []
@@ -33,14 +44,24 @@ class XMLGenomeParser(object):
             self._flame['xforms'].append(dict(attrs))
         elif name == 'finalxform':
             self._flame['finalxform'] = dict(attrs)
-        elif name == 'color':
-            idx = int(attrs['index'])
-            self._flame['palette'][idx][:3] = [float(v) / 255.0
-                                               for v in attrs['rgb'].split()]
+        elif name == 'palette':
+            self._hexpal = (int(attrs.get('count', 256)),
+                            attrs.get('format', 'RGB'))
+            self._text = []
         elif name == 'symmetry':
             self._flame['symmetry'] = int(attrs['kind'])
+    def char_data(self, data):
+        if self._text is not None:
+            self._text.append(data)
     def end_element(self, name):
-        if name == 'flame':
+        if name == 'palette':
+            parse_hex_palette(self._flame['palette'], ''.join(self._text),
+                              *self._hexpal)
+            self._hexpal = self._text = None
+        elif name == 'flame':
+            if self._colors:
+                parse_colors(self._flame['palette'], self._colors)
+                self._colors = []
             self.flames.append(self._flame)
             self._flame = None
 
@@ -50,6 +71,54 @@ class XMLGenomeParser(object):
         parser.parser.Parse(src, True)
         return parser.flames
 
+    @classmethod
+    def iter_flames(cls, fp, chunk_size=1<<20):
+        """
+        Parse the file-like object `fp` a chunk at a time, yielding each
+        flame as soon as it has been read, so that files of any size can be
+        parsed in bounded memory.
+        """
+        parser = cls()
+        for chunk in iter(lambda: fp.read(chunk_size), ''):
+            parser.parser.Parse(chunk, False)
+            for flame in parser.flames:
+                yield flame
+            del parser.flames[:]
+        parser.parser.Parse('', True)
+        for flame in parser.flames:
+            yield flame
+
+def parse_colors(palette, colors):
+    """
+    Fill the float palette array `palette` from a list of `(index, rgb)`
+    pairs, the attribute strings of flam3 `<color>` elements, converting
+    them all with one call each.
+    """
+    idxs, rgbs = zip(*colors)
+    idx = np.fromstring(' '.join(idxs), np.int32, sep=' ')
+    rgb = np.fromstring(' '.join(rgbs), np.float32, sep=' ')
+    palette[idx,:3] = rgb.reshape(-1, 3) / np.float32(255)
+
+def parse_hex_palette(palette, text, count=256, format='RGB'):
+    """
+    Fill the first `count` entries of `palette` from the hex digits in
+    `text`, as found in a flam3 `<palette>` element. Whitespace is ignored,
+    as is alpha in the 'RGBA' format.
+    """
+    nbytes = {'RGB': 3, 'RGBA': 4}.get(format)
+    if nbytes is None:
+        raise ValueError('Unsupported palette format "%s"' % format)
+    try:
+        raw = str(''.join(text.split())).decode('hex')
+    except TypeError, e:
+        # Odd-length or non-hex text
+        raise ValueError('Bad palette: %s' % e)
+    raw = np.frombuffer(raw, np.uint8)
+    if len(raw) != count * nbytes:
+        raise ValueError('Palette has %d bytes, expected %d' %
+                         (len(raw), count * nbytes))
+    palette[:count,:3] = raw.reshape(count, nbytes)[:,:3] / np.float32(255)
+
 def convert_affine(aff, animate=False):
     xx, yx, xy, yy, xo, yo = vals = map(float, aff.split())
     if vals == [1, 0, 0, 1, 0, 0]: return None
@@ -172,14 +241,48 @@ def flam3_to_node(flame):
     n['type'] = 'node'
     return n
 
+def _convert_batch(flames):
+    return map(flam3_to_node, flames)
+
+def _iter_pooled(flames, processes, batch_size):
+    processes = processes or multiprocessing.cpu_count()
+    pool = multiprocessing.Pool(processes)
+    try:
+        pending = deque()
+        while True:
+            batch = list(itertools.islice(flames, batch_size))
+            if batch:
+                pending.append(pool.apply_async(_convert_batch, (batch,)))
+            if pending and (not batch or len(pending) > 2 * processes):
+                for node in pending.popleft().get():
+                    yield node
+            elif not batch:
+                break
+    finally:
+        pool.terminate()
+
+def iter_nodes(fp, processes=None, batch_size=32):
+    """
+    Yield a node for each flame in the flam3 XML file-like object `fp`, in
+    order, reading it incrementally. Flames are converted with
+    `flam3_to_node` on a pool of `processes` processes (one per CPU by
+    default, or 0 to convert them in this process), in batches of
+    `batch_size`. Only a few batches are in flight at once, so memory use
+    doesn't grow with the size of the file.
+    """
+    flames = XMLGenomeParser.iter_flames(fp)
+    if processes == 0:
+        return itertools.imap(flam3_to_node, flames)
+    return _iter_pooled(flames, processes, batch_size)
+
 def nodes_from_xml_path(path):
     """Quick one-shot conversion for an XML genome."""
-    flames = XMLGenomeParser.parse(open(path).read())
-    if len(flames) > 10:
-        warnings.warn("Lot of flames in this file. Sure it's not a "
-                      "frame-based animation?")
-    for flame in flames:
-        yield flam3_to_node(flame)
+    with open(path) as fp:
+        for i, node in enumerate(iter_nodes(fp, processes=0)):
+            if i == 10:
+                warnings.warn("Lot of flames in this file. Sure it's not a "
+                              "frame-based animation?")
+            yield node
 
 if __name__ == "__main__":
     import sys
@@ -1,7 +1,14 @@
 import os
 import json
+import errno
+import sqlite3
+import warnings
+import itertools
+from copy import deepcopy
+from collections import OrderedDict
 
 import convert
+from util import flatten
 
 class GenomeDB(object):
     """
@@ -12,6 +19,12 @@ class GenomeDB(object):
         self.stashed = {}
     def _get(self, id):
         raise NotImplementedError()
+    def _stamp(self, id):
+        """
+        Return a value that changes whenever the genome `id` does, such as
+        its modification time, or None if genomes never change.
+        """
+        return None
     def get(self, id):
         if id in self.stashed:
             return self.stashed[id]
@@ -19,6 +32,59 @@ class GenomeDB(object):
     def stash(self, id, gnm):
         self.stashed[id] = gnm
 
+    def ids(self):
+        """Return the IDs of every genome in the database, sorted."""
+        raise NotImplementedError()
+
+    def find(self, type=None, base=None, author=None):
+        """
+        Return the IDs of the genomes with the given `type`, `base` and
+        `author` (matched against the author's `user`, or failing that their
+        `name`), ignoring criteria that are None.
+
+        This implementation loads every genome to check it; backends with
+        indexes, like SQLiteDB, override it.
+        """
+        want = dict(type=type, base=base, author=author)
+        want = dict((k, v) for k, v in want.items() if v is not None)
+        return [id for id in self.ids()
+                if all(_index_fields(self.get(id))[k] == v
+                       for k, v in want.items())]
+
+    def edges(self):
+        """
+        Return `(edge_id, src, dst)` for every edge in the database, where
+        `src` and `dst` are the IDs of the nodes it links, with any temporal
+        offsets stripped.
+        """
+        out = []
+        for id in self.find(type='edge'):
+            fields = _index_fields(self.get(id))
+            out.append((id, fields['src'], fields['dst']))
+        return out
+
+    def edges_from(self, src):
+        """Return `(edge_id, dst)` for each edge leaving the node `src`."""
+        src = _strip_offset(src)
+        return [(id, d) for id, s, d in self.edges() if s == src]
+
+    def edges_to(self, dst):
+        """Return `(edge_id, src)` for each edge arriving at the node `dst`."""
+        dst = _strip_offset(dst)
+        return [(id, s) for id, s, d in self.edges() if d == dst]
+
+    def get_bases(self, id):
+        """
+        Return the chain of genomes that `id` is based on, as a list of
+        flattened dicts (see `util.flatten`), starting with the root and
+        ending with `id` itself.
+        """
+        gnm = self.get(id)
+        chain = []
+        if gnm.get('base') is not None:
+            chain = self.get_bases(gnm['base'])
+        return chain + [flatten(gnm)]
+
     def get_anim(self, name, half=False):
         """
         Given the identifier of any type of genome that can be converted to an
@@ -35,17 +101,22 @@ class GenomeDB(object):
             basename = head
 
         if os.path.isfile(name) and ext in ('flam3', 'flame'):
+            # Stop reading as soon as it's clear there's more than one flame
             with open(name) as fp:
-                gnm_str = fp.read()
-            flames = convert.XMLGenomeParser.parse(gnm_str)
-            if len(flames) != 1:
-                warnings.warn(
-                        '%d flames in file, only using one.' % len(flames))
+                flames = list(itertools.islice(
+                        convert.XMLGenomeParser.iter_flames(fp), 2))
+            if not flames:
+                raise ValueError('No flames in %s' % name)
+            if len(flames) > 1:
+                warnings.warn('Several flames in file, only using the first.')
             gnm = convert.flam3_to_node(flames[0])
         else:
             gnm = self.get(name)
 
-        if gnm['type'] == 'node':
+        if gnm['type'] == 'animation':
+            # `get` may have returned a dict that's shared with a cache
+            gnm = deepcopy(gnm)
+        elif gnm['type'] == 'node':
             gnm = convert.node_to_anim(self, gnm, half=half)
         elif gnm['type'] == 'edge':
             gnm = convert.edge_to_anim(self, gnm)
@@ -55,6 +126,7 @@ class GenomeDB(object):
 
 class OneFileDB(GenomeDB):
     def __init__(self, dct):
+        super(OneFileDB, self).__init__()
         assert dct.get('type') == 'onefiledb', "Doesn't look like a OneFileDB."
         self.dct = dct
 
@@ -63,23 +135,284 @@ class OneFileDB(GenomeDB):
         with open(path) as fp:
             return cls(json.load(fp))
 
-    def get(self, id):
+    def _get(self, id):
         return self.dct[id]
 
+    def ids(self):
+        return sorted(k for k in self.dct if k != 'type')
+
 class FilesystemDB(GenomeDB):
     def __init__(self, path):
+        super(FilesystemDB, self).__init__()
         self.path = path
 
-    def get(self, id):
+    def _path(self, id):
         if not id.endswith('.json'):
             id += '.json'
-        with open(os.path.join(self.path, id)) as fp:
+        return os.path.join(self.path, id)
+
+    def _get(self, id):
+        with open(self._path(id)) as fp:
             return json.load(fp)
 
-def connect(path):
+    def _stamp(self, id):
+        try:
+            return os.stat(self._path(id)).st_mtime
+        except OSError:
+            return None
+
+    def put(self, id, gnm):
+        """Write the genome `gnm` to the file for `id`."""
+        path = self._path(id)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as fp:
+            fp.write(convert.to_json(gnm))
+
+    def put_many(self, items):
+        """Write each `(id, gnm)` pair. Returns the number written."""
+        count = 0
+        for id, gnm in items:
+            self.put(id, gnm)
+            count += 1
+        return count
+
+    def ids(self):
+        out = []
+        for dir, subdirs, files in os.walk(self.path):
+            rel = os.path.relpath(dir, self.path)
+            for f in files:
+                if f.endswith('.json'):
+                    out.append(os.path.normpath(os.path.join(rel, f[:-5])))
+        return sorted(out)
+
+class SQLiteDB(GenomeDB):
+    """
+    Genomes stored as JSON documents in an SQLite database at `path`, with
+    indexes on type, base, link source and destination, and author, so
+    that `find` and the edge queries don't have to load every genome.
+
+    IDs are stored without any '.json' extension, as with FilesystemDB.
+    """
+    schema = """
+        CREATE TABLE IF NOT EXISTS genomes (
+            id TEXT PRIMARY KEY,
+            type TEXT,
+            base TEXT,
+            src TEXT,
+            dst TEXT,
+            author TEXT,
+            rev INTEGER NOT NULL,
+            doc TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS genomes_type ON genomes (type);
+        CREATE INDEX IF NOT EXISTS genomes_base ON genomes (base);
+        CREATE INDEX IF NOT EXISTS genomes_src ON genomes (src);
+        CREATE INDEX IF NOT EXISTS genomes_dst ON genomes (dst);
+        CREATE INDEX IF NOT EXISTS genomes_author ON genomes (author);
+    """
+    fields = ('type', 'base', 'src', 'dst', 'author')
+
+    def __init__(self, path):
+        super(SQLiteDB, self).__init__()
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(self.schema)
+
+    @staticmethod
+    def _id(id):
+        return id[:-5] if id.endswith('.json') else id
+
+    def _get(self, id):
+        row = self.conn.execute('SELECT doc FROM genomes WHERE id = ?',
+                                (self._id(id),)).fetchone()
+        if row is None:
+            raise IOError(errno.ENOENT, 'No such genome', id)
+        return json.loads(row[0])
+
+    def _stamp(self, id):
+        row = self.conn.execute('SELECT rev FROM genomes WHERE id = ?',
+                                (self._id(id),)).fetchone()
+        return row and row[0]
+
+    def ids(self):
+        return [r[0] for r in
+                self.conn.execute('SELECT id FROM genomes ORDER BY id')]
+
+    def put(self, id, gnm):
+        """Add the genome `gnm` as `id`, replacing any existing one."""
+        self.put_many([(id, gnm)])
+
+    def put_many(self, items):
+        """
+        Add each `(id, gnm)` pair from the iterable `items`, in a single
+        transaction. Returns the number of genomes added.
+        """
+        def rows():
+            for id, gnm in items:
+                id = self._id(id)
+                fields = _index_fields(gnm)
+                count[0] += 1
+                yield ((id,) + tuple(fields[k] for k in self.fields) +
+                       (id, json.dumps(gnm, separators=(',', ':'))))
+        count = [0]
+        with self.conn:
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO genomes VALUES (?, ?, ?, ?, ?, ?, '
+                'IFNULL((SELECT rev FROM genomes WHERE id = ?), 0) + 1, ?)',
+                rows())
+        return count[0]
+
+    def import_db(self, gdb):
+        """Copy every genome from the GenomeDB `gdb` into this database."""
+        return self.put_many((id, gdb.get(id)) for id in gdb.ids())
+
+    def find(self, type=None, base=None, author=None):
+        want = [(k, v) for k, v in zip(('type', 'base', 'author'),
+                                       (type, base, author)) if v is not None]
+        where = ' AND '.join(['%s = ?' % k for k, v in want]) or '1'
+        return [r[0] for r in self.conn.execute(
+                'SELECT id FROM genomes WHERE %s ORDER BY id' % where,
+                [v for k, v in want])]
+
+    def edges(self):
+        return [tuple(r) for r in self.conn.execute(
+                "SELECT id, src, dst FROM genomes WHERE type = 'edge' "
+                "ORDER BY id")]
+
+    def edges_from(self, src):
+        return self._edges('src', 'dst', src)
+
+    def edges_to(self, dst):
+        return self._edges('dst', 'src', dst)
+
+    def _edges(self, end, other, node):
+        return [tuple(r) for r in self.conn.execute(
+                "SELECT id, %s FROM genomes WHERE type = 'edge' AND %s = ? "
+                "ORDER BY id" % (other, end), (_strip_offset(node),))]
+
+class CachedDB(GenomeDB):
+    """
+    Wraps another GenomeDB, keeping the `maxsize` most recently used
+    genomes parsed in memory, along with the base chains built from them.
+    Every cached entry is checked against the backing database's `_stamp`
+    (the file modification times, for a FilesystemDB) when it's used, so
+    edits on disk are picked up.
+
+    Genomes returned from the cache are shared between callers, and must not
+    be modified. Cache performance is tallied in `stats`.
+    """
+    def __init__(self, db, maxsize=256):
+        super(CachedDB, self).__init__()
+        self.db, self.maxsize = db, maxsize
+        self.docs = OrderedDict()
+        self.chains = OrderedDict()
+        self.stats = dict.fromkeys(['hits', 'misses', 'stale',
+                                    'chain_hits', 'chain_misses'], 0)
+
+    def _put(self, cache, id, val):
+        cache[id] = val
+        while len(cache) > self.maxsize:
+            cache.popitem(last=False)
+
+    def _get(self, id):
+        # Stamp before loading, so a change made during the load is caught
+        # the next time around
+        stamp = self.db._stamp(id)
+        ent = self.docs.pop(id, None)
+        if ent is not None and ent[0] == stamp:
+            self.stats['hits'] += 1
+            gnm = ent[1]
+        else:
+            self.stats['misses'] += 1
+            if ent is not None:
+                self.stats['stale'] += 1
+            gnm = self.db.get(id)
+        self._put(self.docs, id, (stamp, gnm))
+        return gnm
+
+    def _stamp(self, id):
+        return self.db._stamp(id)
+
+    # Queries go straight to the backing database, to use its indexes
+    def ids(self):
+        return self.db.ids()
+
+    def find(self, type=None, base=None, author=None):
+        return self.db.find(type, base, author)
+
+    def edges(self):
+        return self.db.edges()
+
+    def edges_from(self, src):
+        return self.db.edges_from(src)
+
+    def edges_to(self, dst):
+        return self.db.edges_to(dst)
+
+    def stash(self, id, gnm):
+        super(CachedDB, self).stash(id, gnm)
+        self.chains.clear()
+
+    def _chain(self, id):
+        ent = self.chains.pop(id, None)
+        if ent is not None and all(self._stamp(i) == stamp
+                                   for i, stamp in ent[0]):
+            self.stats['chain_hits'] += 1
+        else:
+            self.stats['chain_misses'] += 1
+            stamp = self._stamp(id)
+            gnm = self.get(id)
+            ids, chain = [], []
+            if gnm.get('base') is not None:
+                ids, chain = self._chain(gnm['base'])
+            ent = (ids + [(id, stamp)], chain + [flatten(gnm)])
+        self._put(self.chains, id, ent)
+        return ent
+
+    def get_bases(self, id):
+        return list(self._chain(id)[1])
+
+def _strip_offset(id):
+    return id.split('@', 1)[0] if id is not None else None
+
+def _index_fields(gnm):
+    """Return the values that genome databases index `gnm` by."""
+    link = gnm.get('link') or {}
+    author = gnm.get('author') or (gnm.get('authors') or [{}])[0]
+    return dict(type=gnm.get('type'), base=gnm.get('base'),
+                src=_strip_offset(link.get('src')),
+                dst=_strip_offset(link.get('dst')),
+                author=author.get('user') or author.get('name'))
+
+SQLITE_SUFFIXES = ('.sqlite', '.sqlite3', '.db')
+
+def is_sqlite(path):
+    """
+    Whether `path` is an SQLite database, or names a file that doesn't
+    exist yet with an SQLite extension.
+    """
     if os.path.isfile(path):
-        return OneFileDB.read(path)
-    return FilesystemDB(path)
+        with open(path, 'rb') as fp:
+            return fp.read(16) == 'SQLite format 3\0'
+    return not os.path.exists(path) and path.endswith(SQLITE_SUFFIXES)
+
+def connect(path, cache_size=256):
+    """
+    Open the genome database at `path`: an SQLiteDB if it's an SQLite file
+    (see `is_sqlite`), a OneFileDB if it's some other file, or else a
+    FilesystemDB. Unless `cache_size` is 0, the database is wrapped in a
+    CachedDB of that size.
+    """
+    if is_sqlite(path):
+        gdb = SQLiteDB(path)
+    elif os.path.isfile(path):
+        gdb = OneFileDB.read(path)
+    else:
+        gdb = FilesystemDB(path)
+    if cache_size:
+        gdb = CachedDB(gdb, cache_size)
+    return gdb
 
 if __name__ == "__main__":
     import sys
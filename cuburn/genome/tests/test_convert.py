@@ -0,0 +1,116 @@
+import os
+import shutil
+import tempfile
+import unittest
+import warnings
+from cStringIO import StringIO
+import numpy as np
+
+from cuburn.genome import convert, db
+
+def flame_xml(i):
+    colors = ''.join('<color index="%d" rgb="%d %d %d"/>' % (c, c, i, 255 - c)
+                     for c in range(0, 256, 17))
+    return ('<flame name="f%d" size="640 480" center="%d 0" scale="%d" '
+            'rotate="%d" brightness="4">'
+            '<xform weight="0.5" color="0" linear="1" '
+            'coefs="1 0 0 1 %d 0"/>'
+            '<xform weight="0.25" color="1" spherical="0.5" julia="0.5" '
+            'coefs="0 1 -1 0 0 %d"/>%s</flame>') % (i, i, 100 + i, i,
+                                                     i, i, colors)
+
+def flames_xml(n):
+    return '<flames>%s</flames>' % ''.join(map(flame_xml, range(n)))
+
+class ReadCounter(object):
+    def __init__(self, data):
+        self.fp, self.nreads = StringIO(data), 0
+    def read(self, n):
+        self.nreads += 1
+        return self.fp.read(n)
+
+class StreamingImportTest(unittest.TestCase):
+    def setUp(self):
+        self.xml = flames_xml(40)
+        self.nodes = map(convert.flam3_to_node,
+                         convert.XMLGenomeParser.parse(self.xml))
+
+    def test_iter_flames(self):
+        src = ReadCounter(self.xml)
+        flames = convert.XMLGenomeParser.iter_flames(src, chunk_size=1000)
+        first = next(flames)
+        # Only as much of the file as the first flame is read
+        self.assertLess(src.nreads * 1000, len(self.xml) / 10)
+        nodes = map(convert.flam3_to_node, [first] + list(flames))
+        self.assertEqual(nodes, self.nodes)
+        self.assertEqual(nodes[3]['name'], 'f3')
+
+    def test_iter_nodes(self):
+        for procs in 0, 2:
+            nodes = convert.iter_nodes(StringIO(self.xml), procs, batch_size=3)
+            self.assertEqual(list(nodes), self.nodes)
+
+    def test_get_anim(self):
+        dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(dir, 'pack.flam3')
+            with open(path, 'w') as fp:
+                fp.write(flames_xml(3))
+            with warnings.catch_warnings(record=True) as caught:
+                warnings.simplefilter('always')
+                gnm, name = db.FilesystemDB(dir).get_anim(path)
+            self.assertEqual(len(caught), 1)
+            self.assertEqual((gnm['type'], name), ('animation', 'pack'))
+        finally:
+            shutil.rmtree(dir)
+
+class PaletteTest(unittest.TestCase):
+    def setUp(self):
+        rand = np.random.RandomState(0)
+        self.rgb = rand.randint(0, 256, (256, 3))
+
+    def parse(self, body):
+        xml = '<flame size="640 480" scale="1">%s</flame>' % body
+        return convert.XMLGenomeParser.parse(xml)[0]['palette']
+
+    def check(self, pal, rgb):
+        self.assertEqual(pal.dtype, np.float32)
+        self.assertTrue(np.allclose(pal[:,:3] * 255, rgb))
+        self.assertTrue(np.all(pal[:,3] == 1))
+
+    def test_colors(self):
+        # Out of order, and with a gap that keeps the default of white
+        rgb = self.rgb.copy()
+        rgb[7] = 255
+        body = ''.join('<color index="%d" rgb="%d %d %d"/>' % ((i,) + tuple(c))
+                       for i, c in reversed(list(enumerate(rgb))) if i != 7)
+        self.check(self.parse(body), rgb)
+
+    def test_hex(self):
+        digits = ''.join('%02X' % v for v in self.rgb.flat)
+        lines = '\n'.join('   ' + digits[i:i+48]
+                          for i in range(0, len(digits), 48))
+        body = '<palette count="256" format="RGB">\n%s\n</palette>' % lines
+        pal = self.parse(body)
+        self.check(pal, self.rgb)
+        node = convert.flam3_to_node(dict(size='640 480', scale='1',
+                                          xforms=[], palette=pal))
+        self.assertEqual(node['palette'][0], 'rgb8')
+
+    def test_hex_rgba(self):
+        rgba = np.hstack([self.rgb[:16], np.zeros((16, 1), int)])
+        digits = ''.join('%02x' % v for v in rgba.flat)
+        pal = self.parse('<palette count="16" format="RGBA">%s</palette>'
+                         % digits)
+        self.check(pal[:16], self.rgb[:16])
+        self.check(pal[16:], 255)
+
+    def test_bad_hex(self):
+        self.assertRaises(ValueError, self.parse,
+                          '<palette count="256" format="RGB">00ff</palette>')
+        self.assertRaises(ValueError, self.parse,
+                          '<palette count="1" format="BGR">000000</palette>')
+        self.assertRaises(ValueError, self.parse,
+                          '<palette count="1" format="RGB">00000</palette>')
+        self.assertRaises(ValueError, self.parse,
+                          '<palette count="1" format="RGB">00zz00</palette>')
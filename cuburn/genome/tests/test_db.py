@@ -0,0 +1,158 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+
+from cuburn.genome import db, blend
+
+def node(base=None, **kw):
+    gnm = dict(type='node', xforms={'0': {'weight': 1}}, **kw)
+    if base is not None:
+        gnm['base'] = base
+    return gnm
+
+class CachedDBTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.mtime = 1000000000
+        self.write('root', node(camera={'scale': 2}))
+        self.write('mid', node('root', camera={'rotation': 3}))
+        self.write('leaf', node('mid', camera={'rotation': 4}))
+        self.gdb = db.connect(self.dir, cache_size=3)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, id, gnm):
+        path = os.path.join(self.dir, id + '.json')
+        with open(path, 'w') as fp:
+            json.dump(gnm, fp)
+        # Make each write visible, however coarse the filesystem's clock
+        self.mtime += 1
+        os.utime(path, (self.mtime, self.mtime))
+
+    def test_docs(self):
+        self.assertIsInstance(self.gdb, db.CachedDB)
+        a = self.gdb.get('root')
+        self.assertIs(self.gdb.get('root'), a)
+        self.assertEqual((self.gdb.stats['hits'], self.gdb.stats['misses']),
+                         (1, 1))
+        self.write('root', node(camera={'scale': 5}))
+        self.assertEqual(self.gdb.get('root')['camera']['scale'], 5)
+        self.assertEqual(self.gdb.stats['stale'], 1)
+
+    def test_lru(self):
+        for id in ['root', 'mid', 'leaf', 'root', 'leaf.json']:
+            self.gdb.get(id)
+        # 'mid' was least recently used when 'leaf.json' came in
+        self.assertEqual(list(self.gdb.docs), ['leaf', 'root', 'leaf.json'])
+        self.gdb.get('mid')
+        self.assertEqual(self.gdb.stats['misses'], 5)
+
+    def test_bases(self):
+        out = blend.resolve(self.gdb, node('leaf', camera={'spp': 1}))
+        self.assertEqual(out['camera'],
+                         dict(scale=2, rotation=4, spp=1))
+        self.assertEqual(self.gdb.stats['chain_misses'], 3)
+        blend.resolve(self.gdb, node('leaf'))
+        blend.resolve(self.gdb, node('mid'))
+        self.assertEqual(self.gdb.stats['chain_hits'], 2)
+        self.assertEqual(self.gdb.stats['misses'], 3)
+        # A change anywhere along a chain invalidates it
+        self.write('root', node(camera={'scale': 7}))
+        out = blend.resolve(self.gdb, node('leaf'))
+        self.assertEqual(out['camera'], dict(scale=7, rotation=4))
+
+    def test_matches_uncached(self):
+        raw = db.connect(self.dir, cache_size=0)
+        self.assertIsInstance(raw, db.FilesystemDB)
+        self.assertEqual(raw.get_bases('leaf'), self.gdb.get_bases('leaf'))
+        self.assertEqual(self.gdb.get_anim('leaf')[0],
+                         raw.get_anim('leaf')[0])
+
+    def test_stash(self):
+        # Stashed genomes take precedence in every kind of database
+        raw = db.FilesystemDB(self.dir)
+        one = db.OneFileDB(dict(type='onefiledb', root=node()))
+        for gdb in raw, one, self.gdb:
+            gdb.get_bases('root')
+            gdb.stash('root', node(camera={'scale': 9}))
+            self.assertEqual(gdb.get_bases('root')[-1]['camera.scale'], 9)
+
+def edge(src, dst, **kw):
+    return dict(type='edge', link=dict(src=src, dst=dst), **kw)
+
+class SQLiteDBTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.dir, 'fs'))
+        self.genomes = {
+            'a': node(author=dict(name='Ann', user='ann@example.com')),
+            'b': node('a', author=dict(name='Bob')),
+            'c': node('a'),
+            'a=b': edge('a', 'b@0.5', author=dict(name='Bob')),
+            'a=c': edge('a@0.25', 'c'),
+            'c=a': edge('c', 'a', base='a=c'),
+        }
+        for id, gnm in self.genomes.items():
+            with open(os.path.join(self.dir, 'fs', id + '.json'), 'w') as fp:
+                json.dump(gnm, fp)
+        self.path = os.path.join(self.dir, 'genomes.sqlite')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def imported(self):
+        gdb = db.SQLiteDB(self.path)
+        src = db.FilesystemDB(os.path.join(self.dir, 'fs'))
+        self.assertEqual(gdb.import_db(src), len(self.genomes))
+        return gdb
+
+    def test_connect(self):
+        one = os.path.join(self.dir, 'one.json')
+        with open(one, 'w') as fp:
+            json.dump(dict(self.genomes, type='onefiledb'), fp)
+        for path, cls in [(os.path.join(self.dir, 'fs'), db.FilesystemDB),
+                          (one, db.OneFileDB), (self.path, db.SQLiteDB)]:
+            self.assertIsInstance(db.connect(path, cache_size=0), cls)
+        # Once created, a database is recognized by content, not name
+        renamed = os.path.join(self.dir, 'genomes')
+        os.rename(self.path, renamed)
+        self.assertIsInstance(db.connect(renamed).db, db.SQLiteDB)
+        self.assertEqual(db.connect(one).ids(), sorted(self.genomes))
+
+    def test_import(self):
+        gdb = self.imported()
+        self.assertEqual(gdb.ids(), sorted(self.genomes))
+        for id, gnm in self.genomes.items():
+            self.assertEqual(gdb.get(id), gnm)
+            self.assertEqual(gdb.get(id + '.json'), gnm)
+        self.assertRaises(IOError, gdb.get, 'missing')
+        # Reopening finds the same documents
+        self.assertEqual(db.SQLiteDB(self.path).get('a=b'),
+                         self.genomes['a=b'])
+
+    def test_queries(self):
+        # Every backend answers queries the same way, with or without indexes
+        sql = self.imported()
+        for gdb in [sql, db.connect(self.path),
+                    db.FilesystemDB(os.path.join(self.dir, 'fs'))]:
+            self.assertEqual(gdb.find(type='node'), ['a', 'b', 'c'])
+            self.assertEqual(gdb.find(base='a'), ['b', 'c'])
+            self.assertEqual(gdb.find(type='edge', author='Bob'), ['a=b'])
+            self.assertEqual(gdb.find(author='ann@example.com'), ['a'])
+            self.assertEqual(gdb.edges_from('a'), [('a=b', 'b'), ('a=c', 'c')])
+            self.assertEqual(gdb.edges_from('c@0.5'), [('c=a', 'a')])
+            self.assertEqual(gdb.edges_to('a'), [('c=a', 'c')])
+            self.assertEqual(gdb.edges()[0], ('a=b', 'a', 'b'))
+
+    def test_put(self):
+        gdb = self.imported()
+        cached = db.CachedDB(gdb)
+        cached.get_bases('b')
+        stamp = gdb._stamp('a')
+        gdb.put('a', node(camera={'scale': 3}))
+        self.assertNotEqual(gdb._stamp('a'), stamp)
+        self.assertEqual(cached.get_bases('b')[0]['camera.scale'], 3)
+        self.assertEqual(gdb.find(author='ann@example.com'), [])
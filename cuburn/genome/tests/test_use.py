@@ -0,0 +1,148 @@
+import unittest
+import numpy as np
+
+from cuburn.genome import use
+
+def random_knots(rand):
+    n = 2 + 2 * rand.randint(0, 6)
+    knots = list(rand.uniform(-2, 2, n))
+    if n > 4:
+        knots[4::2] = sorted(rand.uniform(-0.5, 1.5, (n - 4) / 2))
+    return knots
+
+def reference_eval(knots, t, deriv=0):
+    """The original scalar evaluator for linear splines, as a reference."""
+    mat = np.matrix([[1.,-2, 1, 0], [2,-3, 0, 1],
+                     [1,-1, 0, 0], [-2, 3, 0, 0]])
+    idx = np.searchsorted(knots[0], t) - 2
+    idx = max(0, min(idx, len(knots[0]) - 4))
+    times, vals = knots[0][idx:idx+4], knots[1][idx:idx+4]
+    scale = 1 / (times[2] - times[1])
+    t, times = (t - times[1]) * scale, (times - times[1]) * scale
+    m1 = (vals[2] - vals[0]) / (1.0 - times[0])
+    m2 = (vals[3] - vals[1]) / times[3]
+    if deriv:
+        mat = mat * (scale * np.matrix(np.diag([3,2,1], 1))) ** deriv
+    val = [m1, vals[1], m2, vals[2]] * mat * np.array([[t**3, t**2, t, 1]]).T
+    return val[0,0]
+
+def device_catmull_rom(times, knots, t, mag=False):
+    """
+    One packed spline evaluated at each time in ``t`` as the device's
+    ``catmull_rom_base`` does it, step for step, as a reference.
+    """
+    # ``bitwise_binsearch`` finds the rightmost knot strictly before ``t``
+    idx = np.searchsorted(times, t) - 1
+    idx = np.clip(idx, 1, len(times) - 3)
+
+    t1 = times[idx]
+    rt2 = 1 / (times[idx+1] - t1)
+    t0, t3 = (times[idx-1] - t1) * rt2, (times[idx+2] - t1) * rt2
+    t = (t - t1) * rt2
+
+    k0, k1, k2, k3 = [knots[idx+i] for i in range(-1, 3)]
+    m1, m2 = (k2 - k0) / (1 - t0), (k3 - k1) / t3
+
+    if mag:
+        m1, m2 = use.linslope(k1, m1), use.linslope(k2, m2)
+        k1, k2 = use.linlog(k1), use.linlog(k2)
+
+    tt = t * t
+    ttt = tt * t
+    r = (m1 * (ttt - 2*tt + t) + k1 * (2*ttt - 3*tt + 1)
+       + m2 * (ttt - tt) + k2 * (-2*ttt + 3*tt))
+    if mag:
+        r = use.linexp(r)
+    return np.float32(r)
+
+class SplineBatchTest(unittest.TestCase):
+    def setUp(self):
+        self.rand = np.random.RandomState(0)
+        self.splines = [(random_knots(self.rand), interp)
+                        for i in range(20) for interp in ('linear', 'mag')]
+        self.t = self.rand.uniform(0, 1, 50)
+
+    def test_matches_reference(self):
+        batch = use.SplineBatch(self.splines, scale=2)
+        for deriv in range(3):
+            out = batch(self.t, deriv)
+            self.assertEqual(out.shape, (len(self.splines), len(self.t)))
+            for row, (knots, interp) in zip(out, self.splines):
+                if interp != 'linear':
+                    continue
+                knots = use.SplineEval.normalize(knots, 2)
+                expected = [reference_eval(knots, t, deriv) for t in self.t]
+                self.assertTrue(np.allclose(row, expected))
+
+    def test_scalar_matches_batch(self):
+        # Single times take a separate path through plain floats
+        batch = use.SplineBatch(self.splines, scale=2)
+        for deriv in range(3):
+            out = batch(self.t, deriv)
+            for row, (knots, interp) in zip(out, self.splines):
+                sp = use.SplineEval(knots, 2, interp)
+                scalar = [sp(t, deriv) for t in self.t]
+                self.assertTrue(all(isinstance(v, float) for v in scalar))
+                self.assertTrue(np.allclose(row, scalar))
+
+    def test_derivatives(self):
+        batch = use.SplineBatch(self.splines)
+        h = 1e-4
+        for i, (knots, interp) in enumerate(self.splines):
+            # Catmull-Rom splines are only C1 at knots, so stay clear of them
+            ktimes = batch.times[i][batch.times[i] < 1e9]
+            t = np.array([x for x in self.t
+                          if np.min(np.abs(ktimes - x)) > 2 * h])
+            val = lambda x: batch(x)[i]
+            d1 = (val(t + h) - val(t - h)) / (2 * h)
+            d2 = (val(t + h) - 2 * val(t) + val(t - h)) / h ** 2
+            self.assertTrue(np.allclose(batch(t, 1)[i], d1, rtol=1e-4,
+                                        atol=1e-4))
+            self.assertTrue(np.allclose(batch(t, 2)[i], d2, rtol=1e-3,
+                                        atol=1e-3))
+
+    def test_mag_constant(self):
+        sp = use.SplineEval(3.5, 1, 'mag')
+        self.assertAlmostEqual(sp(0.3), 3.5)
+        self.assertAlmostEqual(sp(0.3, 1), 0)
+
+    def test_matches_device_arithmetic(self):
+        # Packed float32 arrays, as uploaded to the device
+        times, knots = use.pack_splines(
+                [use.SplineEval.normalize(k, 1) for k, i in self.splines], 32)
+        times, knots = np.float32(times), np.float32(knots)
+        t = np.float32(self.t)
+        out = use.eval_splines(times, knots, t,
+                               [i == 'mag' for k, i in self.splines])
+        for row, tr, kr, (k, i) in zip(out, times, knots, self.splines):
+            expected = device_catmull_rom(tr, kr, t, i == 'mag')
+            self.assertTrue(np.allclose(row, expected, rtol=1e-5, atol=1e-6))
+
+class SplineSetTest(unittest.TestCase):
+    def setUp(self):
+        self.gnm = dict(type='animation', time=dict(duration=2),
+                        camera=dict(scale=[0.5, 0.2, 1.5, -0.1],
+                                    rotation=[10, 0, 30, 1, 0.5, 45]))
+        self.wrapped = use.SplineWrapper(self.gnm, scale=2)
+
+    def test_values(self):
+        cam = self.wrapped.camera
+        for name in ('scale', 'rotation'):
+            sp = use.SplineEval(self.gnm['camera'][name], 2,
+                                getattr(cam, name).interp)
+            for t in (0, 0.3, 0.7):
+                self.assertAlmostEqual(getattr(cam, name)(t), sp(t))
+                self.assertAlmostEqual(getattr(cam, name)(t, 1), sp(t, 1))
+
+    def test_shared(self):
+        splines = self.wrapped._params['splines']
+        for t in (0.2, 0.4):
+            for i in range(3):
+                self.wrapped.camera.scale(t)
+                self.wrapped.camera.rotation(t)
+        self.assertEqual(len(splines), 2)
+        # Scaled copies, as RefScalars make, are kept apart
+        sp = self.wrapped.camera.scale
+        sp *= 3
+        self.assertAlmostEqual(sp(0.4), 3 * self.wrapped.camera.scale(0.4))
+        self.assertEqual(len(splines), 3)
@@ -1,3 +1,5 @@
+import math
+import bisect
 import numpy as np
 
 from spectypes import Enum, Spline, Scalar, RefScalar, Map, List
@@ -113,16 +115,199 @@ class SplineWrapper(Wrapper):
     """
     Wrapper that handles splines. Must provide a 'scale' object
     (normally, equal to duration) as a kwarg to __init__.
+
+    The splines read through one wrapper (and the wrappers it creates) are
+    evaluated at scalar times together, by a shared `SplineSet`.
     """
+    def __init__(self, val, spec=None, path=(), **params):
+        params.setdefault('splines', SplineSet(params['scale']))
+        super(SplineWrapper, self).__init__(val, spec, path, **params)
+
     def wrap_spline(self, path, spec, val):
-        return SplineEval(val if val is not None else spec.default,
-                          self._params['scale'], spec.interp)
+        return WrappedSpline(self._params['splines'], path,
+                             val if val is not None else spec.default,
+                             spec.interp)
 
-class SplineEval(object):
-    _mat = np.matrix([[1.,-2, 1, 0], [2,-3, 0, 1],
-                      [1,-1, 0, 0], [-2, 3, 0, 0]])
-    _deriv = np.matrix(np.diag([3,2,1], 1))
+# See ``catmullromlib`` in `cuburn.code.interp` for the meaning of these.
+ELBOW = 0.0625
+ELOG1 = 5.0
+
+def linlog(x):
+    """Transform from linear to magnitude domain."""
+    ax = np.maximum(np.abs(x), ELBOW)
+    return np.where(np.abs(x) > ELBOW, np.sign(x) * (np.log2(ax) + ELOG1),
+                    x / ELBOW)
+
+def linexp(v, deriv=0):
+    """Reverse of ``linlog``, or its first or second derivative."""
+    av = np.maximum(np.abs(v), 1)
+    big = np.abs(v) >= 1
+    if deriv == 0:
+        return np.where(big, np.sign(v) * np.exp2(av - ELOG1), v * ELBOW)
+    if deriv == 1:
+        return np.where(big, np.log(2) * np.exp2(av - ELOG1), ELBOW)
+    return np.where(big, np.sign(v) * np.log(2) ** 2 * np.exp2(av - ELOG1), 0)
+
+def linslope(x, m):
+    return m / np.maximum(np.abs(x), ELBOW)
+
+def _linlog1(x):
+    """`linlog` for a single float."""
+    if abs(x) > ELBOW:
+        return math.copysign(math.log(abs(x), 2) + ELOG1, x)
+    return x / ELBOW
+
+def _linexp1(v, deriv=0):
+    """`linexp` for a single float."""
+    if abs(v) < 1:
+        return (v * ELBOW, ELBOW, 0.)[deriv]
+    e = 2 ** (abs(v) - ELOG1)
+    return (math.copysign(e, v), math.log(2) * e,
+            math.copysign(math.log(2) ** 2 * e, v))[deriv]
+
+def pack_splines(knots, width=None):
+    """
+    Pack a list of normalized knot arrays (as returned by
+    ``SplineEval.normalize``) into two dense arrays of times and values,
+    shaped ``(len(knots), width)``. As in `GenomePacker.pack`, unused times
+    are padded with 1e9.
+    """
+    width = width or max(k.shape[1] for k in knots)
+    times = np.empty((len(knots), width))
+    times.fill(1e9)
+    vals = np.zeros((len(knots), width))
+    for i, k in enumerate(knots):
+        times[i,:k.shape[1]], vals[i,:k.shape[1]] = k
+    return times, vals
+
+def eval_splines(times, knots, t, mag=False, deriv=0):
+    """
+    Evaluate many packed splines at many times in one call.
+
+    ``times`` and ``knots`` are arrays shaped ``(nsplines, nknots)``, as
+    returned by ``pack_splines`` or `GenomePacker.pack`. ``t`` is an array of
+    times, and ``mag`` is a bool or per-spline array selecting magnitude-domain
+    interpolation. Returns the value (or ``deriv``th derivative with respect to
+    time) of each spline at each time, shaped ``(nsplines, len(t))``.
+
+    The segment search and the arithmetic follow the device's
+    ``catmull_rom_base`` step for step, so evaluating float32 inputs gives
+    the same values as ``catmull_rom`` and ``catmull_rom_mag``.
+    """
+    times, knots = np.atleast_2d(times), np.atleast_2d(knots)
+    t = np.asarray(t, dtype=knots.dtype).reshape(-1)
+    rows = np.arange(len(times))[:,None]
+
+    # Rightmost knot strictly before 't', as found by ``bitwise_binsearch``
+    nvalid = np.sum(times < 1e9, axis=1)[:,None]
+    if len(t) == 1:
+        idx = np.sum(times < t, axis=1)[:,None] - 1
+    else:
+        idx = np.array([np.searchsorted(row, t) for row in times]) - 1
+    idx = np.clip(idx, 1, np.maximum(nvalid - 3, 1))
+
+    t1 = times[rows,idx]
+    rt2 = 1 / (times[rows,idx+1] - t1)
+    t0 = (times[rows,idx-1] - t1) * rt2
+    t3 = (times[rows,idx+2] - t1) * rt2
+    tn = (t - t1) * rt2
+
+    k0, k1, k2, k3 = [knots[rows,idx+i] for i in range(-1, 3)]
+    m1, m2 = (k2 - k0) / (1 - t0), (k3 - k1) / t3
+
+    mag = np.broadcast_to(np.asarray(mag, bool).reshape(-1, 1), k1.shape)
+    if mag.any():
+        m1 = np.where(mag, linslope(k1, m1), m1)
+        m2 = np.where(mag, linslope(k2, m2), m2)
+        k1 = np.where(mag, linlog(k1), k1)
+        k2 = np.where(mag, linlog(k2), k2)
+
+    # Coefficients of the cubic in normalized time, highest order first
+    coefs = [m1 + 2*k1 + m2 - 2*k2, -2*m1 - 3*k1 - m2 + 3*k2, m1, k1]
+    def poly(d):
+        cs = coefs
+        for i in range(d):
+            cs = [c * (len(cs) - j - 1) for j, c in enumerate(cs[:-1])]
+        r = np.zeros_like(tn)
+        for c in cs:
+            r = r * tn + c
+        return r * rt2 ** d
+
+    r = poly(deriv)
+    if mag.any():
+        if deriv > 2:
+            raise ValueError('Magnitude splines support up to 2 derivatives')
+        v = poly(0)
+        if deriv == 0:
+            rm = linexp(v)
+        elif deriv == 1:
+            rm = linexp(v, 1) * r
+        else:
+            rm = linexp(v, 2) * poly(1) ** 2 + linexp(v, 1) * r
+        r = np.where(mag, rm, r)
+    return r
+
+class SplineBatch(object):
+    """
+    A group of genome splines, packed once and evaluated together.
+    ``splines`` is a list of ``(value, interp)`` pairs, where each value is in
+    the form accepted by ``SplineEval``.
+    """
+    def __init__(self, splines, scale=1):
+        self.times, self.knots = pack_splines(
+                [SplineEval.normalize(v, scale) for v, i in splines])
+        self.mag = np.array([i == 'mag' for v, i in splines], bool)
+
+    @classmethod
+    def from_knots(cls, knots, interps):
+        """Create a batch from already normalized knot arrays."""
+        batch = cls.__new__(cls)
+        batch.times, batch.knots = pack_splines(knots)
+        batch.mag = np.array([i == 'mag' for i in interps], bool)
+        return batch
+
+    def __len__(self):
+        return len(self.times)
 
+    def __call__(self, t, deriv=0):
+        return eval_splines(self.times, self.knots, t, self.mag, deriv)
+
+class SplineSet(object):
+    """
+    The splines read from one wrapped genome or profile. Rendering a frame
+    reads a few dozen of these, all at the same time; the first read at a new
+    time evaluates every spline seen so far with one `SplineBatch` call, and
+    the rest are lookups. Knots are normalized once per spline, so changes
+    to the underlying genome aren't seen by a set which has read it.
+    """
+    def __init__(self, scale=1):
+        self.scale = scale
+        self.index, self.knots, self.interps = {}, [], []
+        self.batch = self._t = self._vals = None
+
+    def __len__(self):
+        return len(self.knots)
+
+    def add(self, key, knots, interp):
+        """Add the normalized ``knots`` under ``key`` if not already there,
+        and return their position in the set."""
+        if key not in self.index:
+            self.index[key] = len(self.knots)
+            self.knots.append(knots)
+            self.interps.append(interp)
+            self.batch = None
+        return self.index[key]
+
+    def value(self, idx, t):
+        """Return the value at time ``t`` of the spline at ``idx``."""
+        if self.batch is None:
+            self.batch = SplineBatch.from_knots(self.knots, self.interps)
+            self._t = None
+        if t != self._t:
+            self._t, self._vals = t, self.batch([t])[:,0].tolist()
+        return self._vals[idx]
+
+class SplineEval(object):
     def __init__(self, knots, scale, interp='linear'):
         self.knots, self.interp = self.normalize(knots, scale), interp
 
@@ -157,32 +342,48 @@ class SplineEval(object):
         knotarray.T[:] = knots
         return knotarray
 
-    def find_knots(self, itime):
-        idx = np.searchsorted(self.knots[0], itime) - 2
-        idx = max(0, min(idx, len(self.knots[0]) - 4))
-
-        times = self.knots[0][idx:idx+4]
-        vals = self.knots[1][idx:idx+4]
-        # Normalize to [0,1]
-        t = itime - times[1]
-        times = times - times[1]
-        scale = 1 / times[2]
-        t = t * scale
-        times = times * scale
-        return times, vals, t, scale
-
     def __call__(self, itime, deriv=0):
-        # TODO: respect 'interp' THIS IS IMPORTANT.
-        times, vals, t, scale = self.find_knots(itime)
+        """
+        Evaluate at ``itime``, which may be a scalar or an array of times.
+        """
+        if np.ndim(itime):
+            return eval_splines(self.knots[0], self.knots[1], itime,
+                                self.interp == 'mag', deriv)[0]
+        return self._eval_scalar(float(itime), deriv)
+
+    def _eval_scalar(self, t, deriv):
+        # The same search and arithmetic as `eval_splines`, on plain floats,
+        # since this is called for single times far more often than not
+        times = self.knots[0].tolist()
+        idx = bisect.bisect_left(times, t) - 1
+        idx = min(max(idx, 1), max(len(times) - 3, 1))
+        t0, t1, t2, t3 = times[idx-1:idx+3]
+        k0, k1, k2, k3 = self.knots[1,idx-1:idx+3].tolist()
 
-        m1 = (vals[2] - vals[0]) / (1.0 - times[0])
-        m2 = (vals[3] - vals[1]) / times[3]
+        rt2 = 1 / (t2 - t1)
+        tn = (t - t1) * rt2
+        m1 = (k2 - k0) / (1 - (t0 - t1) * rt2)
+        m2 = (k3 - k1) / ((t3 - t1) * rt2)
+        mag = self.interp == 'mag'
+        if mag:
+            if deriv > 2:
+                raise ValueError('Magnitude splines support up to 2 '
+                                 'derivatives')
+            m1, m2 = m1 / max(abs(k1), ELBOW), m2 / max(abs(k2), ELBOW)
+            k1, k2 = _linlog1(k1), _linlog1(k2)
 
-        mat = self._mat
-        if deriv:
-            mat = mat * (scale * self._deriv) ** deriv
-        val = [m1, vals[1], m2, vals[2]] * mat * np.array([[t**3, t**2, t, 1]]).T
-        return val[0,0]
+        # The cubic and its derivatives with respect to time
+        a, b = m1 + 2*k1 + m2 - 2*k2, -2*m1 - 3*k1 - m2 + 3*k2
+        v = ((a*tn + b)*tn + m1)*tn + k1
+        d1 = ((3*a*tn + 2*b)*tn + m1) * rt2
+        d2 = (6*a*tn + 2*b) * rt2 ** 2
+        if not mag:
+            return (v, d1, d2, 6*a * rt2 ** 3, 0.)[min(deriv, 4)]
+        if deriv == 0:
+            return _linexp1(v)
+        if deriv == 1:
+            return _linexp1(v, 1) * d1
+        return _linexp1(v, 2) * d1 ** 2 + _linexp1(v, 1) * d2
 
     def __imul__(self, other):
         self.knots[1] *= other
@@ -194,8 +395,42 @@ class SplineEval(object):
         r = x[1] - x[0]
         plt.figure(fig)
         plt.title(name)
-        plt.plot(x,map(self,x),x,[self(i,1) for i in x],'--',
+        plt.plot(x,self(x),x,self(x,1),'--',
                  self.knots[0],self.knots[1],'x')
         plt.xlim(0.0, 1.0)
         if show:
             plt.show()
+
+class WrappedSpline(SplineEval):
+    """
+    A spline read through a `SplineWrapper`. Single values go through the
+    wrapper's `SplineSet`, and the knots are only normalized here when
+    something else is asked of the spline.
+    """
+    def __init__(self, splines, path, value, interp):
+        self.splines, self.path, self.value = splines, path, value
+        self.interp, self.factor = interp, 1
+        self._knots = self._idx = None
+
+    @property
+    def knots(self):
+        if self._knots is None:
+            self._knots = self.normalize(self.value, self.splines.scale)
+            self._knots[1] *= self.factor
+        return self._knots
+
+    def __call__(self, itime, deriv=0):
+        if deriv or np.ndim(itime):
+            return super(WrappedSpline, self).__call__(itime, deriv)
+        if self._idx is None:
+            key = (self.path, self.factor)
+            self._idx = self.splines.index.get(key)
+            if self._idx is None:
+                self._idx = self.splines.add(key, self.knots, self.interp)
+        return self.splines.value(self._idx, float(itime))
+
+    def __imul__(self, other):
+        # Scaled splines (as for RefScalars) are kept apart in the set
+        self.factor *= other
+        self._knots = self._idx = None
+        return self
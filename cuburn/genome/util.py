@@ -58,10 +58,9 @@ def hash(gnm):
     compilation; if two genomes has equally, their iteration kernels may be
     shared.
     """
-    # For now, this has to be kept in sync with the code manually. This is
-    # easy, since the only thing which we depend on when compiling is the
-    # presence or absence of certain keys, but enumerated parameters may play
-    # into it at some point in the future.
+    # This has to be kept in sync with the code manually, and is stricter
+    # than it needs to be. Use `cuburn.code.iter.kernel_key` to decide
+    # whether a compiled module can be shared.
     return sha1('\n'.join(flatten(gnm).keys())).hexdigest()
 
 def resolve_spec(sp, path):
@@ -1,7 +1,7 @@
 import os
 import tempfile
-from cStringIO import StringIO
 from subprocess import Popen, PIPE
+from cStringIO import StringIO
 import numpy as np
 from numpy import float32 as f32, int32 as i32
 
@@ -9,6 +9,7 @@ import pycuda.driver as cuda
 
 from code.util import ClsMod, launch
 from code.output import pixfmtlib
+import writer
 
 import scipy.misc
 
@@ -29,6 +30,14 @@ def launchC(name, mod, stream, dim, fb, *args):
             *args)
 
 class Output(object):
+    # If True, `encode` keeps no state between frames, so frames may be
+    # encoded concurrently and in any order (see `writer.EncoderPool`).
+    parallel = False
+    # If True, `encode` returns each media segment piecewise as the encoder
+    # produces it, and the pieces for each channel must be appended to one
+    # another until the flush (see `writer.StreamedFiles`).
+    stream = False
+
     def convert(self, fb, gnm, dim, stream=None):
         """
         Convert a filtered buffer to whatever output format is needed by the
@@ -65,6 +74,9 @@ class Output(object):
 
         Media segments are discretely decodeable chunks of content. The
         mapping of media segments to individual frames is not specified.
+        When `stream` is set, each call instead returns whatever part of the
+        current segment is ready, and a channel's segment is only complete
+        (and decodeable) once the pipeline has been flushed.
         """
         raise NotImplementedError()
 
@@ -79,6 +91,7 @@ class Output(object):
 
 class PILOutput(Output, ClsMod):
     lib = pixfmtlib
+    parallel = True
 
     def __init__(self, codec='jpeg', quality=100, alpha=False):
         super(PILOutput, self).__init__()
@@ -94,11 +107,7 @@ class PILOutput(Output, ClsMod):
         return h_out
 
     def _convert_buf(self, buf):
-        out = StringIO()
-        img = scipy.misc.toimage(buf, cmin=0, cmax=1)
-        img.save(out, self.type, quality=self.quality)
-        out.seek(0)
-        return out
+        return writer.encode_image(buf, self.type, self.quality)
 
     def encode(self, buf):
         if buf is None: return {}, []
@@ -128,8 +137,9 @@ class X264Output(Output, ClsMod):
             '--rc-lookahead 5 --muxer raw -o - - --log-level debug')
 
     def __init__(self, profile='normal', csp='i444', crf=15,
-                 command='x264', x264opts='', alpha=False):
+                 command='x264', x264opts='', alpha=False, stream=False):
         super(X264Output, self).__init__()
+        self.stream = stream
         self.args = ' '.join([command, self.base, self.profiles[profile],
                               '--crf', str(crf), x264opts]).split()
         self.alpha = alpha
@@ -140,6 +150,7 @@ class X264Output(Output, ClsMod):
         self.outf = None
         self.asubp = None
         self.aoutf = None
+        self.staging = writer.StagingBuffers()
 
     def convert(self, fb, gnm, dim, stream=None):
         launchC('f32_to_rgba_u16', self.mod, stream, dim, fb,
@@ -154,13 +165,11 @@ class X264Output(Output, ClsMod):
         res = '%dx%d' % (framesize[1], framesize[0])
         csp = 'yv12' if alpha else 'rgb'
         extras = ['--input-csp', csp, '--demuxer', 'raw', '--input-res', res]
-        outf = tempfile.TemporaryFile(bufsize=0)
         if alpha:
             extras += ['--output-csp', 'i420', '--chroma-qp-offset', '24']
         else:
             extras += ['--output-csp', self.csp]
-        subp = Popen(self.args + extras, stdin=PIPE, stderr=PIPE, stdout=outf)
-        return outf, subp
+        return _spawn_encoder(self.args + extras, self.stream)
 
     def _spawn(self, framesize):
         self.framesize = framesize
@@ -171,43 +180,17 @@ class X264Output(Output, ClsMod):
             self.zeros = np.empty(bufsz, dtype='u2')
             self.zeros.fill(32767)
 
-    def _flush_sub(self, subp):
-        if gevent is not None:
-            # Use non-blocking poll to allow applications to continue
-            # rendering in other coros
-            subp.stdin.close()
-            log = ''
-            while subp.poll() is None:
-                log += subp.stderr.read()
-                gevent.sleep(0.1)
-            log += subp.stderr.read()
-        else:
-            (stdout, log) = subp.communicate()
-        if subp.returncode:
-            raise IOError("x264 exited with an error")
-        return log
-
     def _flush(self):
         if self.subp is None:
             return {}, []
-        log = self._flush_sub(self.subp)
-        self.outf.seek(0)
+        outf, log = _flush_encoder(self.outf, self.subp, 'x264')
         self.subp = None
         if self.alpha:
-            alog = self._flush_sub(self.asubp)
-            self.aoutf.seek(0)
+            aoutf, alog = _flush_encoder(self.aoutf, self.asubp, 'x264')
             self.asubp = None
-            return ({'_color.h264': self.outf, '_alpha.h264': self.aoutf},
+            return (_media({'_color.h264': outf, '_alpha.h264': aoutf}),
                     [('x264_color', log), ('x264_alpha', alog)])
-        return {'.h264': self.outf}, [('x264_color', log)]
-
-    def _write(self, buf, subp):
-        try:
-            subp.stdin.write(buffer(buf))
-        except IOError, e:
-            print 'Exception while writing. Log:'
-            print subp.stderr.read()
-            raise e
+        return _media({'.h264': outf}), [('x264_color', log)]
 
     def encode(self, buf):
         out = ({}, [])
@@ -217,11 +200,23 @@ class X264Output(Output, ClsMod):
             return out
         if self.subp is None:
             self._spawn(buf.shape[:2])
-        self._write(np.delete(buf, 3, axis=2), self.subp)
+        # Drop alpha into a buffer that's reused from frame to frame
+        rgb = self.staging.get('rgb', buf.shape[:2] + (3,), buf.dtype)
+        np.copyto(rgb, buf[:,:,:3])
+        chunks = {self.suffix: _write_encoder(self.outf, self.subp, rgb)}
         if self.alpha:
-            self._write(buf[:,:,3].tostring(), self.asubp)
-            self._write(buffer(self.zeros), self.asubp)
-        return out
+            alpha = self.staging.get('alpha', buf.shape[:2], buf.dtype)
+            np.copyto(alpha, buf[:,:,3])
+            chunks['_alpha.h264'] = _write_encoder(self.aoutf, self.asubp,
+                                                   alpha, self.zeros)
+        if not self.stream:
+            return out
+        # Output from a new encoder after a change of frame size is appended
+        # to the flushed stream; raw H.264 elementary streams concatenate.
+        media, log = out
+        for suffix, file_like in media.items():
+            chunks[suffix] = file_like.read() + chunks[suffix]
+        return _media(chunks), log
 
     @property
     def suffix(self):
@@ -234,18 +229,25 @@ class VPxOutput(Output, ClsMod):
     base = ('vpxenc --end-usage=3 -p 1 -q --cpu-used=-8 --lag-in-frames=5 '
             '--min-q=2 --disable-kf --arnr-maxframes=3 -o - -')
 
-    def __init__(self, codec='vp9', fps=24, crf=15, pix_fmt='yuv420p'):
+    def __init__(self, codec='vp9', fps=24, crf=15, pix_fmt='yuv420p',
+                 chroma_threads=1, stream=False):
         super(VPxOutput, self).__init__()
+        self.stream = stream
         self.codec = codec
         self.pix_fmt = pix_fmt
 
         self.dim = None
         self.subp = None
         self.outf = None
+        self.subsample = None
 
         self.args = self.base.split()
         if pix_fmt == 'yuv420p':
+            # Chroma is subsampled on the host
             self.out_filter = 'f32_to_yuv444p'
+            self.subsample = writer.ChromaSubsampler(chroma_threads)
+        elif pix_fmt == 'yuv420p8':
+            self.out_filter = 'f32_to_yuv420p8'
         else:
             assert codec == 'vp9'
             if pix_fmt == 'yuv444p':
@@ -281,7 +283,7 @@ class VPxOutput(Output, ClsMod):
         if self.pix_fmt in ('yuv444p10', 'yuv420p10', 'yuv444p12'):
             fmt = 'u2'
         dims =  (3, dim.h, dim.w)
-        if self.pix_fmt == 'yuv420p10':
+        if self.pix_fmt in ('yuv420p8', 'yuv420p10'):
             dims = (dim.h * dim.w * 6 / 4,)
         h_out = pool.allocate(dims, fmt)
         cuda.memcpy_dtoh_async(h_out, fb.d_back, stream)
@@ -293,66 +295,104 @@ class VPxOutput(Output, ClsMod):
         if num_columns:
             extras.append('--tile-columns=%d' % num_columns)
 
-        self.outf = tempfile.TemporaryFile(bufsize=0)
-        self.subp = Popen(map(str, self.args + extras),
-                          stdin=PIPE, stderr=PIPE, stdout=self.outf)
-
-    def _flush_sub(self, subp):
-        if gevent is not None:
-            # Use non-blocking poll to allow applications to continue
-            # rendering in other coros
-            subp.stdin.close()
-            log = ''
-            while subp.poll() is None:
-                log += subp.stderr.read()
-                gevent.sleep(0.1)
-            log += subp.stderr.read()
-        else:
-            (stdout, log) = subp.communicate()
-        if subp.returncode:
-            raise IOError("vpxenc exited with an error")
-        return log
+        self.outf, self.subp = _spawn_encoder(map(str, self.args + extras),
+                                              self.stream)
 
     def _flush(self):
         if self.subp is None:
             return {}, []
-        log = self._flush_sub(self.subp)
-        self.outf.seek(0)
+        outf, log = _flush_encoder(self.outf, self.subp, 'vpxenc')
         self.subp = None
-        return {'.webm': self.outf}, [('webm', log)]
-
-    def _write(self, buf, subp):
-        try:
-            subp.stdin.write(buffer(buf))
-        except IOError, e:
-            print 'Exception while writing. Log:'
-            print subp.stderr.read()
-            raise e
+        return _media({'.webm': outf}), [('webm', log)]
 
     def encode(self, buf):
-        out = ({}, [])
         if buf is None:
             return self._flush()
         if self.subp is None:
             self._spawn()
-        if self.pix_fmt == 'yuv420p':
-            # Perform terrible chroma subsampling
-            self._write(buf[0].tostring(), self.subp)
-            self._write(buf[1,::2,::2].tostring(), self.subp)
-            self._write(buf[2,::2,::2].tostring(), self.subp)
+        if self.subsample is not None:
+            chunk = _write_encoder(self.outf, self.subp,
+                                   buf[0], self.subsample(buf[1:]))
         else:
-            self._write(buf, self.subp)
-        return out
+            chunk = _write_encoder(self.outf, self.subp, buf)
+        return _media({'.webm': chunk}), []
 
     @property
     def suffix(self):
         return '.webm'
 
 
+def _spawn_encoder(args, stream):
+    """
+    Start an encoder that reads raw frames on stdin and writes the encoded
+    stream to stdout. Returns ``(outf, subp)``, where ``outf`` is the
+    temporary file the output is spooled to or, if ``stream`` is set, a
+    `writer.PipePump` that hands it back as it is produced.
+
+    The encoder's stderr is drained as it's written, into a bounded
+    `writer.LogRing` kept as ``subp.log``; x264 logs at debug level, and a
+    full stderr pipe would otherwise stall it partway through a long shard.
+    """
+    if stream:
+        subp = Popen(args, stdin=PIPE, stderr=PIPE, stdout=PIPE)
+        pump = writer.PipePump(subp)
+        subp.log = pump.log
+        return pump, subp
+    outf = tempfile.TemporaryFile(bufsize=0)
+    subp = Popen(args, stdin=PIPE, stderr=PIPE, stdout=outf)
+    subp.log = writer.LogDrainer(subp.stderr)
+    return outf, subp
+
+def _write_encoder(outf, subp, *planes):
+    """
+    Write ``planes`` to an encoder started by `_spawn_encoder`, returning
+    any output that's ready (which is always empty when spooling).
+    """
+    try:
+        if isinstance(outf, writer.PipePump):
+            return outf.write(*planes)
+        writer.write_planes(subp.stdin, *planes)
+        return ''
+    except IOError, e:
+        print 'Exception while writing. Log:'
+        print subp.log.getvalue()
+        raise e
+
+def _flush_encoder(outf, subp, name):
+    """
+    Finish encoding, returning ``(out, log)``. ``out`` is the spooled file,
+    rewound, or the rest of the output as a string when streaming.
+    """
+    if isinstance(outf, writer.PipePump):
+        out = outf.close()
+        log = outf.read_log()
+    else:
+        subp.stdin.close()
+        if gevent is not None:
+            # Use non-blocking poll to allow applications to continue
+            # rendering in other coros
+            while subp.poll() is None:
+                gevent.sleep(0.1)
+        else:
+            subp.wait()
+        log = subp.log.join()
+        outf.seek(0)
+        out = outf
+    if subp.returncode:
+        raise IOError("%s exited with an error" % name)
+    return out, log
+
+def _media(segments):
+    # Streamed chunks are strings, and empty ones are left out
+    return dict((k, StringIO(v) if isinstance(v, str) else v)
+                for k, v in segments.items() if not isinstance(v, str) or v)
+
 def get_output_for_profile(gprof):
     opts = dict(gprof.output._val)
     handler = opts.pop('type', 'jpeg')
     if handler in ('jpeg', 'png', 'tiff'):
+        # Each image is complete as soon as it's encoded anyway
+        opts.pop('stream', None)
         return PILOutput(codec=handler, **opts)
     elif handler == 'x264':
         return X264Output(**opts)
@@ -58,6 +58,9 @@ def add_args(parser=None):
 
     out = parser.add_argument_group('Output options')
     out.add_argument('--codec', choices=['jpeg', 'png', 'tiff', 'x264', 'vp8', 'vp9'])
+    out.add_argument('--stream', action='store_true',
+        help="Write video output as it is encoded, instead of spooling each "
+             "segment to a temporary file first")
     return parser
 
 def get_from_args(args):
@@ -78,6 +81,8 @@ def get_from_args(args):
             base[arg] = getattr(args, arg)
     if args.codec is not None:
         base.setdefault('output', {})['type'] = args.codec
+    if getattr(args, 'stream', False):
+        base.setdefault('output', {})['stream'] = True
 
     return name, base
 
@@ -0,0 +1,206 @@
+"""
+A ring of raw frames in a memory-mapped file, for live previews.
+
+The renderer writes each host frame into the next of a fixed number of
+slots in place, and viewers map the same file and read the latest complete
+frame straight out of it, so following a render costs no file rewrites or
+renames. Nothing here needs CUDA.
+
+File layout (all integers little-endian):
+
+    0     header: magic, version, slot count, dtype and frame shape
+    128   u64 sequence number of the latest complete frame (0 if none)
+    192   per slot, u64 pairs: sequence numbers at the start and end of
+          the last write to the slot
+    ...   slots, each starting on a page boundary
+
+Sequence numbers start at 1, and frame ``seq`` goes in slot ``seq % nslots``.
+The writer stamps a slot's start number before copying a frame in and its
+end number afterwards, so a reader can tell a complete frame from one being
+overwritten (this relies on aligned 8-byte stores being atomic and kept in
+order, as they are on x86).
+"""
+
+import os
+import mmap
+import struct
+import tempfile
+
+import numpy as np
+
+MAGIC = 'CBRAWRNG'
+VERSION = 1
+HEADER = struct.Struct('<8sIII4x16sQ4Q')
+HEAD_OFFSET = 128
+SLOTS_OFFSET = 192
+MAX_DIMS = 4
+
+def _align(n, to=mmap.PAGESIZE):
+    return (n + to - 1) / to * to
+
+class _Layout(object):
+    def __init__(self, shape, dtype, nslots):
+        self.shape, self.dtype = tuple(shape), np.dtype(dtype)
+        self.nslots = nslots
+        if len(self.shape) > MAX_DIMS:
+            raise ValueError('Frames may have at most %d dimensions'
+                             % MAX_DIMS)
+        self.frame_bytes = int(np.prod(self.shape)) * self.dtype.itemsize
+        self.slot_bytes = _align(self.frame_bytes)
+        self.data_offset = _align(SLOTS_OFFSET + 16 * nslots)
+        self.size = self.data_offset + nslots * self.slot_bytes
+
+    def pack(self):
+        shape = self.shape + (0,) * (MAX_DIMS - len(self.shape))
+        return HEADER.pack(MAGIC, VERSION, self.nslots, len(self.shape),
+                           self.dtype.str, self.slot_bytes, *shape)
+
+    @classmethod
+    def unpack(cls, data):
+        fields = HEADER.unpack_from(data)
+        magic, version, nslots, ndim, dtype = fields[:5]
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('Not a version %d raw frame ring' % VERSION)
+        return cls(fields[6:6+ndim], dtype.rstrip('\0'), nslots)
+
+    def views(self, mm):
+        head = np.ndarray((1,), '<u8', mm, HEAD_OFFSET)
+        seqs = np.ndarray((self.nslots, 2), '<u8', mm, SLOTS_OFFSET)
+        frames = [np.ndarray(self.shape, self.dtype, mm,
+                             self.data_offset + i * self.slot_bytes)
+                  for i in range(self.nslots)]
+        return head, seqs, frames
+
+class RingWriter(object):
+    """
+    Writes frames to the ring file at ``path``, with ``nslots`` slots.
+
+    The file is created when the first frame arrives, and replaced (by an
+    atomic rename, so readers can notice and reopen it) whenever the shape
+    or type of the frames changes.
+    """
+    def __init__(self, path, nslots=3):
+        if nslots < 2:
+            raise ValueError('A ring needs at least two slots')
+        self.path, self.nslots = path, nslots
+        self.layout = self.mm = None
+        self.seq = 0
+
+    def _create(self, shape, dtype):
+        self.close()
+        layout = _Layout(shape, dtype, self.nslots)
+        fd, tmp = tempfile.mkstemp(prefix='.tmp-',
+                                   dir=os.path.dirname(self.path) or '.')
+        try:
+            os.ftruncate(fd, layout.size)
+            os.write(fd, layout.pack())
+            self.mm = mmap.mmap(fd, layout.size)
+            os.rename(tmp, self.path)
+        except:
+            os.unlink(tmp)
+            raise
+        finally:
+            os.close(fd)
+        self.layout = layout
+        self.head, self.seqs, self.frames = layout.views(self.mm)
+        self.seq = 0
+
+    def write(self, buf):
+        """Copy the host frame ``buf`` into the next slot. Returns its
+        sequence number."""
+        if (self.layout is None or buf.shape != self.layout.shape
+                or buf.dtype != self.layout.dtype):
+            self._create(buf.shape, buf.dtype)
+        seq = self.seq + 1
+        slot = seq % self.nslots
+        self.seqs[slot, 0] = seq
+        np.copyto(self.frames[slot], buf)
+        self.seqs[slot, 1] = seq
+        self.head[0] = self.seq = seq
+        return seq
+
+    def close(self):
+        """Unmap the ring. The file is left in place for readers."""
+        if self.mm is not None:
+            self.head = self.seqs = self.frames = None
+            self.mm.close()
+            self.mm = None
+
+class RingReader(object):
+    """
+    Reads frames from a ring file written by `RingWriter`.
+
+    Frames are returned as read-only arrays mapped onto the file, not
+    copies. The writer will eventually reuse a frame's slot, so a viewer
+    that takes its time over a frame should check `is_current` once it's
+    done with it (or use `copy_latest`).
+    """
+    def __init__(self, path):
+        self.path = path
+        self.mm = None
+        self._open()
+
+    def _open(self):
+        # An old mapping stays alive for as long as any frames from it do
+        with open(self.path, 'rb') as fp:
+            self.ino = os.fstat(fp.fileno()).st_ino
+            self.mm = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        self.layout = _Layout.unpack(self.mm)
+        self.head, self.seqs, self.frames = self.layout.views(self.mm)
+
+    @property
+    def shape(self):
+        return self.layout.shape
+
+    @property
+    def dtype(self):
+        return self.layout.dtype
+
+    def reopen_if_replaced(self):
+        """Follow the path to a new ring file, as made when the frame
+        format changes. Returns True if the ring was reopened."""
+        try:
+            if os.stat(self.path).st_ino == self.ino:
+                return False
+        except OSError:
+            return False
+        self._open()
+        return True
+
+    def latest(self):
+        """
+        Return ``(seq, frame)`` for the newest complete frame, or ``(0,
+        None)`` if none have been written.
+        """
+        self.reopen_if_replaced()
+        while True:
+            seq = int(self.head[0])
+            if not seq:
+                return 0, None
+            slot = seq % self.layout.nslots
+            if self.seqs[slot, 1] == seq and self.seqs[slot, 0] == seq:
+                return seq, self.frames[slot]
+            # Lapped by the writer between reading the head and the slot
+
+    def is_current(self, seq):
+        """Whether the slot holding frame ``seq`` is yet to be reused, so
+        that whatever was read from it since `latest` is intact."""
+        return self.seqs[seq % self.layout.nslots, 0] == seq
+
+    def copy_latest(self):
+        """Like `latest`, but returns a private copy of the frame."""
+        while True:
+            seq, frame = self.latest()
+            if frame is None:
+                return seq, frame
+            frame = frame.copy()
+            if self.is_current(seq):
+                return seq, frame
+
+    def close(self):
+        """Unmap the ring. Frames returned from it must not be used
+        afterwards."""
+        if self.mm is not None:
+            self.head = self.seqs = self.frames = None
+            self.mm.close()
+            self.mm = None
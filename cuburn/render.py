@@ -18,10 +18,11 @@ import filters
 import output
 from code import util, mwc, iter, interp, sort
 from code.util import ClsMod, devlib, filldptrlib, assemble_code, launch
-from cuburn.genome.util import palette_decode
+from cuburn.cpu import interp as host_interp
+from cuburn.cpu.interp import PaletteCache
 
 RenderedImage = namedtuple('RenderedImage', 'buf idx gpu_time')
-Dimensions = namedtuple('Dimensions', 'w h aw ah astride')
+Dimensions = util.Dimensions
 
 class DurationEvent(cuda.Event):
     """
@@ -80,10 +81,7 @@ class Framebuffers(object):
         include at least enough gutter to exceed the minimum, and where
         (acc_width % 32) == 0 and (acc_height % 8) == 0.
         """
-        awidth = width + 2 * cls.gutter
-        aheight = 8 * int(np.ceil((height + 2 * cls.gutter) / 8.))
-        astride = 32 * int(np.ceil(awidth / 32.))
-        return Dimensions(width, height, awidth, aheight, astride)
+        return util.calc_dim(width, height, cls.gutter)
 
     def __init__(self):
         self.stream = cuda.Stream()
@@ -133,8 +131,9 @@ class Framebuffers(object):
             # If a frame that's too large sneaks by the task distributor, we
             # don't want to kill the server, but we also don't want to leave
             # it stuck without any free memory to complete the next alloc.
-            # TODO: measure free mem and only take tasks that fit (but that
-            # should be done elsewhere)
+            # (The dist server only routes tasks to workers with room for
+            # them, by `cuburn.dispatch.frame_footprint`, which should be
+            # kept in step with the allocations here.)
             self.free(stream)
             raise e
 
@@ -208,6 +207,24 @@ class DevInfo(object):
                 format=cuda.array_format.SIGNED_INT32,
                 num_channels=2, flags=cuda.array3d_flags.SURFACE_LDST)
         self.d_pal_array = cuda.Array(self.palette_surf_dsc)
+        # Pinned host buffers which are uploaded into the above when
+        # interpolating on the host, and an event marking the last upload
+        self._staging = {}
+        self.upload_evt = None
+
+    def staging(self, name, shape, dtype, pool):
+        """
+        Return the pinned host buffer ``name``, to be filled and then copied
+        to the device asynchronously. The contents change every frame, so
+        this first waits for the last upload from these buffers to finish.
+        """
+        if self.upload_evt is not None:
+            self.upload_evt.synchronize()
+            self.upload_evt = None
+        buf = self._staging.get(name)
+        if buf is None or buf.shape != shape or buf.dtype != dtype:
+            buf = self._staging[name] = pool.allocate(shape, dtype)
+        return buf
 
 class Renderer(object):
     # Unloading a module triggers a context sync. To keep the renderer
@@ -234,19 +251,33 @@ class Renderer(object):
     def __init__(self, gnm, gprof):
         self.packer, self.lib, self.cubin = self.compile(gnm)
         self.mod = self.load(self.cubin)
+        self.set_profile(gprof)
+
+    def set_profile(self, gprof):
+        """Create the filters and output module for ``gprof``. Tasks with
+        different profiles may share a kernel, but not these."""
         self.filts = filters.create(gprof)
         self.out = output.get_output_for_profile(gprof)
 
 class RenderManager(ClsMod):
     lib = devlib(deps=[interp.palintlib, filldptrlib, iter.flushatomlib])
 
-    def __init__(self):
+    def __init__(self, host_interp=False):
+        """
+        If ``host_interp`` is True, the temporal samples of the iteration
+        parameters and the palette rows are computed on the host and
+        uploaded, instead of with ``interp_iter_params`` and
+        ``interp_palette_flat`` kernel launches.
+        """
         super(RenderManager, self).__init__()
+        self.host_interp = host_interp
         self.fb = Framebuffers()
         self.src_a, self.src_b = DevSrc(), DevSrc()
         self.info_a, self.info_b = DevInfo(), DevInfo()
         self.stream_a, self.stream_b = cuda.Stream(), cuda.Stream()
         self.filt_evt = self.copy_evt = None
+        self.palettes = PaletteCache(max_knots=DevSrc.max_knots)
+        self._dither = np.random.RandomState()
 
     def _copy(self, rdr, gnm):
         """
@@ -257,16 +288,20 @@ class RenderManager(ClsMod):
         the genome that was used when creating the renderer.
         """
         times, knots = rdr.packer.pack(gnm, self.fb.pool)
+        self.src_a.packed = times, knots
         cuda.memcpy_htod_async(self.src_a.d_times, times, self.stream_a)
         cuda.memcpy_htod_async(self.src_a.d_knots, knots, self.stream_a)
 
-        palsrc = dict([(v[0], palette_decode(v[1:])) for v in gnm['palette']])
-        ptimes, pvals = zip(*sorted(palsrc.items()))
-        palettes = self.fb.pool.allocate((len(palsrc), 256, 4), f32)
-        palettes[:] = pvals
-        palette_times = self.fb.pool.allocate((self.src_a.max_knots,), f32)
-        palette_times.fill(1e9)
-        palette_times[:len(ptimes)] = ptimes
+        # Palettes are decoded and pinned once per genome, not per frame
+        pal = self.palettes.get(gnm)
+        self.src_a.palettes = pal
+        if self.host_interp:
+            return
+        if pal.pinned is None:
+            pal.pinned = [self.fb.pool.allocate(a.shape, a.dtype)
+                          for a in (pal.times, pal.rgba)]
+            pal.pinned[0][:], pal.pinned[1][:] = pal.times, pal.rgba
+        palette_times, palettes = pal.pinned
         cuda.memcpy_htod_async(self.src_a.d_pals, palettes, self.stream_a)
         cuda.memcpy_htod_async(self.src_a.d_ptimes, palette_times,
                                self.stream_a)
@@ -279,6 +314,20 @@ class RenderManager(ClsMod):
         p_dim[:] = dim
         cuda.memcpy_htod_async(d_acc_size, p_dim, self.stream_a)
 
+        nts = self.info_a.ntemporal_samples
+        if self.host_interp:
+            self._upload_palette(ts, td)
+            times, knots = self.src_a.packed
+            params = host_interp.interp_iter_params(rdr.packer, times, knots,
+                                                    dim, ts, td / nts, nts)
+            h_params = self.info_a.staging('params', params.shape,
+                                           params.dtype, self.fb.pool)
+            h_params[:] = params
+            cuda.memcpy_htod_async(self.info_a.d_params, h_params,
+                                   self.stream_a)
+            self.info_a.upload_evt = cuda.Event().record(self.stream_a)
+            return
+
         tref = self.mod.get_surfref('flatpal')
         tref.set_array(self.info_a.d_pal_array, 0)
         launch('interp_palette_flat', self.mod, self.stream_a,
@@ -286,14 +335,32 @@ class RenderManager(ClsMod):
                 self.fb.d_rb, self.fb.d_seeds,
                 self.src_a.d_ptimes, self.src_a.d_pals,
                 f32(ts), f32(td / self.info_a.palette_height))
-
-        nts = self.info_a.ntemporal_samples
         launch('interp_iter_params', rdr.mod, self.stream_a,
                 256, np.ceil(nts / 256.),
                 self.info_a.d_params, self.src_a.d_times, self.src_a.d_knots,
                 f32(ts), f32(td / nts), i32(nts))
         #self._print_interp_knots(rdr)
 
+    def _upload_palette(self, ts, td):
+        """
+        Blend, dither and pack the palette rows for a frame on the host, and
+        copy them into the ``flatpal`` surface in place of an
+        ``interp_palette_flat`` launch. The caller records the upload event.
+        """
+        height = self.info_a.palette_height
+        rows = self.src_a.palettes.blend(ts, td / height, height)
+        noise = self._dither.uniform(-1, 1, rows.shape[:-1] + (3,))
+        packed = host_interp.pack_palette(rows, noise)
+        h_pal = self.info_a.staging('palette', packed.shape, packed.dtype,
+                                    self.fb.pool)
+        h_pal[:] = packed
+        cp = cuda.Memcpy2D()
+        cp.set_src_host(h_pal)
+        cp.set_dst_array(self.info_a.d_pal_array)
+        cp.width_in_bytes = cp.src_pitch = h_pal.strides[0]
+        cp.height = height
+        cp(self.stream_a)
+
     def _print_interp_knots(self, rdr, tsidx=5):
         infos = cuda.from_device(self.info_a.d_params,
                 (tsidx + 1, len(rdr.packer)), f32)
@@ -0,0 +1,62 @@
+"""
+Scheduling of frames on the device.
+
+Nothing here touches CUDA directly, so the logic can be exercised with any
+object that looks like a CUDA event.
+"""
+
+from collections import deque
+
+_DONE = object()
+
+class FrameScheduler(object):
+    """
+    Keeps up to ``depth`` frames queued on the device at once.
+
+    ``queue`` is called as ``queue(job)`` for each job to be rendered, and
+    must return an ``(evt, buf)`` pair as `RenderManager.queue_frame` does,
+    where ``evt`` has the ``query()`` and ``synchronize()`` methods of a CUDA
+    event.
+
+    Frames are handed back in the order they were queued. Before a completed
+    frame is handed back, the next job is queued in its place, so that
+    whatever the caller does with the frame (encoding, saving) overlaps with
+    the device rendering the frames after it.
+    """
+    def __init__(self, queue, depth=2):
+        if depth < 1:
+            raise ValueError('Queue depth must be at least 1')
+        self.queue, self.depth = queue, depth
+        self.inflight = deque()
+
+    def _fill(self, jobs):
+        while len(self.inflight) < self.depth:
+            job = next(jobs, _DONE)
+            if job is _DONE:
+                return
+            evt, buf = self.queue(job)
+            self.inflight.append((job, evt, buf))
+
+    def frames(self, jobs, block=True):
+        """
+        Iterate over ``(job, evt, buf)`` for each job in ``jobs``, in order,
+        as each completes.
+
+        If ``block`` is True, wait for each frame with ``evt.synchronize()``.
+        Otherwise, yield None whenever the oldest frame is still pending,
+        so that the caller can service an event loop in the meantime.
+        """
+        jobs = iter(jobs)
+        while True:
+            self._fill(jobs)
+            if not self.inflight:
+                return
+            job, evt, buf = self.inflight[0]
+            if block:
+                evt.synchronize()
+            else:
+                while not evt.query():
+                    yield None
+            self.inflight.popleft()
+            self._fill(jobs)
+            yield job, evt, buf
@@ -0,0 +1,373 @@
+import os
+import time
+import shutil
+import tempfile
+import unittest
+import multiprocessing
+
+from cuburn import dispatch
+from cuburn.code import util
+
+MB = 1 << 20
+
+class FootprintTest(unittest.TestCase):
+    def test_frame(self):
+        dim = util.calc_dim(1920, 1080, 12)
+        self.assertEqual(dispatch.frame_footprint(1920, 1080),
+                         48 * dim.ah * dim.astride + dispatch.FIXED_FOOTPRINT)
+        # About 110 MB for 1080p, and not quite four times that at 4K
+        self.assertTrue(100 * MB < dispatch.frame_footprint(1920, 1080)
+                        < 120 * MB)
+        self.assertTrue(380 * MB < dispatch.frame_footprint(3840, 2160)
+                        < 400 * MB)
+
+    def test_fixed(self):
+        # Mostly the two sets of iteration parameters
+        self.assertTrue(8 * MB < dispatch.FIXED_FOOTPRINT < 12 * MB)
+
+class WorkerPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.pool = dispatch.WorkerPool(reserve=0)
+
+    def add(self, addr, mem=None):
+        self.pool.join(addr, None if mem is None else dict(mem=mem))
+        self.pool.put(addr)
+
+    def test_order(self):
+        self.add('a', 100)
+        self.add('b', 100)
+        self.assertEqual(self.pool.take(50), 'a')
+        self.pool.put('a')
+        self.assertEqual(self.pool.take(50), 'b')
+        self.assertEqual(self.pool.take(50), 'a')
+        self.assertIsNone(self.pool.take(50))
+
+    def test_fit(self):
+        self.add('small', 100)
+        self.add('big', 400)
+        self.assertFalse(self.pool.can_run(500))
+        self.assertTrue(self.pool.can_run(300))
+        # Too big for the first ready worker, so it goes to the second
+        self.assertEqual(self.pool.take(300), 'big')
+        # A large task waits for the big worker rather than taking the
+        # small one
+        self.assertIsNone(self.pool.take(300))
+        self.assertEqual(self.pool.ready, ['small'])
+
+    def test_best_fit(self):
+        self.add('big', 400)
+        self.add('small', 100)
+        self.add('medium', 200)
+        self.assertEqual(self.pool.take(50), 'small')
+        self.assertEqual(self.pool.take(50), 'medium')
+        self.assertEqual(self.pool.take(50), 'big')
+
+    def test_unknown(self):
+        # Nothing's known until a worker joins
+        self.assertIsNone(self.pool.can_run(100))
+        # Workers which don't advertise their memory take anything, but
+        # only once workers that fit have been tried
+        self.pool.put('old')
+        self.add('new', 1000)
+        self.assertTrue(self.pool.can_run(1 << 40))
+        self.assertEqual(self.pool.take(100), 'new')
+        self.assertEqual(self.pool.take(100), 'old')
+
+    def test_reserve(self):
+        pool = dispatch.WorkerPool(reserve=64 * MB)
+        pool.join('gpu', dict(mem=1024 * MB, mem_total=2048 * MB))
+        pool.put('gpu')
+        self.assertEqual(pool.capacity('gpu'), 960 * MB)
+        size = dispatch.frame_footprint(3840, 2160)
+        self.assertEqual(pool.take(size), 'gpu')
+        pool.put('gpu')
+        self.assertIsNone(pool.take(dispatch.frame_footprint(7680, 4320)))
+        self.assertFalse(pool.can_run(dispatch.frame_footprint(7680, 4320)))
+
+class SchedulerTest(unittest.TestCase):
+    def setUp(self):
+        self.pool = dispatch.WorkerPool(reserve=0)
+
+    def run_tasks(self, sched, addrs):
+        out = []
+        for addr in addrs:
+            self.pool.put(addr)
+            out += sched.assign()
+        return out
+
+    def warm(self, addr, hash):
+        self.pool.join(addr)
+        self.pool.assigned(addr, hash)
+
+    def test_affinity(self):
+        self.warm('a', 'x')
+        self.warm('b', 'y')
+        sched = dispatch.Scheduler(self.pool)
+        sched.add('y1', 'y', 0)
+        sched.add('x1', 'x', 0)
+        self.assertEqual(self.run_tasks(sched, ['a', 'b']),
+                         [('a', 'x1'), ('b', 'y1')])
+        self.assertEqual(self.pool.hit_rates(), dict(a=0.5, b=0.5))
+
+    def test_window(self):
+        # Only 'a' is around, with 'x' loaded; 'y' can only be passed over
+        # twice before it gets its turn
+        self.warm('a', 'x')
+        sched = dispatch.Scheduler(self.pool, window=2)
+        for item in ['y1', 'x1', 'x2', 'x3']:
+            sched.add(item, item[0], 0)
+        got = [item for addr, item in self.run_tasks(sched, 'aaaa')]
+        self.assertEqual(got, ['x1', 'x2', 'y1', 'x3'])
+
+    def test_in_order(self):
+        self.warm('a', 'x')
+        sched = dispatch.Scheduler(self.pool, window=0)
+        sched.add('y1', 'y', 0)
+        self.assertTrue(sched.full())
+        sched.add('x1', 'x', 0)
+        got = [item for addr, item in self.run_tasks(sched, 'aa')]
+        self.assertEqual(got, ['y1', 'x1'])
+
+    def test_avoid(self):
+        # A cold task goes to the fresh worker, leaving 'a' for the 'x'
+        # task behind it
+        self.warm('a', 'x')
+        self.pool.join('c')
+        sched = dispatch.Scheduler(self.pool, window=1)
+        sched.add('y1', 'y', 0)
+        sched.add('x1', 'x', 0)
+        self.pool.put('a')
+        self.pool.put('c')
+        self.assertEqual(sched.assign(), [('c', 'y1'), ('a', 'x1')])
+
+    def test_memory(self):
+        self.pool.join('small', dict(mem=100))
+        self.pool.join('big', dict(mem=400))
+        sched = dispatch.Scheduler(self.pool, window=4)
+        sched.add('huge', 'x', 1000)
+        sched.add('large', 'y', 300)
+        sched.add('little', 'z', 50)
+        self.assertEqual(sched.drop_unroutable(), ['huge'])
+        self.assertEqual(self.run_tasks(sched, ['small', 'big']),
+                         [('small', 'little'), ('big', 'large')])
+        self.assertEqual(len(sched), 0)
+
+    def test_forced_warm(self):
+        # The oldest task still prefers a worker with its kernel loaded
+        self.warm('a', 'x')
+        self.warm('b', 'y')
+        sched = dispatch.Scheduler(self.pool, window=0)
+        sched.add('y1', 'y', 0)
+        self.pool.put('a')
+        self.pool.put('b')
+        self.assertEqual(sched.assign(), [('b', 'y1')])
+
+    def test_archs(self):
+        self.pool.join('kepler', dict(arch='sm_35'))
+        self.pool.join('maxwell', dict(arch='sm_52'))
+        self.assertEqual(self.pool.archs(), set(['sm_35', 'sm_52']))
+        sched = dispatch.Scheduler(self.pool)
+        sched.add('x1', 'x', 0, archs=['sm_52'])
+        self.pool.put('kepler')
+        self.assertEqual(sched.assign(), [])
+        self.pool.put('maxwell')
+        self.assertEqual(sched.assign(), [('maxwell', 'x1')])
+
+    def test_compiling(self):
+        # A task still compiling doesn't hold up one that's ready, nor
+        # count against the window
+        self.pool.join('a')
+        sched = dispatch.Scheduler(self.pool, window=1)
+        sched.add('x1', 'x', 0, archs=())
+        self.assertFalse(sched.full())
+        sched.add('y1', 'y', 0)
+        self.assertTrue(sched.full())
+        self.assertEqual(self.run_tasks(sched, 'a'), [('a', 'y1')])
+        self.assertEqual(sched.items(), ['x1'])
+        self.assertEqual(sched.drop_uncompiled(lambda hash: True), [])
+        sched.compiled('x', 'sm_35')
+        self.assertEqual(self.run_tasks(sched, 'a'), [('a', 'x1')])
+
+    def test_failed(self):
+        sched = dispatch.Scheduler(self.pool)
+        sched.add('x1', 'x', 0, archs=())
+        sched.add('y1', 'y', 0, archs=())
+        self.assertEqual(sched.drop_uncompiled(lambda hash: hash == 'y'),
+                         ['x1'])
+        self.assertEqual(sched.items(), ['y1'])
+
+def stub_compile(anim, arch):
+    if anim.get('fail'):
+        raise ValueError('bad genome')
+    time.sleep(anim.get('delay', 0))
+    return 'packer', 'lib', 'cubin for %s on %s' % (anim['name'], arch)
+
+class FakeResult(object):
+    def __init__(self, fn, args):
+        self.fn, self.args = fn, args
+        self.done = False
+    def ready(self):
+        return self.done
+    def get(self):
+        return self.fn(*self.args)
+
+class FakePool(object):
+    def __init__(self):
+        self.calls = []
+    def apply_async(self, fn, args):
+        self.calls.append(FakeResult(fn, args))
+        return self.calls[-1]
+
+class CompileServiceTest(unittest.TestCase):
+    def test_dedupe(self):
+        pool = FakePool()
+        svc = dispatch.CompileService(pool, stub_compile)
+        anim = dict(name='x')
+        self.assertIsNone(svc.request('x', anim, 'sm_35'))
+        self.assertIsNone(svc.request('x', anim, 'sm_35'))
+        self.assertIsNone(svc.request('x', anim, 'sm_52'))
+        self.assertEqual(len(pool.calls), 2)
+        self.assertTrue(svc.busy('x'))
+        self.assertEqual(svc.poll(), [])
+
+        pool.calls[1].done = True
+        [(key, rsp)] = svc.poll()
+        self.assertEqual(key, ('x', 'sm_52'))
+        self.assertEqual(rsp, ('packer', 'lib', 'cubin for x on sm_52'))
+        self.assertIsNone(svc.get('x', 'sm_35'))
+        pool.calls[0].done = True
+        self.assertEqual(len(svc.poll()), 1)
+        self.assertFalse(svc.busy('x'))
+        self.assertEqual(svc.request('x', anim, 'sm_35')[2],
+                         'cubin for x on sm_35')
+        self.assertEqual(svc.stats,
+                         dict(hits=1, misses=2, merged=1, errors=0))
+
+    def test_error(self):
+        pool = FakePool()
+        svc = dispatch.CompileService(pool, stub_compile)
+        svc.request('bad', dict(fail=True), 'sm_35')
+        pool.calls[0].done = True
+        [(key, rsp)] = svc.poll()
+        self.assertTrue(dispatch.is_error(rsp))
+        self.assertIn('bad genome', rsp)
+        # Not retried
+        self.assertEqual(svc.request('bad', dict(fail=True), 'sm_35'), rsp)
+        self.assertEqual(len(pool.calls), 1)
+        self.assertEqual(svc.stats['errors'], 1)
+
+    def test_process_pool(self):
+        # A slow compile doesn't hold up a quick one behind it
+        pool = multiprocessing.Pool(2)
+        try:
+            svc = dispatch.CompileService(pool, stub_compile)
+            svc.request('slow', dict(name='slow', delay=1), 'sm_35')
+            svc.request('quick', dict(name='quick'), 'sm_35')
+            done = []
+            deadline = time.time() + 10
+            while svc.inflight and time.time() < deadline:
+                done += [key[0] for key, rsp in svc.poll()]
+                time.sleep(0.01)
+            self.assertEqual(done, ['quick', 'slow'])
+            self.assertEqual(svc.get('slow', 'sm_35')[2],
+                             'cubin for slow on sm_35')
+        finally:
+            pool.terminate()
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.
+    def __call__(self):
+        return self.now
+
+class CompileCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.clock = FakeClock()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def kernel(self, name, size=1000):
+        return ('packer', None, name + '.' * size)
+
+    def test_lru(self):
+        cache = dispatch.CompileCache(max_bytes=3500)
+        for name in 'abc':
+            cache[name, 'sm_35'] = self.kernel(name)
+        self.assertLessEqual(cache.nbytes, 3500)
+        self.assertEqual(len(cache), 3)
+        # Touching 'a' makes 'b' the oldest
+        self.assertEqual(cache.get(('a', 'sm_35'))[2][0], 'a')
+        cache['d', 'sm_35'] = self.kernel('d')
+        self.assertIsNone(cache.get(('b', 'sm_35')))
+        self.assertIn(('a', 'sm_35'), cache)
+        self.assertEqual(cache.stats['evictions'], 1)
+        self.assertEqual((cache.stats['hits'], cache.stats['misses']), (1, 1))
+        # A replaced entry's size isn't counted twice
+        cache['d', 'sm_35'] = self.kernel('d')
+        self.assertEqual(len(cache), 3)
+        self.assertLessEqual(cache.nbytes, 3500)
+
+    def test_spill(self):
+        spill = os.path.join(self.dir, 'spill')
+        cache = dispatch.CompileCache(max_bytes=2500, spill_dir=spill)
+        for name in 'abc':
+            cache[name, 'sm_35'] = self.kernel(name)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(len(os.listdir(spill)), 1)
+        # Loaded back from disk, pushing out the next oldest
+        self.assertEqual(cache.get(('a', 'sm_35')), self.kernel('a'))
+        self.assertNotIn(('b', 'sm_35'), cache.entries)
+        self.assertEqual(cache.stats['spill_hits'], 1)
+        self.assertEqual(cache.stats['spills'], 2)
+        # Another server sharing the directory finds them too
+        other = dispatch.CompileCache(spill_dir=spill)
+        self.assertEqual(other.get(('b', 'sm_35')), self.kernel('b'))
+
+    def test_error_ttl(self):
+        spill = os.path.join(self.dir, 'spill')
+        cache = dispatch.CompileCache(max_bytes=1500, spill_dir=spill,
+                                      error_ttl=60, clock=self.clock)
+        cache['bad', 'sm_35'] = 'Traceback: bad genome'
+        self.clock.now += 59
+        self.assertEqual(cache.get(('bad', 'sm_35')), 'Traceback: bad genome')
+        self.assertEqual(cache.status()['errors'], 1)
+        self.clock.now += 2
+        self.assertIsNone(cache.get(('bad', 'sm_35')))
+        self.assertEqual(cache.stats['expired'], 1)
+        self.assertEqual(cache.nbytes, 0)
+        # Errors are dropped, not spilled, when evicted
+        cache['bad', 'sm_35'] = 'Traceback: bad genome'
+        cache['good', 'sm_35'] = self.kernel('good', 1480)
+        self.assertFalse(os.path.exists(spill))
+        self.assertIsNone(cache.get(('bad', 'sm_35')))
+
+    def test_status(self):
+        cache = dispatch.CompileCache(max_bytes=1 << 20)
+        cache['a', 'sm_35'] = self.kernel('a')
+        status = cache.status()
+        self.assertEqual(status['entries'], 1)
+        self.assertEqual(status['bytes'], cache.nbytes)
+        self.assertEqual(status['max_bytes'], 1 << 20)
+        self.assertIsNone(status['spill'])
+        svc = dispatch.CompileService(FakePool(), stub_compile, cache)
+        svc.request('a', {}, 'sm_35')
+        svc.request('b', {}, 'sm_35')
+        status = svc.status()
+        self.assertEqual(status['inflight'], 1)
+        self.assertEqual(status['hits'], 1)
+        self.assertEqual(status['cache']['hits'], 1)
+
+    def test_worker_status(self):
+        pool = dispatch.WorkerPool()
+        pool.join('\x00a', dict(name='host:0', mem=1 << 30))
+        pool.assigned('\x00a', 'x')
+        pool.assigned('\x00a', 'x')
+        pool.put('\x00a')
+        [desc] = pool.status()
+        self.assertEqual(desc['addr'], '0061')
+        self.assertEqual(desc['name'], 'host:0')
+        self.assertTrue(desc['ready'])
+        self.assertEqual(desc['hit_rate'], 0.5)
+        self.assertNotIn('hash', desc)
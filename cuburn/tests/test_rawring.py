@@ -0,0 +1,82 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+from cuburn import rawring
+
+class RawRingTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'raw')
+        self.writer = rawring.RingWriter(self.path, nslots=3)
+
+    def tearDown(self):
+        self.writer.close()
+        shutil.rmtree(self.dir)
+
+    def frame(self, i, shape=(6, 10, 4), dtype='u2'):
+        return np.full(shape, i, dtype)
+
+    def test_latest(self):
+        self.writer.write(self.frame(0))
+        reader = rawring.RingReader(self.path)
+        self.assertEqual((reader.shape, reader.dtype), ((6, 10, 4), np.uint16))
+        for i in range(1, 5):
+            seq = self.writer.write(self.frame(i))
+            self.assertEqual(seq, i + 1)
+            got, frame = reader.latest()
+            self.assertEqual(got, seq)
+            self.assertTrue(np.all(frame == i))
+        self.assertFalse(frame.flags.writeable)
+        self.assertEqual(os.listdir(self.dir), ['raw'])
+
+    def test_empty(self):
+        self.writer._create((4,), 'u1')
+        reader = rawring.RingReader(self.path)
+        self.assertEqual(reader.latest(), (0, None))
+        self.assertEqual(reader.copy_latest(), (0, None))
+
+    def test_in_place(self):
+        # Frames are views of the mapping, which reflect later writes once
+        # the writer has come back round to their slot
+        self.writer.write(self.frame(1))
+        reader = rawring.RingReader(self.path)
+        seq, frame = reader.latest()
+        ino = os.stat(self.path).st_ino
+        self.writer.write(self.frame(2))
+        self.assertTrue(reader.is_current(seq))
+        self.writer.write(self.frame(3))
+        self.writer.write(self.frame(4))
+        self.assertFalse(reader.is_current(seq))
+        self.assertTrue(np.all(frame == 4))
+        self.assertEqual(os.stat(self.path).st_ino, ino)
+        seq, copy = reader.copy_latest()
+        self.writer.write(self.frame(5))
+        self.assertTrue(np.all(copy == 4))
+
+    def test_torn_frame(self):
+        self.writer.write(self.frame(1))
+        reader = rawring.RingReader(self.path)
+        seq, frame = reader.latest()
+        # The writer stamps the slot as soon as it starts to overwrite it
+        self.writer.seqs[seq % 3, 0] = seq + 3
+        self.assertFalse(reader.is_current(seq))
+
+    def test_format_change(self):
+        self.writer.write(self.frame(1))
+        reader = rawring.RingReader(self.path)
+        old = reader.latest()[1]
+        self.writer.write(self.frame(7, (3, 8, 8), 'u1'))
+        seq, frame = reader.latest()
+        self.assertEqual((seq, frame.shape, frame.dtype),
+                         (1, (3, 8, 8), np.uint8))
+        self.assertTrue(np.all(frame == 7))
+        # Frames from the old file are still safe to look at
+        self.assertTrue(np.all(old == 1))
+
+    def test_bad_file(self):
+        with open(self.path, 'wb') as fp:
+            fp.write('\0' * 4096)
+        self.assertRaises(ValueError, rawring.RingReader, self.path)
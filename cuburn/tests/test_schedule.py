@@ -0,0 +1,80 @@
+import unittest
+
+from cuburn.schedule import FrameScheduler
+
+class FakeEvent(object):
+    """Completes after being queried ``delay`` times, or on synchronize."""
+    def __init__(self, backend, job, delay):
+        self.backend, self.job, self.delay = backend, job, delay
+        self.done = False
+    def query(self):
+        self.delay -= 1
+        if self.delay < 0:
+            self.synchronize()
+        return self.done
+    def synchronize(self):
+        if not self.done:
+            # Events on a stream complete in order
+            assert self.backend.pending[0] is self
+            self.backend.pending.pop(0)
+            self.done = True
+            self.backend.log.append(('done', self.job))
+
+class FakeBackend(object):
+    def __init__(self, delay=0):
+        self.delay, self.pending, self.log = delay, [], []
+        self.max_pending = 0
+    def queue(self, job):
+        evt = FakeEvent(self, job, self.delay)
+        self.pending.append(evt)
+        self.max_pending = max(self.max_pending, len(self.pending))
+        self.log.append(('queue', job))
+        return evt, 'buf%d' % job
+
+class FrameSchedulerTest(unittest.TestCase):
+    def test_order_and_depth(self):
+        for depth in (1, 2, 3, 5):
+            be = FakeBackend()
+            sched = FrameScheduler(be.queue, depth)
+            out = [(job, buf) for job, evt, buf in sched.frames(range(10))]
+            self.assertEqual(out, [(i, 'buf%d' % i) for i in range(10)])
+            self.assertEqual(be.max_pending, min(depth, 10))
+            self.assertFalse(sched.inflight)
+
+    def test_queues_before_yielding(self):
+        be = FakeBackend()
+        sched = FrameScheduler(be.queue, 2)
+        for job, evt, buf in sched.frames(range(4)):
+            be.log.append(('yield', job))
+        self.assertEqual(be.log, [
+            ('queue', 0), ('queue', 1), ('done', 0), ('queue', 2),
+            ('yield', 0), ('done', 1), ('queue', 3), ('yield', 1),
+            ('done', 2), ('yield', 2), ('done', 3), ('yield', 3)])
+
+    def test_nonblocking(self):
+        be = FakeBackend(delay=3)
+        sched = FrameScheduler(be.queue, 2)
+        out = list(sched.frames(range(3), block=False))
+        frames = [o[0] for o in out if o is not None]
+        self.assertEqual(frames, [0, 1, 2])
+        self.assertTrue(None in out)
+
+    def test_lazy_jobs(self):
+        # Jobs are only drawn as slots free up
+        drawn = []
+        def jobs():
+            for i in range(5):
+                drawn.append(i)
+                yield i
+        be = FakeBackend()
+        frames = FrameScheduler(be.queue, 2).frames(jobs())
+        self.assertEqual(next(frames)[0], 0)
+        self.assertEqual(drawn, [0, 1, 2])
+
+    def test_empty(self):
+        be = FakeBackend()
+        self.assertEqual(list(FrameScheduler(be.queue).frames([])), [])
+        self.assertEqual(be.log, [])
+
+    def test_bad_depth(self):
+        self.assertRaises(ValueError, FrameScheduler, None, 0)
@@ -0,0 +1,98 @@
+import unittest
+
+from cuburn import wire
+
+class Frame(object):
+    """Stands in for a ``zmq.Frame``."""
+    def __init__(self, data):
+        self.bytes = data
+
+class MessageTest(unittest.TestCase):
+    def test_round_trip(self):
+        frames = wire.encode(wire.RESULT, dict(addr=['a', 'b'],
+                             attached=['.log', '.jpg']), ['log', '\0\xff'])
+        msg = wire.decode(map(Frame, frames))
+        self.assertEqual(msg.kind, wire.RESULT)
+        self.assertEqual(msg.meta['addr'], ['a', 'b'])
+        self.assertEqual(sorted(msg.blobs), ['.jpg', '.log'])
+        self.assertEqual(msg.blobs['.jpg'].bytes, '\0\xff')
+
+    def test_header(self):
+        self.assertEqual(len(wire.encode(wire.ACK)[0]), 5)
+        self.assertEqual(wire.decode(wire.encode(wire.ACK)).meta, {})
+
+    def test_bad(self):
+        ok = wire.encode(wire.TASK, dict(attached=['x']), ['data'])
+        bad_version = [wire.HEADER.pack(wire.MAGIC, wire.VERSION + 1,
+                                        wire.TASK)] + ok[1:]
+        for frames in ([], ok[:1], ['junk'] + ok[1:], bad_version,
+                       ok[:2], ok + ['extra'], [ok[0], '{', 'data'],
+                       [ok[0], '{"attached": 3}']):
+            self.assertRaises(wire.ProtocolError, wire.decode, frames)
+
+    def test_no_pickle(self):
+        # A pickle in the meta frame is just bad JSON
+        import cPickle as pickle
+        frames = [wire.encode(wire.TASK)[0], pickle.dumps(dict(a=1))]
+        self.assertRaises(wire.ProtocolError, wire.decode, frames)
+
+    def test_json_blob(self):
+        a = wire.encode_json(dict(x=1, y=[1.5, 'z']))
+        b = wire.encode_json(dict(y=[1.5, 'z'], x=1))
+        self.assertEqual(wire.blob_hash(a), wire.blob_hash(b))
+
+class BlobStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.data = dict((wire.blob_hash(d), d)
+                         for d in ('anim%d' % i for i in range(8)))
+        self.hashes = sorted(self.data)
+        self.sender = wire.BlobStore(4)
+        self.receiver = wire.BlobStore(4)
+
+    def send(self, **refs):
+        attach = self.sender.select(refs, self.data)
+        frames = wire.encode_task(wire.TASK, {}, refs, attach)
+        msg = wire.decode(map(Frame, frames))
+        return len(attach), self.receiver.resolve(msg.meta['refs'],
+                                                  msg.blobs)
+
+    def test_once(self):
+        h = self.hashes
+        n, blobs = self.send(anim=h[0], cubin=h[1])
+        self.assertEqual(n, 2)
+        self.assertEqual(blobs, dict(anim=self.data[h[0]],
+                                     cubin=self.data[h[1]]))
+        n, blobs = self.send(anim=h[2], cubin=h[1])
+        self.assertEqual(n, 1)
+        self.assertEqual(blobs['cubin'], self.data[h[1]])
+
+    def test_in_step(self):
+        # However refs come and go, the sender never leaves out a blob the
+        # receiver doesn't have
+        h = self.hashes
+        for i in range(50):
+            self.send(anim=h[i % 7], cubin=h[(i * 3) % 5],
+                      packer=h[(i / 4) % 8])
+            self.assertEqual(self.sender.blobs.keys(),
+                             self.receiver.blobs.keys())
+
+    def test_missing(self):
+        self.assertRaises(wire.MissingBlob, self.receiver.resolve,
+                          dict(anim=self.hashes[0]), {})
+
+    def test_corrupt(self):
+        h = self.hashes[0]
+        self.assertRaises(wire.ProtocolError, self.receiver.resolve,
+                          dict(anim=h), {h: 'not it'})
+        self.assertNotIn(h, self.receiver)
+
+    def test_capacity(self):
+        self.assertRaises(ValueError, wire.BlobStore, 2)
+        store = wire.BlobStore(3)
+        for h in self.hashes:
+            store.add(h)
+        self.assertEqual(store.blobs.keys(), self.hashes[-3:])
+        store.get(self.hashes[-3])
+        store.add(self.hashes[0])
+        self.assertNotIn(self.hashes[-2], store)
+        self.assertIn(self.hashes[-3], store)
@@ -0,0 +1,289 @@
+import os
+import sys
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+from subprocess import Popen, PIPE
+from cStringIO import StringIO
+import numpy as np
+
+from cuburn import writer
+
+try:
+    import gevent
+except ImportError:
+    gevent = None
+
+class WriteAtomicTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_write(self):
+        path = os.path.join(self.dir, 'frame.png')
+        writer.write_atomic(path, 'old')
+        writer.write_atomic(path, 'new')
+        self.assertEqual(open(path).read(), 'new')
+        self.assertEqual(os.listdir(self.dir), ['frame.png'])
+
+    def test_failed_write(self):
+        path = os.path.join(self.dir, 'missing', 'frame.png')
+        self.assertRaises(OSError, writer.write_atomic, path, 'data')
+
+    def test_write_file(self):
+        path = os.path.join(self.dir, 'seg.h264')
+        writer.write_atomic(path, StringIO('x' * 100000))
+        self.assertEqual(open(path).read(), 'x' * 100000)
+
+    def test_streamed(self):
+        files = writer.StreamedFiles()
+        a, b = [os.path.join(self.dir, n) for n in ('a.webm', 'b.webm')]
+        writer.write_atomic(a, 'old')
+        files.append(a, 'one ')
+        files.append(b, StringIO('two'))
+        files.append(a, StringIO('three'))
+        # Nothing replaces the old file until the segment is finished
+        self.assertEqual(open(a).read(), 'old')
+        files.finish()
+        self.assertEqual(open(a).read(), 'one three')
+        self.assertEqual(open(b).read(), 'two')
+        files.append(b, 'partial')
+        files.abort()
+        self.assertEqual(open(b).read(), 'two')
+        self.assertEqual(sorted(os.listdir(self.dir)), ['a.webm', 'b.webm'])
+
+    def test_segment_buffer(self):
+        with tempfile.TemporaryFile() as fp:
+            self.assertEqual(writer.segment_buffer(fp), '')
+            fp.write('segment')
+            fp.flush()
+            buf = writer.segment_buffer(fp)
+            self.assertEqual(buf[:], 'segment')
+        self.assertEqual(writer.segment_buffer(StringIO('jpeg')), 'jpeg')
+
+# Stands in for x264 at --log-level debug: a screenful of stderr for every
+# frame it reads, and its output to stdout at the end
+FAKE_ENCODER = '''
+import os, sys
+nbytes = 0
+while True:
+    data = os.read(0, 1 << 16)
+    if not data:
+        break
+    nbytes += len(data)
+    for i in range(400):
+        sys.stderr.write('x264 [debug]: frame %d line %d\\n' % (nbytes, i))
+sys.stderr.write('encoded %d bytes\\n' % nbytes)
+sys.stdout.write(str(nbytes))
+'''
+
+class LogDrainerTest(unittest.TestCase):
+    def test_ring(self):
+        ring = writer.LogRing(10)
+        ring.append('abc')
+        self.assertEqual(ring.getvalue(), 'abc')
+        ring.append('defghij')
+        ring.append('klm')
+        self.assertEqual(ring.size, 10)
+        self.assertEqual(ring.getvalue(),
+                         '[3 bytes of log dropped]\ndefghijklm')
+        ring.append('n' * 25)
+        self.assertEqual(ring.getvalue(),
+                         '[28 bytes of log dropped]\n' + 'n' * 10)
+
+    def test_fake_encoder(self):
+        # Megabytes of log against a 64K pipe buffer: without the
+        # drainer, the writes below would block forever
+        outf = tempfile.TemporaryFile()
+        subp = Popen([sys.executable, '-c', FAKE_ENCODER],
+                     stdin=PIPE, stdout=outf, stderr=PIPE)
+        log = writer.LogDrainer(subp.stderr, maxbytes=1 << 16)
+        frame = np.zeros((256, 1024), 'u2')
+        def encode():
+            for i in range(16):
+                writer.write_planes(subp.stdin, frame)
+            subp.stdin.close()
+            subp.wait()
+        thr = threading.Thread(target=encode)
+        thr.daemon = True
+        thr.start()
+        thr.join(30)
+        self.assertFalse(thr.is_alive(), 'encoder stalled')
+        self.assertEqual(subp.returncode, 0)
+        outf.seek(0)
+        self.assertEqual(outf.read(), str(16 * frame.nbytes))
+        text = log.join()
+        self.assertLessEqual(log.size, 1 << 16)
+        self.assertGreater(log.dropped, 1 << 20)
+        self.assertTrue(text.startswith('[%d bytes' % log.dropped))
+        self.assertTrue(text.endswith('encoded %d bytes\n' % (16 * frame.nbytes)))
+
+class PipePumpTest(unittest.TestCase):
+    def pump(self, cmd):
+        subp = Popen(cmd, shell=True, stdin=PIPE, stdout=PIPE, stderr=PIPE)
+        return writer.PipePump(subp, chunk_size=4096)
+
+    def test_stream(self):
+        # Far more than fits in the pipes, so output has to be read while
+        # input is written, and it should come back a frame at a time
+        pump = self.pump('cat')
+        frames = [np.random.RandomState(i).randint(0, 65536, (256, 1024))
+                    .astype('u2') for i in range(4)]
+        out = [pump.write(f[:128], f[128:]) for f in frames]
+        out.append(pump.close())
+        self.assertEqual(''.join(out), ''.join(f.tostring() for f in frames))
+        self.assertGreater(len(out[0]), 0)
+        self.assertLess(max(map(len, out)), 2 * frames[0].nbytes)
+        self.assertEqual(pump.subp.returncode, 0)
+
+    def test_log(self):
+        # An encoder that's chatty on stderr doesn't stall on a full pipe
+        pump = self.pump('cat; head -c 1000000 /dev/zero >&2; echo end >&2')
+        out = pump.write(np.arange(10, dtype='u1')) + pump.close()
+        self.assertEqual(out, np.arange(10, dtype='u1').tostring())
+        log = pump.read_log()
+        self.assertEqual(len(log), 1000004)
+        self.assertTrue(log.endswith('end\n'))
+
+    def test_exit(self):
+        pump = self.pump('exec 0<&-; echo failed >&2; exit 3')
+        self.assertRaises(IOError, pump.write, np.zeros(1 << 20, 'u1'))
+        pump.close()
+        self.assertEqual(pump.subp.returncode, 3)
+        self.assertEqual(pump.read_log(), 'failed\n')
+
+    @unittest.skipIf(gevent is None, 'gevent not installed')
+    def test_cooperative(self):
+        # Other greenlets run while the pump waits on a slow encoder
+        ticks = []
+        def tick():
+            while True:
+                ticks.append(time.time())
+                gevent.sleep(0.01)
+        ticker = gevent.spawn(tick)
+        pump = self.pump('sleep 0.2; cat')
+        out = pump.write(np.arange(10, dtype='u1')) + pump.close()
+        ticker.kill()
+        self.assertEqual(out, np.arange(10, dtype='u1').tostring())
+        self.assertGreater(len(ticks), 5)
+
+class EncoderPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.pool = writer.EncoderPool(4, depth=3)
+
+    def tearDown(self):
+        for evt in getattr(self, 'gates', []):
+            evt.set()
+        self.pool.close()
+
+    def test_order(self):
+        # Later tasks finish first, but results come back in order
+        delay = lambda i: time.sleep(0.002 * (10 - i)) or i
+        results = []
+        for i in range(10):
+            results += self.pool.submit(delay, i)
+        results += self.pool.drain()
+        self.assertEqual(results, range(10))
+        self.assertFalse(self.pool.pending)
+
+    def test_backpressure(self):
+        self.gates = [threading.Event() for i in range(4)]
+        submitted = []
+        def feed():
+            for i, gate in enumerate(self.gates):
+                self.pool.submit(gate.wait)
+                submitted.append(i)
+        thr = threading.Thread(target=feed)
+        thr.daemon = True
+        thr.start()
+        time.sleep(0.05)
+        # The fourth submission waits for the first task to finish
+        self.assertEqual(submitted, [0, 1, 2])
+        self.gates[0].set()
+        thr.join(1)
+        self.assertEqual(submitted, [0, 1, 2, 3])
+        self.assertLessEqual(len(self.pool.pending), self.pool.depth)
+
+    def test_error(self):
+        def fail():
+            raise ValueError('bad frame')
+        # Raised by whichever call collects the failed task
+        self.assertRaises(ValueError,
+                          lambda: self.pool.submit(fail) + self.pool.drain())
+        # The pool is still usable afterwards
+        results = self.pool.submit(lambda: 1) + self.pool.drain()
+        self.assertEqual(results, [1])
+
+    def test_close(self):
+        results = []
+        for i in range(3):
+            results += self.pool.submit(lambda i=i: i)
+        self.assertEqual(results + self.pool.close(), [0, 1, 2])
+        self.assertEqual(self.pool._threads, [])
+
+class StagingTest(unittest.TestCase):
+    def test_reuse(self):
+        staging = writer.StagingBuffers()
+        a = staging.get('rgb', (4, 6, 3), 'u2')
+        self.assertIs(staging.get('rgb', (4, 6, 3), 'u2'), a)
+        self.assertIsNot(staging.get('alpha', (4, 6, 3), 'u2'), a)
+        b = staging.get('rgb', (8, 6, 3), 'u2')
+        self.assertEqual(b.shape, (8, 6, 3))
+        self.assertEqual(staging.get('rgb', (8, 6, 3), 'u1').dtype, np.uint8)
+
+    def test_write_planes(self):
+        fd, path = tempfile.mkstemp()
+        try:
+            planes = [np.arange(12, dtype='u2').reshape(3, 4),
+                      np.arange(5, dtype='u1')]
+            with os.fdopen(fd, 'wb', 0) as fp:
+                writer.write_planes(fp, *planes)
+                self.assertRaises(Exception, writer.write_planes,
+                                  fp, planes[0][:,::2])
+            with open(path, 'rb') as fp:
+                data = fp.read()
+            self.assertEqual(data, ''.join(p.tostring() for p in planes))
+        finally:
+            os.unlink(path)
+
+class SubsampleTest(unittest.TestCase):
+    def reference(self, src):
+        # Area average in floating point, replicating odd edges
+        n, h, w = src.shape
+        pad = np.pad(src.astype(float), [(0, 0), (0, h % 2), (0, w % 2)],
+                     'edge')
+        avg = pad.reshape(n, (h + 1) / 2, 2, (w + 1) / 2, 2).mean(axis=(2, 4))
+        return np.floor(avg + 0.5)
+
+    def test_box_subsample(self):
+        rand = np.random.RandomState(0)
+        for h, w in [(8, 12), (7, 12), (8, 11), (5, 9), (1, 1)]:
+            src = rand.randint(0, 256, (2, h, w)).astype('u1')
+            shape = (2, (h + 1) / 2, (w + 1) / 2)
+            out, acc = np.empty(shape, 'u1'), np.empty(shape, 'u2')
+            rows = np.empty(shape[:2] + (w,), 'u2')
+            writer.box_subsample(src, out, rows, acc)
+            self.assertTrue(np.array_equal(out, self.reference(src)), (h, w))
+
+    def test_no_aliasing(self):
+        # A one-pixel checkerboard averages to flat grey, where decimation
+        # would pick out a single phase
+        src = np.indices((2, 16, 16)).sum(axis=0) % 2 * 254
+        out = writer.ChromaSubsampler()(src.astype('u1'))
+        self.assertTrue(np.all(out == 127))
+
+    def test_threads(self):
+        rand = np.random.RandomState(1)
+        src = rand.randint(0, 256, (2, 37, 50)).astype('u1')
+        single = writer.ChromaSubsampler()(src).copy()
+        sub = writer.ChromaSubsampler(4)
+        try:
+            out = sub(src)
+            self.assertTrue(np.array_equal(out, single))
+            self.assertIs(sub(src), out)
+        finally:
+            sub.pool.close()
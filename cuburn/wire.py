@@ -0,0 +1,169 @@
+"""
+The framed message format used between the dist client, server and workers.
+
+Each message is a list of frames (as sent by ``zmq``'s ``send_multipart``):
+
+    header      magic, protocol version and message kind, packed
+    meta        JSON object, whose ``attached`` list names the blobs
+    blobs...    raw bytes, one frame each
+
+Genomes, packers and cubins travel as blobs, addressed by the SHA-1 of their
+contents. A task names the blobs it needs in its ``refs``, and carries
+(listed in ``attached``) only those the receiver doesn't already have, so a
+genome shared by many tasks crosses each link once. Blob frames are passed
+through untouched, so they can be sent and received without copies.
+
+Nothing is ever unpickled, so a message can do no more harm than fail to
+decode.
+"""
+
+import json
+import struct
+import hashlib
+from collections import namedtuple, OrderedDict
+
+MAGIC = 'CBW'
+VERSION = 1
+HEADER = struct.Struct('<3sBB')
+
+# Message kinds
+TASK, ACK, NEED, JOIN, RESULT, ERROR = range(1, 7)
+
+Message = namedtuple('Message', 'kind meta blobs')
+
+class ProtocolError(ValueError):
+    pass
+
+def as_bytes(frame):
+    """The contents of a frame, which may be a ``zmq.Frame``."""
+    return getattr(frame, 'bytes', frame)
+
+def blob_hash(data):
+    return hashlib.sha1(data).hexdigest()
+
+def encode(kind, meta=None, blobs=()):
+    """Return the frames of a message. ``blobs`` are included as given."""
+    return ([HEADER.pack(MAGIC, VERSION, kind),
+             json.dumps(meta or {}, separators=(',', ':'))] + list(blobs))
+
+def decode(frames):
+    """
+    Parse a message from a list of frames. Returns a `Message`, whose
+    ``blobs`` maps the name of each attached blob (its hash, for a task) to
+    its frame, unchanged.
+    Raises `ProtocolError` if the message is malformed, or from another
+    version of the protocol.
+    """
+    if len(frames) < 2:
+        raise ProtocolError('Truncated message')
+    header = as_bytes(frames[0])
+    if len(header) != HEADER.size:
+        raise ProtocolError('Bad message header')
+    magic, version, kind = HEADER.unpack(header)
+    if magic != MAGIC:
+        raise ProtocolError('Bad message header')
+    if version != VERSION:
+        raise ProtocolError('Protocol version %d, expected %d'
+                            % (version, VERSION))
+    try:
+        meta = json.loads(as_bytes(frames[1]))
+    except ValueError:
+        raise ProtocolError('Bad message metadata')
+    attached = meta.get('attached', []) if isinstance(meta, dict) else None
+    if not isinstance(attached, list):
+        raise ProtocolError('Bad message metadata')
+    if len(attached) != len(frames) - 2:
+        raise ProtocolError('Expected %d blobs, got %d'
+                            % (len(attached), len(frames) - 2))
+    return Message(kind, meta, dict(zip(attached, frames[2:])))
+
+def encode_json(obj):
+    """Encode a genome (or packer state) as a blob. Equal objects always
+    give equal blobs, and so the same hash."""
+    return json.dumps(obj, sort_keys=True, separators=(',', ':'))
+
+def encode_task(kind, meta, refs, attach):
+    """
+    Return the frames of a message about a task. ``refs`` maps names to the
+    hashes of the blobs the task needs, and ``attach`` is a list of ``(hash,
+    data)`` pairs for those to be sent along with it.
+    """
+    meta = dict(meta, refs=refs, attached=[h for h, d in attach])
+    return encode(kind, meta, [d for h, d in attach])
+
+class MissingBlob(KeyError):
+    pass
+
+class BlobStore(object):
+    """
+    Keeps the last ``capacity`` blobs used, by hash.
+
+    The sender on a link keeps a store with the same capacity as the
+    receiver's, holding hashes only, and uses it to `select` which of a
+    task's blobs to attach; the receiver then `resolve`\\ s the task's refs
+    against its own store. Both make the same changes to their stores in the
+    same order, so the sender always knows what the receiver holds, without
+    it having to say.
+    """
+    def __init__(self, capacity=32):
+        if capacity < 3:
+            raise ValueError('A blob store must hold at least three blobs')
+        self.capacity = capacity
+        self.blobs = OrderedDict()
+
+    def __len__(self):
+        return len(self.blobs)
+
+    def __contains__(self, hash):
+        return hash in self.blobs
+
+    def get(self, hash):
+        data = self.blobs.pop(hash)
+        self.blobs[hash] = data
+        return data
+
+    def add(self, hash, data=None):
+        self.blobs.pop(hash, None)
+        self.blobs[hash] = data
+        while len(self.blobs) > self.capacity:
+            self.blobs.popitem(last=False)
+
+    def clear(self):
+        self.blobs.clear()
+
+    def select(self, refs, blobs):
+        """
+        Sender side: return the ``(hash, data)`` pairs to attach to a task
+        with ``refs``, looking up their contents in the dict ``blobs`` (by
+        hash), and record them as sent.
+        """
+        attach = []
+        for name, hash in sorted(refs.items()):
+            if hash in self.blobs:
+                self.get(hash)
+            else:
+                attach.append((hash, blobs[hash]))
+                self.add(hash)
+        return attach
+
+    def resolve(self, refs, attached, verify=True):
+        """
+        Receiver side: return a dict mapping the names in ``refs`` to blob
+        contents, taken from the ``attached`` blobs of a decoded task or
+        from this store, and store the attached ones. Raises `MissingBlob`
+        if a blob is neither, and `ProtocolError` if ``verify`` is set and
+        an attached blob doesn't match its hash.
+        """
+        out = {}
+        for name, hash in sorted(refs.items()):
+            if hash in attached:
+                data = as_bytes(attached[hash])
+                if verify and blob_hash(data) != hash:
+                    raise ProtocolError('Corrupt blob %s' % hash)
+                self.add(hash, data)
+            elif hash in self.blobs:
+                data = self.get(hash)
+            else:
+                raise MissingBlob(hash)
+            out[name] = data
+        return out
@@ -0,0 +1,403 @@
+"""
+Host-side encoding and writing of rendered frames.
+
+Unlike `cuburn.output`, nothing here needs CUDA, so encoders can be driven
+(and benchmarked) from plain host buffers.
+"""
+
+import os
+import sys
+import mmap
+import errno
+import fcntl
+import shutil
+import tempfile
+import threading
+import multiprocessing
+from Queue import Queue
+from collections import deque
+from cStringIO import StringIO
+
+import numpy as np
+
+try:
+    # Outside a gevent program, this waits just as the standard one does
+    from gevent.select import select as _select
+except ImportError:
+    from select import select as _select
+
+def encode_image(buf, codec='jpeg', quality=100):
+    """
+    Compress the uint8 array ``buf`` (shaped ``(h, w)`` or ``(h, w, ch)``)
+    with PIL, returning a file-like object holding the encoded image.
+    """
+    import scipy.misc
+    out = StringIO()
+    img = scipy.misc.toimage(buf, cmin=0, cmax=1)
+    img.save(out, codec, quality=quality)
+    out.seek(0)
+    return out
+
+def _copy_to(fp, data):
+    if hasattr(data, 'read'):
+        shutil.copyfileobj(data, fp)
+    else:
+        fp.write(data)
+
+def _mkstemp(path):
+    return tempfile.mkstemp(prefix='.tmp-', dir=os.path.dirname(path) or '.')
+
+def write_atomic(path, data):
+    """
+    Write ``data`` (a string, or a file-like object, which is copied a piece
+    at a time) to ``path`` via a temporary file in the same directory, so
+    that readers never see a partially written file.
+    """
+    fd, tmp = _mkstemp(path)
+    try:
+        with os.fdopen(fd, 'wb') as fp:
+            _copy_to(fp, data)
+        os.rename(tmp, path)
+    except:
+        os.unlink(tmp)
+        raise
+
+class StreamedFiles(object):
+    """
+    Files assembled from media segments that arrive a chunk at a time, as
+    they do from an `Output` in streaming mode. Chunks are appended to a
+    temporary file beside each target as they arrive, and `finish` renames
+    them all into place, so as with `write_atomic` readers never see a
+    partial segment.
+    """
+    def __init__(self):
+        self.files = {}
+
+    def append(self, path, data):
+        """Append ``data`` (a string or file-like object) to ``path``."""
+        if path not in self.files:
+            fd, tmp = _mkstemp(path)
+            self.files[path] = (os.fdopen(fd, 'wb'), tmp)
+        _copy_to(self.files[path][0], data)
+
+    def finish(self):
+        """Move every file written since the last call into place."""
+        for path, (fp, tmp) in sorted(self.files.items()):
+            fp.close()
+            os.rename(tmp, path)
+        self.files.clear()
+
+    def abort(self):
+        """Discard every file written since the last call."""
+        for fp, tmp in self.files.values():
+            fp.close()
+            os.unlink(tmp)
+        self.files.clear()
+
+def segment_buffer(file_like):
+    """
+    Return the contents of a media segment as an object supporting the
+    buffer interface. A segment backed by a real file (such as the
+    temporary files the video outputs spool to) is memory-mapped rather
+    than read, so it can be handed to ``zmq`` with ``copy=False`` and sent
+    straight from the page cache. Other file-like objects are just read.
+    """
+    try:
+        fd = file_like.fileno()
+    except (AttributeError, IOError):
+        return file_like.read()
+    size = os.fstat(fd).st_size
+    if not size:
+        return ''
+    return mmap.mmap(fd, size, prot=mmap.PROT_READ)
+
+def write_planes(fp, *planes):
+    """
+    Write each array in ``planes`` to the file ``fp`` in turn, through a
+    memoryview so the data is not copied. The arrays must be C-contiguous.
+    """
+    for plane in planes:
+        fp.write(memoryview(plane))
+
+class LogRing(object):
+    """
+    The last ``maxbytes`` of a log that arrives in chunks. Older text is
+    discarded as new text arrives, and a note of how much was lost heads the
+    log when it is read back. Safe to append to from another thread.
+    """
+    def __init__(self, maxbytes=1<<20):
+        self.maxbytes = maxbytes
+        self.size = self.dropped = 0
+        self._chunks = deque()
+        self._lock = threading.Lock()
+
+    def append(self, data):
+        with self._lock:
+            self._chunks.append(data)
+            self.size += len(data)
+            while self.size > self.maxbytes:
+                head = self._chunks[0]
+                excess = min(len(head), self.size - self.maxbytes)
+                if excess == len(head):
+                    self._chunks.popleft()
+                else:
+                    self._chunks[0] = head[excess:]
+                self.size -= excess
+                self.dropped += excess
+
+    def getvalue(self):
+        with self._lock:
+            data = ''.join(self._chunks)
+        if self.dropped:
+            return '[%d bytes of log dropped]\n%s' % (self.dropped, data)
+        return data
+
+class LogDrainer(LogRing):
+    """
+    A `LogRing` filled from the pipe ``fp`` by a background thread, so that
+    a process logging to the pipe never blocks on it, no matter how much it
+    writes or how long it is until anyone looks at the log.
+    """
+    def __init__(self, fp, maxbytes=1<<20, chunk_size=1<<16):
+        super(LogDrainer, self).__init__(maxbytes)
+        self._thread = threading.Thread(target=self._drain,
+                                        args=(fp, chunk_size))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _drain(self, fp, chunk_size):
+        fd = fp.fileno()
+        while True:
+            data = os.read(fd, chunk_size)
+            if not data:
+                break
+            self.append(data)
+        fp.close()
+
+    def join(self, timeout=None):
+        """
+        Wait for the writing end of the pipe to be closed (typically, by the
+        process exiting), and return the log.
+        """
+        self._thread.join(timeout)
+        return self.getvalue()
+
+class PipePump(object):
+    """
+    Drives an encoder subprocess started with all three standard streams
+    as pipes, returning encoded output a chunk at a time as it appears
+    instead of leaving it to accumulate in a temporary file.
+
+    Input, output and the log on stderr are all serviced from one ``select``
+    loop, with stdin non-blocking, so the encoder filling up one pipe can
+    never stall a write to another. When gevent is installed, the loop
+    waits with gevent's ``select``, yielding to other greenlets rather than
+    blocking the hub. The log is kept in a `LogRing`. Output is held only
+    until the `write` or `close` call which read it returns, so memory use
+    is bounded by the encoder's own lookahead, not by the length of the
+    segment.
+    """
+    def __init__(self, subp, chunk_size=1<<16, log_size=1<<20):
+        self.subp = subp
+        self.chunk_size = chunk_size
+        self.log = LogRing(log_size)
+        self._chunks = []
+        self._infd = subp.stdin.fileno()
+        flags = fcntl.fcntl(self._infd, fcntl.F_GETFL)
+        fcntl.fcntl(self._infd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+        self._sinks = {subp.stdout.fileno(): self._chunks,
+                       subp.stderr.fileno(): self.log}
+
+    def _poll(self, writing):
+        wfds = [self._infd] if writing else []
+        rfds, wfds, _ = _select(list(self._sinks), wfds, [])
+        for fd in rfds:
+            data = os.read(fd, self.chunk_size)
+            if data:
+                self._sinks[fd].append(data)
+            else:
+                del self._sinks[fd]
+        return bool(wfds)
+
+    def _take(self):
+        data = ''.join(self._chunks)
+        del self._chunks[:]
+        return data
+
+    def write(self, *planes):
+        """
+        Write each C-contiguous array in ``planes`` to the encoder without
+        copying it, and return the output produced in the meantime.
+        """
+        for plane in planes:
+            view = memoryview(np.frombuffer(plane, np.uint8))
+            while len(view):
+                if not self._poll(True):
+                    continue
+                try:
+                    view = view[os.write(self._infd, view):]
+                except OSError, e:
+                    if e.errno != errno.EAGAIN:
+                        raise IOError(e.errno, e.strerror)
+        return self._take()
+
+    def close(self):
+        """
+        Close the encoder's input, wait for it to exit, and return the rest
+        of its output. The exit status is left in ``subp.returncode``.
+        """
+        self.subp.stdin.close()
+        while self._sinks:
+            self._poll(False)
+        self.subp.wait()
+        return self._take()
+
+    def read_log(self):
+        """Return what the encoder has written to stderr so far."""
+        return self.log.getvalue()
+
+class StagingBuffers(object):
+    """
+    Named host arrays that are reused from frame to frame, and only
+    reallocated when the requested shape or type changes.
+    """
+    def __init__(self):
+        self._bufs = {}
+
+    def get(self, name, shape, dtype):
+        buf = self._bufs.get(name)
+        if buf is None or buf.shape != shape or buf.dtype != dtype:
+            buf = self._bufs[name] = np.empty(shape, dtype)
+        return buf
+
+def box_subsample(src, out, rows, acc):
+    """
+    Halve the resolution of each uint8 plane of ``src`` (shaped ``(n, h,
+    w)``) with a 2x2 box filter, writing the rounded averages to ``out``
+    (shaped ``(n, (h+1)/2, (w+1)/2)``). ``rows`` and ``acc`` are uint16
+    scratch arrays, shaped ``(n, (h+1)/2, w)`` and like ``out``. At an odd
+    right or bottom edge, the last column or row stands in for the missing
+    one.
+    """
+    h, w = src.shape[1:]
+    eh, ew = h / 2, w / 2
+    # Summing pairs of rows first halves the data for the strided pass
+    np.add(src[:,0:2*eh:2], src[:,1:2*eh:2], out=rows[:,:eh], dtype=rows.dtype)
+    if h % 2:
+        np.multiply(src[:,-1:], 2, out=rows[:,eh:], dtype=rows.dtype)
+    np.add(rows[:,:,0:2*ew:2], rows[:,:,1:2*ew:2], out=acc[:,:,:ew])
+    if w % 2:
+        np.multiply(rows[:,:,-1:], 2, out=acc[:,:,ew:])
+    acc += 2
+    np.right_shift(acc, 2, out=out, casting='unsafe')
+
+class ChromaSubsampler(object):
+    """
+    Box-filters planes with `box_subsample` into buffers that are reused
+    from frame to frame. If ``nthreads`` is more than one, bands of rows
+    are filtered in parallel (NumPy releases the GIL for the arithmetic).
+    """
+    def __init__(self, nthreads=1):
+        self.staging = StagingBuffers()
+        self.pool = EncoderPool(nthreads) if nthreads > 1 else None
+
+    def __call__(self, planes):
+        """Return the subsampled ``planes``, valid until the next call."""
+        n, h, w = planes.shape
+        shape = (n, (h + 1) / 2, (w + 1) / 2)
+        out = self.staging.get('out', shape, planes.dtype)
+        rows = self.staging.get('rows', shape[:2] + (w,), np.uint16)
+        acc = self.staging.get('acc', shape, np.uint16)
+        if self.pool is None:
+            box_subsample(planes, out, rows, acc)
+            return out
+        bands = np.linspace(0, shape[1], self.pool.nthreads + 1).astype(int)
+        for y0, y1 in zip(bands[:-1], bands[1:]):
+            if y1 > y0:
+                self.pool.submit(box_subsample, planes[:,2*y0:2*y1],
+                                 out[:,y0:y1], rows[:,y0:y1], acc[:,y0:y1])
+        self.pool.drain()
+        return out
+
+class _Task(object):
+    def __init__(self, fn, args):
+        self.fn, self.args = fn, args
+        self.done = threading.Event()
+        self.result = self.exc_info = None
+
+    def run(self):
+        try:
+            self.result = self.fn(*self.args)
+        except:
+            self.exc_info = sys.exc_info()
+        self.done.set()
+
+    def get(self):
+        self.done.wait()
+        if self.exc_info:
+            raise self.exc_info[0], self.exc_info[1], self.exc_info[2]
+        return self.result
+
+class EncoderPool(object):
+    """
+    Runs encoding tasks on ``nthreads`` threads (by default, one per CPU).
+
+    At most ``depth`` tasks may be pending at once; `submit` blocks the
+    caller until the oldest one finishes when the limit is reached, which
+    holds back the renderer when encoding can't keep up. Results are handed
+    back in submission order, whatever order the tasks finish in, and an
+    exception raised by a task is re-raised when its result is collected.
+
+    The work done by tasks should mostly release the GIL, as compression
+    in PIL and zlib does.
+    """
+    def __init__(self, nthreads=None, depth=None):
+        self.nthreads = nthreads or multiprocessing.cpu_count()
+        self.depth = depth or 2 * self.nthreads
+        self.pending = deque()
+        self._queue = Queue()
+        self._threads = []
+        for i in range(self.nthreads):
+            thr = threading.Thread(target=self._work)
+            thr.daemon = True
+            thr.start()
+            self._threads.append(thr)
+
+    def _work(self):
+        while True:
+            task = self._queue.get()
+            if task is None:
+                return
+            task.run()
+
+    def _collect(self, block_until):
+        results = []
+        while self.pending and (len(self.pending) > block_until or
+                                self.pending[0].done.is_set()):
+            results.append(self.pending.popleft().get())
+        return results
+
+    def submit(self, fn, *args):
+        """
+        Queue ``fn(*args)`` to run on the pool. Returns the results of the
+        tasks which have finished since the last call, in order.
+        """
+        results = self._collect(self.depth - 1)
+        task = _Task(fn, args)
+        self.pending.append(task)
+        self._queue.put(task)
+        return results + self._collect(self.depth)
+
+    def drain(self):
+        """Wait for every pending task, and return their results in order."""
+        return self._collect(0)
+
+    def close(self):
+        """Wait for pending tasks and stop the worker threads."""
+        results = self.drain()
+        for thr in self._threads:
+            self._queue.put(None)
+        for thr in self._threads:
+            thr.join()
+        self._threads = []
+        return results
@@ -1,23 +1,26 @@
 #!/usr/bin/env python2
 import os
+import json
 import uuid
 import weakref
+import multiprocessing
+from collections import deque
 import numpy as np
-import cPickle as pickle
 
 import gevent
 from gevent import spawn, queue, coros
 import zmq.green as zmq
 
 import _importhack
-from cuburn import profile, output
-from cuburn.genome import db, util
+from cuburn import profile, output, wire
+from cuburn.genome import db
+from cuburn.code.iter import kernel_key
 
 from messages import *
 
-# TODO: remove this dependency (loading the output module to get the suffix
-# requires a compiler / default instance)
-import pycuda.autoinit
+# Genomes the client assumes the server still holds, from those it has sent
+# lately. Tasks for a genome the server doesn't hold are sent again with it.
+SENT_ANIMS = 64
 
 class RenderClient(object):
     def __init__(self, task_addr, rsp_addr, ctx=None, start=True):
@@ -33,6 +36,8 @@ class RenderClient(object):
         self.tq = queue.Channel()
 
         self.taskmap = weakref.WeakValueDictionary()
+        self.sent = wire.BlobStore(SENT_ANIMS)
+        self._anim = (None, None)
         if start: self.start()
 
     def put(self, task, rq=None):
@@ -48,20 +53,43 @@ class RenderClient(object):
         spawn(self._deal_tasks)
         spawn(self._deal_rsps)
 
+    def _anim_blob(self, anim):
+        # Consecutive tasks usually share a genome (the same object)
+        if self._anim[0] is not anim:
+            self._anim = (anim, anim_blob(anim))
+        return self._anim[1]
+
     def _deal_tasks(self):
         for task, rq in self.tq:
             rid = uuid.uuid1().hex
             self.taskmap[rid] = rq
-            atask = AddressedTask([self.cid, rid], task)
-            self.tsock.send_pyobj(atask)
-            # Wait for an (empty) response. This ratelimits tasks.
-            self.tsock.recv()
+            ahash, adata = self._anim_blob(task.anim)
+            meta = task_meta(task, addr=[self.cid, rid])
+            refs = dict(anim=ahash)
+            attach = self.sent.select(refs, {ahash: adata})
+            while True:
+                self.tsock.send_multipart(
+                        wire.encode_task(wire.TASK, meta, refs, attach),
+                        copy=False)
+                # Wait for a response. This ratelimits tasks.
+                rsp = wire.decode(self.tsock.recv_multipart())
+                if rsp.kind == wire.ACK:
+                    break
+                elif rsp.kind == wire.NEED and not attach:
+                    attach = [(ahash, adata)]
+                else:
+                    # Tell whoever waits on the task, and carry on
+                    print '!!', task.id, 'refused:', rsp.meta.get('error',
+                                                                  rsp.kind)
+                    self.taskmap.pop(rid, None)
+                    rq.put(None)
+                    break
 
     def _deal_rsps(self):
         while True:
-            rsp = self.rsock.recv_multipart(copy=False)
-            rq = self.taskmap.get(rsp[0].bytes, None)
-            if rq: rq.put((rsp[1].bytes, rsp[2].bytes.split('\0'), rsp[3:]))
+            msg = wire.decode(self.rsock.recv_multipart(copy=False))
+            rq = self.taskmap.get(msg.meta['id'], None)
+            if rq: rq.put((msg.meta['attached'], msg.blobs))
 
 # Time (in seconds) before a job times out
 # TODO: replace timeout mechanism with polling?
@@ -73,61 +101,144 @@ QUEUE_LENGTH_FACTOR=2
 
 RETRIES=2
 
-def iter_genomes(prof, outpath, gpaths):
+# Genome database used by conversion processes
+_gdb = None
+
+def _init_converter(dbpath):
+    global _gdb
+    _gdb = db.connect(dbpath)
+
+def convert_genome(prof, outpath, gpath):
+    """
+    Convert the genome at `gpath` to an animation and find the frame times
+    to render. Returns `(odir, gnm, ghash, times)`, or None if the genome
+    can't be loaded or its output is already complete. Runs in a pool
+    process set up by `_init_converter`.
+    """
+    try:
+        gnm, basename = _gdb.get_anim(gpath)
+    except IOError:
+        return None
+    odir = os.path.join(outpath, basename)
+    if (os.path.isfile(os.path.join(odir, 'COMPLETE')) or
+        os.path.isfile(os.path.join(outpath, 'ref', basename+'.ts'))):
+        return None
+    gprof = profile.wrap(prof, gnm)
+    times = list(profile.enumerate_times(gprof))
+    return odir, gnm, kernel_key(gnm), times
+
+def _wait(result):
+    # Poll, so the other greenlets can send tasks and take results meanwhile
+    while not result.ready():
+        gevent.sleep(0.01)
+    return result.get()
+
+def _imap_ordered(pool, fn, argss, window):
+    """
+    Like `pool.imap`, but with no more than `window` calls in flight or
+    finished and waiting to be consumed, and yielding to gevent while
+    results are pending.
+    """
+    pending = deque()
+    for args in argss:
+        pending.append(pool.apply_async(fn, args))
+        if len(pending) >= window:
+            yield _wait(pending.popleft())
+    while pending:
+        yield _wait(pending.popleft())
+
+# Output file suffixes, by the profile's output options. Finding the suffix
+# means instantiating (and compiling) an output module.
+_suffixes = {}
+
+def output_suffix(prof, gprof):
+    key = json.dumps(prof.get('output', {}), sort_keys=True)
+    if key not in _suffixes:
+        # TODO: remove this dependency (loading the output module to get
+        # the suffix requires a compiler / default instance). Imported here
+        # so that the conversion pool isn't forked with a live context.
+        import pycuda.autoinit
+        _suffixes[key] = output.get_output_for_profile(gprof).suffix
+    return _suffixes[key]
+
+def iter_genomes(prof, outpath, gpaths, processes=None):
     """
     Walk a list of genome paths, yielding them in an order suitable for
     the `genomes` argument of `create_jobs()`.
-    """
-    gdb = db.connect('.')
 
-    for gpath in gpaths:
-        try:
-            gnm, basename = gdb.get_anim(gpath)
-        except IOError:
-            continue
-        odir = os.path.join(outpath, basename)
-        if (os.path.isfile(os.path.join(odir, 'COMPLETE')) or
-            os.path.isfile(os.path.join(outpath, 'ref', basename+'.ts'))):
-            continue
-        gprof = profile.wrap(prof, gnm)
-        ghash = util.hash(gnm)
-        times = list(profile.enumerate_times(gprof))
-        if not os.path.isdir(odir):
-            os.makedirs(odir)
-        with open(os.path.join(odir, 'NFRAMES'), 'w') as fp:
-            fp.write(str(len(times)))
-        outmod = output.get_output_for_profile(gprof)
-        for i, t in times:
-            opath = os.path.join(odir, '%05d' % i)
-            if not os.path.isfile(opath + outmod.suffix):
-                yield Task(opath, ghash, prof, gnm, t)
+    Genomes are converted to animations on a pool of `processes` processes
+    (by default, one per CPU; 0 converts them in this process), and tasks
+    are yielded in path order as the conversions finish. The pool is started
+    by this call, not when iteration begins, so call it before setting up
+    CUDA or zmq, neither of which survives a fork.
+    """
+    argss = ((prof, outpath, gpath) for gpath in gpaths)
+    if processes == 0:
+        _init_converter('.')
+        return _iter_tasks(prof, (convert_genome(*args) for args in argss))
+    processes = processes or multiprocessing.cpu_count()
+    pool = multiprocessing.Pool(processes, _init_converter, ('.',))
+    convs = _imap_ordered(pool, convert_genome, argss, 4 * processes)
+    return _iter_tasks(prof, convs, pool)
 
-def get_result(cli, task, rq):
+def _iter_tasks(prof, convs, pool=None):
     try:
-        log, names, bufs = rq.get(timeout=TIMEOUT)
-    except queue.Empty:
-        cli.put(task, rq)
-        print '>>', task.id
-        log, names, bufs = rq.get()
+        for conv in convs:
+            if conv is None:
+                continue
+            odir, gnm, ghash, times = conv
+            if not os.path.isdir(odir):
+                os.makedirs(odir)
+            with open(os.path.join(odir, 'NFRAMES'), 'w') as fp:
+                fp.write(str(len(times)))
+            suffix = output_suffix(prof, profile.wrap(prof, gnm))
+            for i, t in times:
+                opath = os.path.join(odir, '%05d' % i)
+                if not os.path.isfile(opath + suffix):
+                    yield Task(opath, ghash, prof, gnm, t)
+    finally:
+        if pool is not None:
+            pool.terminate()
 
-    with open(task.id + '.log', 'wb') as fp:
-        fp.write(log)
+def get_result(cli, task, rq):
+    """
+    Wait for the result of `task` on `rq` and write it out. A task that
+    times out or is refused is sent again, up to `RETRIES` times; the last
+    attempt waits for as long as it takes.
+    """
+    for attempt in range(RETRIES + 1):
+        try:
+            rsp = rq.get(timeout=TIMEOUT if attempt < RETRIES else None)
+        except queue.Empty:
+            rsp = None
+        if rsp is not None:
+            break
+        if attempt < RETRIES:
+            cli.put(task, rq)
+            print '>>', task.id
+    else:
+        print '!!', task.id, 'failed'
+        return
+    names, bufs = rsp
 
-    for name in reversed(names):
-        buf = bufs.pop()
+    # The log comes as one more output file, with the suffix '.log'
+    for name in names:
         with open(task.id + name, 'wb') as fp:
-            fp.write(buffer(buf))
+            fp.write(buffer(bufs[name]))
     print '< ', task.id
 
 def main(addrs):
     parser = profile.add_args()
     parser.add_argument('genomes', nargs='+')
+    parser.add_argument('-j', '--jobs', metavar='N', type=int,
+        help="Processes used to convert genomes (default one per CPU)")
     args = parser.parse_args()
     prof_name, prof = profile.get_from_args(args)
 
+    # The conversion pool forks, so it goes first
+    gen = iter_genomes(prof, 'out/%s' % prof_name, args.genomes, args.jobs)
     cli = RenderClient(addrs['tasks_loprio'], addrs['responses'])
 
-    gen = iter_genomes(prof, 'out/%s' % prof_name, args.genomes)
     try:
         for task in gen:
             rq = cli.put(task)
@@ -1,5 +1,38 @@
+import json
 from collections import namedtuple
 
+from cuburn import wire
+
 Task = namedtuple('Task', 'id hash profile anim times')
-AddressedTask = namedtuple('AddressedTask', 'addr task')
-FullTask = namedtuple('FullTask', 'addr task cubin packer')
+
+def anim_blob(anim):
+    """Return ``(hash, data)`` for a task's genome, as sent on the wire."""
+    data = wire.encode_json(anim)
+    return wire.blob_hash(data), data
+
+def task_meta(task, **kwargs):
+    """The fields of a task sent as message metadata; the genome goes as a
+    blob."""
+    return dict(kwargs, id=task.id, hash=task.hash, profile=task.profile,
+                times=map(float, task.times))
+
+def read_task(msg, store):
+    """
+    Return the reply address of a decoded task message, its `Task` and the
+    task's genome blob, as ``(addr, task, (hash, data))``, resolving the
+    genome against ``store``. Raises `wire.MissingBlob` if it isn't there,
+    or `wire.ProtocolError` if the message doesn't hold a task.
+    """
+    if msg.kind != wire.TASK:
+        raise wire.ProtocolError('Expected a task')
+    try:
+        meta, refs = msg.meta, msg.meta['refs']
+        addr = map(str, meta['addr'])
+        data = store.resolve(dict(anim=refs['anim']), msg.blobs)['anim']
+        task = Task(meta['id'], meta['hash'], meta['profile'],
+                    json.loads(data), meta['times'])
+    except (wire.MissingBlob, wire.ProtocolError):
+        raise
+    except (KeyError, TypeError, ValueError):
+        raise wire.ProtocolError('Bad task')
+    return addr, task, (refs['anim'], data)
@@ -1,17 +1,45 @@
 #!/usr/bin/env python2
+import json
+import argparse
+import multiprocessing
 from itertools import takewhile
 
 import gevent
 from gevent import spawn, queue, event
 import zmq.green as zmq
-import cPickle as pickle
 
 import _importhack
+from cuburn import profile, wire
 from cuburn.render import Renderer
+from cuburn.dispatch import (WorkerPool, Scheduler, CompileService,
+                             CompileCache, frame_footprint, is_error)
 
 from messages import *
 
-ctx = zmq.Context()
+# Created by `main`, once the compile pool has forked
+ctx = None
+
+# Genomes held for clients to refer to by hash
+ANIM_BLOBS = 256
+
+# Blobs held by a worker which doesn't say how many it can hold
+WORKER_BLOBS = 16
+
+def read_client_task(sock, anims):
+    """
+    Receive a task message on a REP socket, and return it as ``(addr, task,
+    (anim_hash, anim))``. If the task's genome isn't in ``anims`` or attached,
+    or the message can't be read, reply accordingly and return None;
+    otherwise the caller must acknowledge the task.
+    """
+    frames = sock.recv_multipart(copy=False)
+    try:
+        return read_task(wire.decode(frames), anims)
+    except wire.MissingBlob, e:
+        sock.send_multipart(wire.encode(wire.NEED, dict(need=list(e.args))))
+    except wire.ProtocolError, e:
+        print 'Bad task message:', e
+        sock.send_multipart(wire.encode(wire.ERROR, dict(error=str(e))))
 
 def setup_task_listeners(addrs, tq, rq):
     hisock = ctx.socket(zmq.REP)
@@ -21,6 +49,8 @@ def setup_task_listeners(addrs, tq, rq):
 
     loevt = event.Event()
     loevt.set()
+    anims = wire.BlobStore(ANIM_BLOBS)
+    ack = wire.encode(wire.ACK)
 
     @spawn
     def listen_hi():
@@ -29,57 +59,158 @@ def setup_task_listeners(addrs, tq, rq):
                 # No messages pending. Set loevt, allowing messages from
                 # losock to be added to the queue.
                 loevt.set()
-            task = hisock.recv_pyobj()
+            task = read_client_task(hisock, anims)
+            if task is None:
+                continue
             loevt.clear() # Got message; pause listen_lo().
             tq.put(task)
-            hisock.send('')
+            hisock.send_multipart(ack)
 
     @spawn
     def listen_lo():
         while True:
             loevt.wait()
-            tq.put(losock.recv_pyobj())
-            losock.send('')
+            task = read_client_task(losock, anims)
+            if task is None:
+                continue
+            tq.put(task)
+            losock.send_multipart(ack)
+
+def compile_kernel(anim, arch):
+    # The assembled source is only useful for debugging, and would only
+    # bloat the pipe back from the pool and the compile cache. The packer
+    # is kept as it's sent to workers.
+    packer, lib, cubin = Renderer.compile(anim, arch=arch)
+    return wire.encode_json(packer.to_dict()), None, cubin
 
-def setup_worker_listener(addrs, tq, rq):
+def setup_worker_listener(addrs, tq, rq, compiler, workers, sched):
     wsock = ctx.socket(zmq.ROUTER)
     wsock.bind(addrs['workers'])
 
-    readyq = queue.Queue()
+    roomevt = event.Event()
+    # Mirrors of each worker's blob store, and the task each is working on
+    stores, running = {}, {}
+
+    def request_compiles(hash, anim):
+        for arch in workers.archs():
+            rsp = compiler.request(hash, anim, arch)
+            if rsp is not None and not is_error(rsp):
+                sched.compiled(hash, arch)
+
+    def queue_task(addr, task, anim):
+        gprof = profile.wrap(task.profile, task.anim)
+        sched.add((addr, task, anim), task.hash,
+                  frame_footprint(gprof.width, gprof.height), archs=())
+        request_compiles(task.hash, task.anim)
+
+    def send_task(worker_addr, addr, task, anim):
+        rsp = compiler.get(task.hash, workers.arch(worker_addr))
+        if rsp is None:
+            # Evicted from the compile cache since it was compiled;
+            # start over with this one
+            workers.put(worker_addr)
+            queue_task(addr, task, anim)
+            return
+        packer, lib, cubin = rsp
+        refs = dict(anim=anim[0], packer=wire.blob_hash(packer),
+                    cubin=wire.blob_hash(cubin))
+        blobs = {refs['anim']: anim[1], refs['packer']: packer,
+                 refs['cubin']: cubin}
+        attach = stores[worker_addr].select(refs, blobs)
+        msg = wire.encode_task(wire.TASK, task_meta(task, addr=addr),
+                               refs, attach)
+        running[worker_addr] = (addr, task, anim)
+        # Blobs are sent from the strings held here, without copies
+        wsock.send_multipart([worker_addr, ''] + msg, copy=False)
 
-    compcache = {}
+    def dispatch():
+        for addr, task, anim in sched.drop_unroutable():
+            print 'No worker has room for task', task.id
+        for addr, task, anim in sched.drop_uncompiled(compiler.busy):
+            print 'Dropping task', task.id, 'which failed to compile'
+        for worker_addr, item in sched.assign():
+            send_task(worker_addr, *item)
+        if not sched.full():
+            roomevt.set()
 
     @spawn
     def send_work():
-        for addr, task in tq:
+        for addr, task, anim in tq:
             print ' >', ' '.join(addr)
-            if task.hash not in compcache:
-                try:
-                    rsp = Renderer.compile(task.anim, arch='sm_35')
-                except:
-                    # Store exceptions, so that we don't try to endlessly
-                    # recompile bad genomes
-                    import traceback
-                    rsp = traceback.format_exc()
+            queue_task(addr, task, anim)
+            dispatch()
+            # Hold off on taking more tasks until there's room to wait
+            while sched.full():
+                roomevt.clear()
+                roomevt.wait()
+
+    @spawn
+    def collect_compiles():
+        while True:
+            for (hash, arch), rsp in compiler.poll():
+                if is_error(rsp):
                     print 'Error while compiling task:', rsp
-                compcache[task.hash] = rsp
-            else:
-                rsp = compcache[task.hash]
-            if isinstance(rsp, basestring):
-                continue
-            packer, lib, cubin = rsp
-            ctask = FullTask(addr, task, cubin, packer)
-            worker_addr = readyq.get()
-            wsock.send_multipart([worker_addr, '', pickle.dumps(ctask)])
+                else:
+                    sched.compiled(hash, arch)
+                dispatch()
+            gevent.sleep(0.01)
 
     @spawn
     def read_rsps():
         while True:
             rsp = wsock.recv_multipart(copy=False)
-            if rsp[2].bytes != '':
-                print '< ', rsp[2].bytes, rsp[3].bytes
-                rq.put(rsp[2:])
-            readyq.put(rsp[0])
+            worker_addr = rsp[0].bytes
+            try:
+                msg = wire.decode(rsp[2:])
+            except wire.ProtocolError, e:
+                # Most likely a worker from another version. Leave it be.
+                print 'Bad message from worker:', e
+                continue
+            if msg.kind == wire.RESULT:
+                (cid, rid), names = msg.meta['addr'], msg.meta['attached']
+                print '< ', cid, rid
+                # Output files are passed on as the frames they came in
+                rq.put([str(cid)] + wire.encode(wire.RESULT,
+                        dict(id=rid, attached=names), rsp[4:]))
+                running.pop(worker_addr, None)
+            elif msg.kind == wire.JOIN:
+                # A joining worker, advertising its capacity. It may need
+                # kernels for a new architecture.
+                workers.join(worker_addr, msg.meta)
+                stores[worker_addr] = wire.BlobStore(
+                        msg.meta.get('blobs', WORKER_BLOBS))
+                for addr, task, anim in sched.items():
+                    request_compiles(task.hash, task.anim)
+            elif msg.kind == wire.NEED:
+                # The worker's blob store and our mirror of it disagree.
+                # Both start again from empty, and the task goes back in.
+                print 'Worker lost blobs', ', '.join(msg.meta['need'])
+                stores[worker_addr].clear()
+                if worker_addr in running:
+                    queue_task(*running.pop(worker_addr))
+            elif msg.kind == wire.ERROR:
+                # The worker couldn't read the task. Its blob store starts
+                # over, and the client will resend the task after its
+                # timeout.
+                print 'Worker refused a task:', msg.meta.get('error')
+                stores[worker_addr].clear()
+                running.pop(worker_addr, None)
+            workers.put(worker_addr)
+            dispatch()
+
+def setup_status(addrs, compiler, workers, sched):
+    """Answer any request on the status socket with a JSON summary of the
+    compile cache, the workers and the tasks waiting."""
+    ssock = ctx.socket(zmq.REP)
+    ssock.bind(addrs['status'])
+
+    @spawn
+    def send_status():
+        while True:
+            ssock.recv()
+            ssock.send(json.dumps(dict(compiler=compiler.status(),
+                                       workers=workers.status(),
+                                       waiting=len(sched))))
 
 def setup_responder(addrs, rq):
     rsock = ctx.socket(zmq.ROUTER)
@@ -91,17 +222,49 @@ def setup_responder(addrs, rq):
             rsock.send_multipart(rsp)
     return send_responses
 
-def main(addrs):
+def main(addrs, pool, arch='sm_35', cache=None):
+    """
+    Serve tasks, compiling kernels on ``pool``, a `multiprocessing.Pool`.
+    Pool processes don't survive a fork with a live zmq context, so the
+    pool must be created first.
+    """
+    global ctx
+    ctx = zmq.Context()
     # Channel holding (addr, task) pairs.
     tq = queue.Channel()
     # Queue holding response messages (as a list of raw zmq frames).
     rq = queue.Queue()
 
+    compiler = CompileService(pool, compile_kernel, cache)
+    workers = WorkerPool(default_arch=arch)
+    sched = Scheduler(workers)
+
     setup_task_listeners(addrs, tq, rq)
-    setup_worker_listener(addrs, tq, rq)
+    setup_worker_listener(addrs, tq, rq, compiler, workers, sched)
+    setup_status(addrs, compiler, workers, sched)
     # TODO: Will switch to a Nanny central wait loop
     setup_responder(addrs, rq).join()
 
 if __name__ == "__main__":
     import addrs
-    main(addrs.addrs)
+    parser = argparse.ArgumentParser(description='Render task server.')
+    parser.add_argument('--arch', default='sm_35',
+        help="Architecture to compile for, for workers which don't say")
+    parser.add_argument('-j', '--jobs', metavar='N', type=int,
+        help="Processes used to compile kernels (default one per CPU)")
+    parser.add_argument('--cache-size', metavar='MB', type=int, default=256,
+        help="Memory for compiled kernels (default %(default)s MB)")
+    parser.add_argument('--spill-dir', metavar='DIR',
+        help="Keep kernels evicted from memory here, instead of dropping "
+             "them")
+    parser.add_argument('--spill-size', metavar='MB', type=int, default=1024,
+        help="Disk space for spilled kernels (default %(default)s MB)")
+    parser.add_argument('--error-ttl', metavar='SECS', type=float,
+        default=3600, help="Time before retrying a kernel which failed "
+                           "to compile (default %(default)s)")
+    args = parser.parse_args()
+    # Fork the compile pool before anything opens a zmq context
+    pool = multiprocessing.Pool(args.jobs)
+    cache = CompileCache(args.cache_size << 20, args.spill_dir,
+                         args.spill_size << 20, args.error_ttl)
+    main(addrs.addrs, pool, args.arch, cache)
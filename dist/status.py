@@ -0,0 +1,23 @@
+#!/usr/bin/env python2
+"""
+Print the status of a running render server: its compile cache, its workers
+and how many tasks are waiting.
+"""
+import sys
+import json
+
+import zmq
+
+def main(addr):
+    ctx = zmq.Context()
+    sock = ctx.socket(zmq.REQ)
+    sock.setsockopt(zmq.LINGER, 0)
+    sock.connect(addr)
+    sock.send('')
+    if not sock.poll(timeout=5000):
+        sys.exit('No response from server at ' + addr)
+    print json.dumps(json.loads(sock.recv()), indent=2, sort_keys=True)
+
+if __name__ == "__main__":
+    import addrs
+    main(addrs.addrs['status'])
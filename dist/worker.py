@@ -1,6 +1,9 @@
 #!/usr/bin/env python2
 import sys
+import json
 import socket
+import shutil
+import tempfile
 from cStringIO import StringIO
 
 import gevent
@@ -10,7 +13,9 @@ import pycuda.driver as cuda
 cuda.init()
 
 import _importhack
-from cuburn import render, profile, output
+from cuburn import render, profile, output, writer, wire
+from cuburn.code import util
+from cuburn.code.interp import GenomePacker
 from cuburn.genome import convert, db, use
 
 from messages import *
@@ -22,7 +27,14 @@ class PrecompiledRenderer(render.Renderer):
         self.packer, self.cubin = packer, cubin
         super(PrecompiledRenderer, self).__init__(gnm, gprof)
 
+# Genomes, packers and cubins kept by each request loop, so the server need
+# only send those it hasn't sent the loop lately
+BLOBS = 16
+
 def main(worker_addr):
+    # Measured before anything is allocated, since the server's estimate of
+    # a task's footprint includes the RenderManager's fixed buffers
+    mem_free, mem_total = cuda.mem_get_info()
     rmgr = render.RenderManager()
 
     ctx = zmq.Context()
@@ -33,34 +45,93 @@ def main(worker_addr):
         sock = ctx.socket(zmq.REQ)
         sock.connect(worker_addr)
 
-        # Start the request loop with an empty job
-        sock.send('')
+        # Start the request loop by joining, telling the server how much
+        # memory there is for it to fill, what to compile for, and how many
+        # blobs to expect this loop to keep
+        name = (socket.gethostname() + ':' +
+                cuda.Context.get_current().get_device().pci_bus_id())
+        desc = dict(name=name, mem=mem_free, mem_total=mem_total,
+                    arch=util.device_arch(), blobs=BLOBS)
+        sock.send_multipart(wire.encode(wire.JOIN, desc))
 
-        hash = None
+        store = wire.BlobStore(BLOBS)
+        hash = anim_hash = prof = None
         while True:
-            log = [('worker', socket.gethostname() + ':' +
-                    cuda.Context.get_current().get_device().pci_bus_id())]
-            addr, task, cubin, packer = sock.recv_pyobj()
+            log = [('worker', name)]
+            try:
+                msg = wire.decode(sock.recv_multipart(copy=False))
+                if msg.kind != wire.TASK:
+                    raise wire.ProtocolError('Expected a task')
+                meta, refs = msg.meta, msg.meta['refs']
+                blobs = store.resolve(refs, msg.blobs)
+                if anim_hash != refs['anim']:
+                    anim = json.loads(blobs['anim'])
+                    anim_hash = refs['anim']
+                task = Task(meta['id'], meta['hash'], meta['profile'], anim,
+                            meta['times'])
+            except wire.MissingBlob, e:
+                # Out of step with the server; both start over
+                store.clear()
+                sock.send_multipart(wire.encode(wire.NEED,
+                                                dict(need=list(e.args))))
+                continue
+            except (KeyError, TypeError, ValueError), e:
+                # Includes wire.ProtocolError. The server drops the task,
+                # and as with a missing blob, both stores start over.
+                print 'Bad task message:', repr(e)
+                store.clear()
+                sock.send_multipart(wire.encode(wire.ERROR,
+                                                dict(error=repr(e))))
+                continue
             gprof = profile.wrap(task.profile, task.anim)
+            task_prof = json.dumps(task.profile, sort_keys=True)
             if hash != task.hash:
-                rdr = PrecompiledRenderer(task.anim, gprof, packer, cubin)
+                # Keeping the renderer also keeps its packer's cache, so
+                # later tasks for the same kernel only repack what changed
+                packer = GenomePacker.from_dict(json.loads(blobs['packer']))
+                rdr = PrecompiledRenderer(task.anim, gprof, packer,
+                                          blobs['cubin'])
+                hash, prof = task.hash, task_prof
+            elif prof != task_prof:
+                rdr.set_profile(gprof)
+                prof = task_prof
+            segments = {}
+            def collect(out):
+                for suffix, file_like in out.items():
+                    if rdr.out.stream:
+                        # Spool streamed chunks rather than holding them
+                        if suffix not in segments:
+                            segments[suffix] = tempfile.TemporaryFile()
+                        shutil.copyfileobj(file_like, segments[suffix])
+                    else:
+                        segments[suffix] = file_like
+
+            out = {}
             for t in task.times:
                 evt, buf = rmgr.queue_frame(rdr, task.anim, gprof, t)
                 while not evt.query():
                     gevent.sleep(0.01)
                 out, frame_log = rdr.out.encode(buf)
+                collect(out)
                 log += frame_log
                 print 'Rendered', task.id, 'in', int(evt.time()), 'ms'
             final_out, final_log = rdr.out.encode(None)
-            assert not (out and final_out), 'Got output from two sources!'
-            out = out or final_out
+            assert rdr.out.stream or not (out and final_out), \
+                    'Got output from two sources!'
+            collect(final_out)
             log += final_log
             log = '\0'.join([k + ' ' + v for k, v in log])
 
-            suffixes, files = zip(*[(k, v.read())
-                                    for k, v in sorted(out.items())])
-            # TODO: reduce copies, generally spruce up the memory usage here
-            sock.send_multipart(addr + [log, '\0'.join(suffixes)] + list(files))
+            # Segments in files are mapped, not read, and zmq sends them
+            # from the mappings without making copies of its own. The log
+            # goes along as one more file.
+            for f in segments.values():
+                f.flush()
+            suffixes, files = zip(*[(k, writer.segment_buffer(v))
+                                    for k, v in sorted(segments.items())])
+            meta = dict(addr=meta['addr'], attached=['.log'] + list(suffixes))
+            sock.send_multipart(wire.encode(wire.RESULT, meta,
+                                            [log] + list(files)), copy=False)
 
     # Spawn two request loops to take advantage of CUDA pipelining.
     spawn(request_loop)
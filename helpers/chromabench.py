@@ -0,0 +1,69 @@
+"""
+Compare host chroma subsampling for `VPxOutput`'s yuv420p mode on 4K
+frames: the old every-other-pixel decimation against the 2x2 box filter,
+on one or more threads. Reports time per frame, and the RMS error of each
+method against a floating-point area average on a frame with fractal-like
+high-frequency detail. Run from the repository root:
+
+    python helpers/chromabench.py [width height] [nframes]
+"""
+
+import sys, time, multiprocessing
+sys.path.insert(0, '.')
+import numpy as np
+
+from cuburn import writer
+
+def test_frame(w, h):
+    # Noise at every octave, so there's energy right up to Nyquist
+    rand = np.random.RandomState(0)
+    img = np.zeros((2, h, w))
+    for octave in range(8):
+        s = 1 << octave
+        noise = rand.rand(2, (h + s - 1) / s, (w + s - 1) / s)
+        img += noise.repeat(s, 1).repeat(s, 2)[:,:h,:w] / (octave + 1)
+    img = (img - img.min()) / (img.max() - img.min())
+    return np.uint8(img * 255)
+
+def tostring(planes):
+    # The original path, which also copied the luma plane (the first chroma
+    # plane stands in for it here)
+    return (planes[0].tostring(), planes[0,::2,::2].tostring(),
+            planes[1,::2,::2].tostring())
+
+def decimate(staging, planes):
+    n, h, w = planes.shape
+    out = staging.get('out', (n, (h + 1) / 2, (w + 1) / 2), planes.dtype)
+    np.copyto(out, planes[:,::2,::2])
+    return out
+
+def bench(fn, planes, nframes):
+    fn(planes)
+    t = time.time()
+    for i in range(nframes):
+        out = fn(planes)
+    return (time.time() - t) / nframes, out
+
+def main(w=3840, h=2160, nframes=20):
+    planes = test_frame(w, h)
+    ref = planes.astype(float).reshape(2, h / 2, 2, w / 2, 2).mean(axis=(2, 4))
+    staging = writer.StagingBuffers()
+    methods = [('tostring', tostring),
+               ('decimate', lambda p: decimate(staging, p)),
+               ('box, 1 thread', writer.ChromaSubsampler())]
+    ncpu = multiprocessing.cpu_count()
+    if ncpu > 1:
+        methods.append(('box, %d threads' % ncpu,
+                        writer.ChromaSubsampler(ncpu)))
+    print '%dx%d, %d frames' % (w, h, nframes)
+    for name, fn in methods:
+        dt, out = bench(fn, planes, nframes)
+        if isinstance(out, tuple):
+            print '%-16s %7.2f ms/frame' % (name, dt * 1e3)
+            continue
+        rms = np.sqrt(np.mean((out - ref) ** 2))
+        print '%-16s %7.2f ms/frame   RMS error %6.3f' % (name, dt * 1e3, rms)
+
+if __name__ == "__main__":
+    args = map(int, sys.argv[1:])
+    main(*args)
@@ -0,0 +1,110 @@
+"""
+Simulate the dist server handing tasks to a pool of workers, to compare the
+old first-ready dispatch against hash-affinity scheduling with a few window
+sizes. Tasks come from several animations at once, interleaved as the
+client shards them, and a worker pays a fixed cost to load the kernel
+whenever it gets a task with a different hash from its last. Reports
+simulated throughput, the fraction of tasks that reused a loaded kernel,
+and the most any task was passed over. Run from the repository root:
+
+    python helpers/dispatchbench.py [nworkers] [nanims] [ntasks]
+"""
+
+import sys, heapq
+sys.path.insert(0, '.')
+import numpy as np
+
+from cuburn import dispatch
+
+# Seconds per task, and to load a kernel
+RENDER, RELOAD = 2.0, 0.6
+
+class FirstReady(object):
+    """The old dispatch: each task, in order, to the first ready worker."""
+    def __init__(self, workers):
+        self.workers, self.pending = workers, []
+    def full(self):
+        return bool(self.pending)
+    def add(self, item, hash, size):
+        self.pending.append((item, hash))
+    def assign(self):
+        out = []
+        while self.pending and self.workers.ready:
+            item, hash = self.pending.pop(0)
+            addr = self.workers.ready.pop(0)
+            self.workers.assigned(addr, hash)
+            out.append((addr, item))
+        return out
+
+def tasks(nanims, ntasks, rand):
+    # Each animation's tasks in order, from animations started at random
+    anims = [iter(range(ntasks / nanims)) for i in range(nanims)]
+    while anims:
+        i = rand.randint(len(anims))
+        try:
+            yield i, next(anims[i])
+        except StopIteration:
+            anims.pop(i)
+
+def simulate(sched, nworkers, nanims, ntasks, seed=0):
+    """Run all tasks through ``sched``, and return the simulated time taken
+    and the fraction of tasks which reused a loaded kernel."""
+    pool = sched.workers
+    loaded, now, events = {}, 0., []
+    src = tasks(nanims, ntasks, np.random.RandomState(seed))
+    for w in range(nworkers):
+        pool.join(w)
+        pool.put(w)
+    while True:
+        # As the server does: take tasks while there's room to hold them,
+        # handing out what can go each time
+        while True:
+            while not sched.full():
+                task = next(src, None)
+                if task is None:
+                    break
+                sched.add(task, task[0], 0)
+            assigned = sched.assign()
+            for addr, task in assigned:
+                cost = RENDER + (RELOAD if loaded.get(addr) != task[0] else 0)
+                loaded[addr] = task[0]
+                heapq.heappush(events, (now + cost, addr))
+            if not assigned:
+                break
+        if not events:
+            break
+        now, addr = heapq.heappop(events)
+        pool.put(addr)
+    tally = [(d.get('hits', 0), d.get('tasks', 0))
+             for d in pool.workers.values()]
+    hits, total = map(sum, zip(*tally))
+    return now, hits / float(total)
+
+class TrackingScheduler(dispatch.Scheduler):
+    """Notes the most times any task was passed over."""
+    worst = 0
+    def _pop(self, p, addr):
+        eligible = self._eligible()
+        skips = [q.skips + 1 for q in eligible[:eligible.index(p)]]
+        self.worst = max([self.worst] + skips)
+        return dispatch.Scheduler._pop(self, p, addr)
+
+def main(nworkers=8, nanims=6, ntasks=1200):
+    print ('%d workers, %d animations, %d tasks; %.1fs per task, %.1fs per '
+           'kernel load' % (nworkers, nanims, ntasks, RENDER, RELOAD))
+    print '%-14s %9s %10s %10s' % ('scheduler', 'tasks/s', 'hit rate',
+                                   'max skips')
+    scheds = [('first ready', lambda pool: FirstReady(pool))]
+    for window in (0, 2, 4, 8, 16):
+        scheds.append(('window %d' % window,
+                       lambda pool, w=window: TrackingScheduler(pool, w)))
+    for name, make in scheds:
+        sched = make(dispatch.WorkerPool())
+        t, hit = simulate(sched, nworkers, nanims, ntasks)
+        print '%-14s %9.3f %9.1f%% %10d' % (name, ntasks / t, hit * 100,
+                                           getattr(sched, 'worst', 0))
+    print '%-14s %9.3f' % ('no reloads', nworkers / RENDER)
+
+if __name__ == "__main__":
+    args = map(int, sys.argv[1:])
+    main(*args)
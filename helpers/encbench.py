@@ -0,0 +1,55 @@
+"""
+Measure image encoding throughput, in frames per second, for synthetic
+uint8 frames pushed through `writer.EncoderPool` with different numbers of
+threads. Needs PIL, but not CUDA. Run from the repository root:
+
+    python helpers/encbench.py [png|jpeg] [width height] [nframes]
+"""
+
+import os, sys, time, shutil, tempfile, multiprocessing
+sys.path.insert(0, '.')
+import numpy as np
+
+from cuburn import writer
+
+def frames(w, h, n):
+    # Smooth gradients plus noise, so the compressors have some real work
+    rand = np.random.RandomState(0)
+    y, x = np.mgrid[:h,:w]
+    base = np.dstack([x * 255 / w, y * 255 / h, (x + y) % 256,
+                      np.full((h, w), 255)]).astype(np.uint8)
+    for i in range(n):
+        yield base + rand.randint(0, 8, base.shape).astype(np.uint8)
+
+def encode(path, buf, codec):
+    writer.write_atomic(path, writer.encode_image(buf, codec).read())
+    return path
+
+def bench(codec, w, h, n, nthreads, outdir):
+    bufs = list(frames(w, h, n))
+    pool = writer.EncoderPool(nthreads)
+    t = time.time()
+    for i, buf in enumerate(bufs):
+        pool.submit(encode, os.path.join(outdir, '%05d.%s' % (i, codec)),
+                    buf, codec)
+    pool.close()
+    return n / (time.time() - t)
+
+def main(codec='png', w=1920, h=1080, n=24):
+    outdir = tempfile.mkdtemp()
+    try:
+        ncpu = multiprocessing.cpu_count()
+        counts = sorted(set([1, 2, 4, ncpu]))
+        print '%s %dx%d, %d frames' % (codec, w, h, n)
+        for nthreads in counts:
+            fps = bench(codec, w, h, n, nthreads, outdir)
+            print '%3d threads: %6.2f fps' % (nthreads, fps)
+    finally:
+        shutil.rmtree(outdir)
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    codec = args.pop(0) if args else 'png'
+    w, h = map(int, args[:2]) if len(args) >= 2 else (1920, 1080)
+    n = int(args[2]) if len(args) > 2 else 24
+    main(codec, w, h, n)
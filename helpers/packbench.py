@@ -0,0 +1,62 @@
+"""
+Time `GenomePacker.pack` on genomes with many xforms and variations: a cold
+pack, a repack of an unchanged genome, and a repack after changing one value
+(the common case when rendering consecutive frames or tasks). Run from the
+repository root.
+"""
+
+import sys, time
+sys.path.insert(0, '.')
+import numpy as np
+
+from cuburn.code import iter
+from cuburn.genome.variations import var_params
+
+VARS = ['linear', 'julia', 'spherical', 'waves', 'perspective', 'julian',
+        'curl', 'rings2', 'fan2', 'blob']
+
+def anim(rand, nxf, nvar):
+    def spline():
+        return list(rand.uniform(-1, 1, 2 * rand.randint(1, 6)))
+    def xform():
+        xf = {'weight': spline(), 'color': spline(),
+              'pre_affine': {'angle': spline(), 'spread': spline(),
+                             'offset': {'x': spline(), 'y': spline()}},
+              'post_affine': {'angle': spline()}, 'variations': {}}
+        for v in rand.choice(VARS, nvar, replace=False):
+            xf['variations'][v] = dict((p, spline()) for p in var_params[v])
+            xf['variations'][v]['weight'] = spline()
+        return xf
+    return {'type': 'animation', 'camera': {'scale': spline()},
+            'xforms': dict((str(i), xform()) for i in range(nxf))}
+
+def bench(fn, reps):
+    t = time.time()
+    for i in range(reps):
+        fn()
+    return (time.time() - t) / reps
+
+def main(reps=50):
+    rand = np.random.RandomState(0)
+    print '%4s %4s %6s %10s %10s %10s' % (
+            'xfs', 'vars', 'rows', 'cold', 'unchanged', 'one edit')
+    for nxf, nvar in [(2, 2), (6, 4), (12, 6), (24, 8)]:
+        gnm = anim(rand, nxf, nvar)
+        packer, lib = iter.mkiterlib(gnm)
+
+        def cold():
+            del packer._pack_states[:]
+            packer.pack(gnm)
+        def edit():
+            gnm['camera']['scale'][0] = rand.rand()
+            packer.pack(gnm)
+
+        tcold = bench(cold, reps)
+        tsame = bench(lambda: packer.pack(gnm), reps)
+        tedit = bench(edit, reps)
+        print '%4d %4d %6d %8.2fms %8.2fms %8.2fms' % (
+                nxf, nvar, len(packer.genome),
+                tcold * 1e3, tsame * 1e3, tedit * 1e3)
+
+if __name__ == "__main__":
+    main()
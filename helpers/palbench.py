@@ -0,0 +1,58 @@
+"""
+Measure how fast flam3 palettes are parsed, comparing the old per-element
+conversion of `<color>` entries against `XMLGenomeParser`'s batched one,
+and the hex `<palette>` format. Run from the repository root:
+
+    python helpers/palbench.py [nflames]
+"""
+
+import sys, time
+sys.path.insert(0, '.')
+import numpy as np
+
+from cuburn.genome import convert
+
+class OldParser(convert.XMLGenomeParser):
+    def start_element(self, name, attrs):
+        if name == 'color':
+            idx = int(attrs['index'])
+            self._flame['palette'][idx][:3] = [float(v) / 255.0
+                                               for v in attrs['rgb'].split()]
+        else:
+            super(OldParser, self).start_element(name, attrs)
+
+def flame(rgb, hex):
+    if hex:
+        pal = '<palette count="256" format="RGB">%s</palette>' % ''.join(
+                '%02X' % v for v in rgb.flat)
+    else:
+        pal = ''.join('<color index="%d" rgb="%d %d %d"/>' % ((i,) + tuple(c))
+                      for i, c in enumerate(rgb))
+    return ('<flame size="640 480" scale="100"><xform weight="1" '
+            'linear="1" coefs="1 0 0 1 0 0"/>%s</flame>' % pal)
+
+def bench(cls, xml, nflames):
+    t = time.time()
+    flames = cls.parse(xml)
+    dt = time.time() - t
+    assert len(flames) == nflames
+    return dt, flames
+
+def main(nflames=2000):
+    rand = np.random.RandomState(0)
+    rgb = rand.randint(0, 256, (256, 3))
+    colors = '<flames>%s</flames>' % (flame(rgb, False) * nflames)
+    hexes = '<flames>%s</flames>' % (flame(rgb, True) * nflames)
+    print '%d flames' % nflames
+    ref = None
+    for name, cls, xml in [('old <color>', OldParser, colors),
+                           ('new <color>', convert.XMLGenomeParser, colors),
+                           ('hex <palette>', convert.XMLGenomeParser, hexes)]:
+        dt, flames = bench(cls, xml, nflames)
+        pal = flames[-1]['palette']
+        ref = pal if ref is None else ref
+        print '%-14s %8.1f flames/s   max error %g' % (
+                name, nflames / dt, np.abs(pal - ref).max())
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
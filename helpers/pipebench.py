@@ -0,0 +1,79 @@
+"""
+Measure how fast host frames can be pushed to an encoder subprocess, using
+`cat > /dev/null` as a stand-in for x264 and vpxenc. Compares the old
+copy-per-frame paths against the staged, memoryview-based writes used by
+`X264Output` and `VPxOutput`. Run from the repository root (Linux only):
+
+    python helpers/pipebench.py [width height] [nframes]
+
+Allocation is measured by minor page faults: with glibc's mmap threshold
+fixed, every large temporary array is mapped fresh and faults its pages
+in, while reused buffers have already been faulted in.
+"""
+
+import sys, time, ctypes, resource
+sys.path.insert(0, '.')
+from subprocess import Popen, PIPE
+import numpy as np
+
+from cuburn import writer
+
+M_MMAP_THRESHOLD = -3
+PAGE = resource.getpagesize()
+
+def x264_old(buf, st, fp):
+    fp.write(buffer(np.delete(buf, 3, axis=2)))
+    fp.write(buf[:,:,3].tostring())
+
+def x264_new(buf, st, fp):
+    rgb = st.get('rgb', buf.shape[:2] + (3,), buf.dtype)
+    np.copyto(rgb, buf[:,:,:3])
+    alpha = st.get('alpha', buf.shape[:2], buf.dtype)
+    np.copyto(alpha, buf[:,:,3])
+    writer.write_planes(fp, rgb, alpha)
+
+def vpx_old(buf, st, fp):
+    fp.write(buf[0].tostring())
+    fp.write(buf[1,::2,::2].tostring())
+    fp.write(buf[2,::2,::2].tostring())
+
+def vpx_new(buf, st, fp):
+    h, w = buf.shape[1:]
+    chroma = st.get('chroma', (2, (h+1)/2, (w+1)/2), buf.dtype)
+    np.copyto(chroma, buf[1:,::2,::2])
+    writer.write_planes(fp, buf[0], chroma)
+
+def bench(fn, buf, nframes):
+    subp = Popen('cat > /dev/null', shell=True, stdin=PIPE)
+    st = writer.StagingBuffers()
+    fn(buf, st, subp.stdin)
+    faults = resource.getrusage(resource.RUSAGE_SELF).ru_minflt
+    t = time.time()
+    for i in range(nframes):
+        fn(buf, st, subp.stdin)
+    dt = time.time() - t
+    faults = resource.getrusage(resource.RUSAGE_SELF).ru_minflt - faults
+    subp.stdin.close()
+    subp.wait()
+    return dt, faults / float(nframes)
+
+def main(w=1920, h=1080, nframes=60):
+    ctypes.CDLL('libc.so.6').mallopt(M_MMAP_THRESHOLD, 128 << 10)
+    rand = np.random.RandomState(0)
+    rgba = rand.randint(0, 65536, (h, w, 4)).astype('u2')
+    yuv = rand.randint(0, 256, (3, h, w)).astype('u1')
+    print '%dx%d, %d frames' % (w, h, nframes)
+    print '%-10s %10s %12s %14s' % ('path', 'MB/s', 'faults/frm',
+                                    'fresh MB/frm')
+    for name, fn, buf in [('x264 old', x264_old, rgba),
+                          ('x264 new', x264_new, rgba),
+                          ('vpx old', vpx_old, yuv),
+                          ('vpx new', vpx_new, yuv)]:
+        dt, faults = bench(fn, buf, nframes)
+        print '%-10s %10.1f %12.1f %14.2f' % (
+                name, buf.nbytes * nframes / dt / 1e6, faults,
+                faults * PAGE / 1e6)
+
+if __name__ == "__main__":
+    args = map(int, sys.argv[1:])
+    main(*args)
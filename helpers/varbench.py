@@ -0,0 +1,42 @@
+"""
+Time each host variation over a batch of points, to see which ones dominate
+the per-sample cost of CPU rendering. Run from the repository root.
+"""
+
+import sys, time
+sys.path.insert(0, '.')
+import numpy as np
+
+from cuburn.genome.variations import var_params
+from cuburn.cpu import variations
+from cuburn.cpu.iter import HostRNG
+
+class Param(float):
+    """A value whose every sub-parameter is the same value."""
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return self.__dict__.get(name, self)
+    def _set(self, name, val):
+        self.__dict__[name] = val
+
+def bench(name, n, reps):
+    rng = HostRNG(0)
+    tx, ty = rng.next_11(n), rng.next_11(n)
+    pv, px = Param(0.7), Param(0.7)
+    if name in variations.var_precalc:
+        variations.var_precalc[name](pv, px)
+    fun = variations.var_funcs[name]
+    t = time.time()
+    for i in range(reps):
+        fun(tx.copy(), ty.copy(), np.float32(0.7), pv, px, rng)
+    return (time.time() - t) / (n * reps)
+
+def main(n=1<<18, reps=5):
+    np.seterr(all='ignore')
+    times = [(bench(k, n, reps), k) for k in sorted(var_params)]
+    for t, k in sorted(times, reverse=True):
+        print '%-16s %6.2f ns/sample' % (k, t * 1e9)
+
+if __name__ == "__main__":
+    main()
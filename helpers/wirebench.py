@@ -0,0 +1,119 @@
+"""
+Compare the old pickled server-to-worker task messages against the framed
+protocol in `cuburn.wire`, for a stream of tasks from several genomes, each
+with its own kernel, sent to one worker. Reports bytes sent per task, and,
+if pyzmq is installed, tasks per second sent over a TCP loopback and decoded
+as the worker does. Run from the repository root:
+
+    python helpers/wirebench.py [nanims] [tasks_per_anim] [cubin_kb]
+"""
+
+import sys, json, time, threading
+sys.path.insert(0, '.')
+import cPickle as pickle
+import numpy as np
+
+from cuburn import wire, profile
+from cuburn.code import iter
+from cuburn.code.interp import GenomePacker
+from cuburn.code.tests.test_iter import random_anim
+
+sys.path.insert(0, 'dist')
+from messages import Task, anim_blob, task_meta
+
+ADDR = 'tcp://127.0.0.1:5599'
+
+def make_tasks(nanims, per_anim, cubin_kb, seed=0):
+    """Yield ``(addr, task, packer, cubin)`` for a run of tasks from each
+    animation in turn, as the client sends them."""
+    rand = np.random.RandomState(seed)
+    prof = profile.BUILTIN['720p']
+    for i in range(nanims):
+        anim = random_anim(rand, nxf=4)
+        packer, lib = iter.mkiterlib(anim)
+        cubin = rand.bytes(cubin_kb << 10)
+        for j in range(per_anim):
+            times = list(np.linspace(j, j + 1, 4, endpoint=False) / per_anim)
+            task = Task('out/anim%d/%05d' % (i, j), 'kernel%d' % i, prof,
+                        anim, times)
+            yield ['client', 'req%d' % j], task, packer, cubin
+
+def pickled(tasks):
+    # As the server did: the whole task in one frame, at pickle protocol 0
+    for addr, task, packer, cubin in tasks:
+        yield [pickle.dumps((addr, task, cubin, packer))]
+
+def framed(tasks):
+    # As the server does now, for one worker
+    store = wire.BlobStore()
+    for addr, task, packer, cubin in tasks:
+        packer = wire.encode_json(packer.to_dict())
+        ahash, adata = anim_blob(task.anim)
+        refs = dict(anim=ahash, packer=wire.blob_hash(packer),
+                    cubin=wire.blob_hash(cubin))
+        blobs = {ahash: adata, refs['packer']: packer, refs['cubin']: cubin}
+        attach = store.select(refs, blobs)
+        yield wire.encode_task(wire.TASK, task_meta(task, addr=addr),
+                               refs, attach)
+
+def read_pickled(frames, state):
+    return pickle.loads(frames[0].bytes)
+
+def read_framed(frames, state):
+    msg = wire.decode(frames)
+    refs = msg.meta['refs']
+    blobs = state.setdefault('store', wire.BlobStore()).resolve(refs,
+                                                                msg.blobs)
+    # Genomes and packers are only decoded when they change
+    if state.get('anim') != refs['anim']:
+        state['anim'] = refs['anim']
+        json.loads(blobs['anim'])
+    if state.get('packer') != refs['packer']:
+        state['packer'] = refs['packer']
+        GenomePacker.from_dict(json.loads(blobs['packer']))
+
+def loopback(msgs, read):
+    """Send ``msgs`` over TCP and return the time until the last one has
+    been received and read."""
+    import zmq
+    ctx = zmq.Context()
+    rsock = ctx.socket(zmq.PULL)
+    rsock.bind(ADDR)
+    ssock = ctx.socket(zmq.PUSH)
+    ssock.connect(ADDR)
+    def receive():
+        state = {}
+        for i in range(len(msgs)):
+            read(rsock.recv_multipart(copy=False), state)
+    thread = threading.Thread(target=receive)
+    t = time.time()
+    thread.start()
+    for frames in msgs:
+        ssock.send_multipart(frames, copy=False)
+    thread.join()
+    t = time.time() - t
+    ssock.close()
+    rsock.close()
+    ctx.term()
+    return t
+
+def main(nanims=8, per_anim=16, cubin_kb=256):
+    ntasks = nanims * per_anim
+    print ('%d animations, %d tasks each, %d KB cubins'
+           % (nanims, per_anim, cubin_kb))
+    try:
+        import zmq
+    except ImportError:
+        zmq = None
+        print 'pyzmq not installed; reporting message sizes only'
+    print '%-10s %12s %10s' % ('format', 'bytes/task', 'tasks/s')
+    for name, encode, read in [('pickle', pickled, read_pickled),
+                               ('framed', framed, read_framed)]:
+        msgs = list(encode(make_tasks(nanims, per_anim, cubin_kb)))
+        size = sum(len(f) for frames in msgs for f in frames)
+        rate = ntasks / loopback(msgs, read) if zmq else float('nan')
+        print '%-10s %12d %10.1f' % (name, size / ntasks, rate)
+
+if __name__ == "__main__":
+    args = map(int, sys.argv[1:])
+    main(*args)
@@ -22,18 +22,33 @@ from itertools import ifilter
 import numpy as np
 
 sys.path.insert(0, os.path.dirname(__file__))
-from cuburn import render, filters, output, profile
+from cuburn import render, filters, output, profile, schedule, writer
+from cuburn import rawring
 from cuburn.genome import convert, use, db
+from cuburn.code import util, cache
 
-def save(output_module, name, rendered_frame):
+# Segments from streaming outputs, which are assembled across frames
+streamed = writer.StreamedFiles()
+
+def write(output_module, name, rendered_frame):
     out, log = output_module.encode(rendered_frame)
     for suffix, file_like in out.items():
-        with open(name + suffix, 'w') as fp:
-            fp.write(file_like.read())
+        if output_module.stream:
+            streamed.append(name + suffix, file_like)
+        else:
+            writer.write_atomic(name + suffix, file_like)
+    if output_module.stream and rendered_frame is None:
+        streamed.finish()
+    return log
+
+def print_log(log):
     for key, val in log:
         print '\n=== %s ===' % key
         print val
 
+def save(output_module, name, rendered_frame):
+    print_log(write(output_module, name, rendered_frame))
+
 def pyglet_preview(args, gprof, itr):
     import pyglet
     import pyglet.gl as gl
@@ -119,10 +134,13 @@ def main(args, prof):
     # We don't initialize a CUDA context until here. This keeps other
     # functions like --help and --print snappy.
     import pycuda.autoinit
-    rmgr = render.RenderManager()
+    util.cubin_cache = None
+    if args.cache_dir:
+        util.cubin_cache = cache.CubinCache(args.cache_dir)
+    rmgr = render.RenderManager(args.host_interp)
     rdr = render.Renderer(gnm, gprof)
 
-    def render_iter():
+    def jobs():
         m = os.path.getmtime(args.flame)
         first = True
         for name, times in frames:
@@ -132,21 +150,49 @@ def main(args, prof):
                     continue
 
             for idx, t in enumerate(times):
-                evt, buf = rmgr.queue_frame(rdr, gnm, gprof, t, first)
+                yield name, idx, len(times), t, first
                 first = False
-                while not evt.query():
-                    time.sleep(0.01)
-                    yield None
-                save(rdr.out, name, buf)
-                if args.rawfn:
-                    try:
-                        buf.tofile(args.rawfn + '.tmp')
-                        os.rename(args.rawfn + '.tmp', args.rawfn)
-                    except e:
-                        print 'Failed to write %s: %s' % (args.rawfn, e)
-                print '%s (%3d/%3d), %dms' % (name, idx, len(times), evt.time())
-                yield name, buf
-            save(rdr.out, name, None)
+
+    def queue((name, idx, nframes, t, copy)):
+        return rmgr.queue_frame(rdr, gnm, gprof, t, copy)
+
+    raw = None
+    if args.rawfn:
+        raw = rawring.RingWriter(args.rawfn, args.raw_slots)
+
+    pool = None
+    if rdr.out.parallel and args.encode_threads != 0:
+        pool = writer.EncoderPool(args.encode_threads)
+
+    def save_frame(name, buf):
+        if pool is None:
+            save(rdr.out, name, buf)
+        else:
+            # Logs come back in frame order, once each frame is written
+            for log in pool.submit(write, rdr.out, name, buf):
+                print_log(log)
+
+    def render_iter():
+        # The preview window needs control back while frames are pending
+        sched = schedule.FrameScheduler(queue, args.queue_depth)
+        for out in sched.frames(jobs(), block=not args.gfx):
+            if out is None:
+                yield None
+                continue
+            (name, idx, nframes, t, copy), evt, buf = out
+            save_frame(name, buf)
+            if raw is not None:
+                try:
+                    raw.write(buf)
+                except (IOError, OSError), e:
+                    print 'Failed to write %s: %s' % (args.rawfn, e)
+            print '%s (%3d/%3d), %dms' % (name, idx, nframes, evt.time())
+            yield name, buf
+            if idx == nframes - 1:
+                save_frame(name, None)
+        if pool is not None:
+            for log in pool.close():
+                print_log(log)
 
     if args.gfx:
         pyglet_preview(args, gprof, render_iter())
@@ -176,11 +222,24 @@ if __name__ == "__main__":
     parser.add_argument('--subdir', action='store_true',
         help="Use basename as subdirectory of out dir, instead of prefix")
     parser.add_argument('--raw', metavar='PATH', type=str, dest='rawfn',
-        help="Target file for raw buffer, to enable previews.")
+        help="Ring file for raw buffers, to enable previews "
+             "(see cuburn.rawring)")
+    parser.add_argument('--raw-slots', metavar='N', type=int, default=3,
+        help="Number of frames kept in the raw ring file (default 3)")
     parser.add_argument('--half', action='store_true',
         help='Use half-loops when converting nodes to animations')
     parser.add_argument('--print', action='store_true',
         help="Print the blended animation and exit.")
+    parser.add_argument('--cache-dir', metavar='PATH', type=str,
+        default=cache.DEFAULT_CACHE_DIR,
+        help="Directory for cached kernels ('' to disable, default %(default)s)")
+    parser.add_argument('--queue-depth', metavar='N', type=int, default=2,
+        help="Number of frames to keep queued on the device (default 2)")
+    parser.add_argument('--encode-threads', metavar='N', type=int,
+        help="Threads used to encode image outputs (default one per CPU, "
+             "0 to encode on the render thread)")
+    parser.add_argument('--host-interp', action='store_true',
+        help="Interpolate iteration parameters and palettes on the host")
     profile.add_args(parser)
 
     args = parser.parse_args()
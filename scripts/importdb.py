@@ -0,0 +1,55 @@
+#!/usr/bin/env python2
+"""
+Copy genomes into a genome database (an SQLite file or a directory),
+creating it if needed.
+
+    importdb.py [-j N] [--prefix PREFIX] DEST SRC...
+
+Each SRC is either another genome database (a directory of JSON files or
+a OneFileDB), or a flam3 XML file of any size, whose flames are converted
+to nodes on N processes and stored as PREFIX + the flame's name (or its
+index in the file, if it has none). PREFIX defaults to the file's basename
+and a slash.
+"""
+
+import os
+import sys
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from cuburn.genome import convert, db
+
+def flame_ids(prefix, nodes):
+    for i, node in enumerate(nodes):
+        name = node.get('name') or '%05d' % i
+        yield prefix + name.replace('/', '_'), node
+
+def main(args):
+    if db.is_sqlite(args.dest):
+        out = db.SQLiteDB(args.dest)
+    else:
+        out = db.FilesystemDB(args.dest)
+    for src in args.srcs:
+        base, ext = os.path.splitext(os.path.basename(src))
+        if ext in ('.flam3', '.flame'):
+            prefix = base + '/' if args.prefix is None else args.prefix
+            with open(src) as fp:
+                nodes = convert.iter_nodes(fp, args.jobs)
+                n = out.put_many(flame_ids(prefix, nodes))
+        else:
+            gdb = db.connect(src, cache_size=0)
+            n = out.put_many((id, gdb.get(id)) for id in gdb.ids())
+        print 'Imported %d genomes from %s' % (n, src)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Copy genomes into a genome database.')
+    parser.add_argument('dest', metavar='DEST',
+        help="Database to write to (an SQLite file, or a directory)")
+    parser.add_argument('srcs', metavar='SRC', nargs='+',
+        help="Genome databases or flam3 files to read from")
+    parser.add_argument('-j', '--jobs', metavar='N', type=int,
+        help="Processes used to convert flames (default one per CPU)")
+    parser.add_argument('--prefix', metavar='PREFIX',
+        help="Prefix for the IDs of converted flames")
+    main(parser.parse_args())
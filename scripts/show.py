@@ -1,26 +1,48 @@
 #!/usr/bin/env python2
+"""
+Play a random walk through a directory of rendered nodes and edges, as one
+video stream on stdout.
+
+    show.py DIR [DB]
+
+Edges are found from their file names ('src=dst'), or, if a genome
+database is given, from the links of the edges in it.
+"""
 import random, os, subprocess, sys
 
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from cuburn.genome import db
+
 class Shower(object):
-    def __init__(self):
+    def __init__(self, gdb=None):
+        self.gdb = gdb
         self.nodes = {}
         self.edges_by_src = {}
         self.had_webm = False
         self.y4m_header = None
 
     def walk_dir(self, dir):
+        rendered = {}
         for i in os.listdir(dir):
             fn = os.path.join(dir, i)
             if not i.endswith('.h264') and not i.endswith('.webm'): continue
             if i.startswith('latest'): continue
             path = i.rsplit('.', 1)[0].rsplit('_', 1)[0]
+            rendered[path] = fn
             if '=' in i:
-                src, dst = path.split('=')
-                self.edges_by_src.setdefault(src, set()).add((dst, fn))
+                if self.gdb is None:
+                    src, dst = path.split('=')
+                    self.edges_by_src.setdefault(src, set()).add((dst, fn))
             else:
                 self.nodes[path] = fn
             if i.endswith('.webm'):
                 self.had_webm = True
+        if self.gdb is not None:
+            for id, src, dst in self.gdb.edges():
+                fn = rendered.get(os.path.basename(id))
+                if fn is not None:
+                    self.edges_by_src.setdefault(os.path.basename(src),
+                            set()).add((os.path.basename(dst), fn))
 
     def output(self, path):
         sys.stderr.write(path)
@@ -58,7 +80,7 @@ class Shower(object):
                 src = None
 
 def main():
-    shower = Shower()
+    shower = Shower(db.connect(sys.argv[2]) if len(sys.argv) > 2 else None)
     while True:
         shower.walk_dir(sys.argv[1])
         shower.run_for(1000)
@@ -1,28 +1,40 @@
 #!/usr/bin/python2
+"""
+Print a random walk through a genome database, alternating node and edge
+IDs, as paths suitable for rendering one after another.
+
+    walk.py [SEED] [DB]
+
+DB may be any kind of genome database (default 'edges').
+"""
 
 import os
 import sys
 import random
 
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from cuburn.genome import db
+
 if len(sys.argv) > 1:
     random.seed(sys.argv[1])
+dbpath = sys.argv[2] if len(sys.argv) > 2 else 'edges'
+gdb = db.connect(dbpath)
+prefix = dbpath + '/' if os.path.isdir(dbpath) else ''
 
 edges = {}
-
-for i in os.listdir('edges'):
-    if '=' not in i: continue
-    src, dst = i.rsplit('.', 1)[0].split('=', 1)
-    edges.setdefault(src, set()).add((src, dst))
+for id, src, dst in gdb.edges():
+    edges.setdefault(src, set()).add((id, dst))
 
 seen = set()
 
 src = random.choice(edges.keys())
 for i in range(1000):
-    print 'edges/' + src
-    dsts = edges.get(src, set()).difference(seen)
-    if not dsts:
+    print prefix + src
+    outs = edges.get(src, set()).difference(seen)
+    if not outs:
         src = random.choice(edges.keys())
     else:
-        dst = random.choice(list(dsts))[1]
-        print 'edges/' + '='.join([src, dst])
-        src = dst
+        edge = random.choice(sorted(outs))
+        seen.add(edge)
+        print prefix + edge[0]
+        src = edge[1]